@@ -30,11 +30,66 @@ AUTH_MODE_DIRECT = False
 
 READER_PORT = int(os.environ.get('READER_PORT', 3000))
 READIUM_PORT = int(os.environ.get('READIUM_PORT', 15080))
-READIUM_BASE_URL = f"http://lenny_readium:{READIUM_PORT}"
+# Overridable to point Lenny at a stand-in (see lenny/core/standin.py)
+READIUM_BASE_URL = os.environ.get('LENNY_READIUM_URL', f"http://lenny_readium:{READIUM_PORT}").rstrip('/')
 
 LENNY_SEED = os.environ.get('LENNY_SEED')
 LOAN_LIMIT = int(os.environ.get('LENNY_LOAN_LIMIT', 10))
 
+# Patron-independent OPDS documents are cached per catalog version
+FEED_CACHE_SIZE = int(os.environ.get('LENNY_FEED_CACHE_SIZE', 512))
+FEED_CACHE_TTL = int(os.environ.get('LENNY_FEED_CACHE_TTL', 300))
+
+# Server-sent availability events: per-subscriber backlog before a slow
+# client is dropped, and the number of concurrent streams per worker
+EVENTS_QUEUE_SIZE = int(os.environ.get('LENNY_EVENTS_QUEUE_SIZE', 256))
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('LENNY_EVENTS_MAX_SUBSCRIBERS', 1000))
+EVENTS_HEARTBEAT = int(os.environ.get('LENNY_EVENTS_HEARTBEAT', 15))
+
+# Search strategy: 'auto' lets the planner choose per query, 'batched'
+# or 'intersect' force one (see lenny/core/search.py)
+SEARCH_STRATEGY = os.environ.get('LENNY_SEARCH_STRATEGY', 'auto')
+
+# Search results are cached per normalized query and catalog version
+SEARCH_CACHE_SIZE = int(os.environ.get('LENNY_SEARCH_CACHE_SIZE', 1024))
+SEARCH_CACHE_TTL = int(os.environ.get('LENNY_SEARCH_CACHE_TTL', 60))
+
+# Open Library (or a stand-in serving its API, e.g. in tests); editions
+# fetched by key are cached individually, up to EDITION_CACHE_SIZE
+OPENLIBRARY_URL = os.environ.get('LENNY_OPENLIBRARY_URL', 'https://openlibrary.org').rstrip('/')
+OPENLIBRARY_EDITION_CACHE_SIZE = int(os.environ.get('LENNY_OPENLIBRARY_EDITION_CACHE_SIZE', 20000))
+
+# Local stand-in (see lenny/core/standin.py) that `lenny.core.standin:lenny_app`
+# sends every upstream request to, including those of libraries whose
+# upstream URL isn't configurable, like the OPDS provider's searches
+STANDIN_URL = os.environ.get('LENNY_STANDIN_URL', '').rstrip('/')
+
+# Open Library resilience: the circuit breaker opens after N consecutive
+# failed or slow (> seconds) requests, for RESET seconds; responses are
+# fresh for FRESH_TTL, then served stale (and refreshed in the
+# background) for up to STALE_TTL
+OPENLIBRARY_BREAKER_FAILURES = int(os.environ.get('LENNY_OPENLIBRARY_BREAKER_FAILURES', 5))
+OPENLIBRARY_BREAKER_SLOW = float(os.environ.get('LENNY_OPENLIBRARY_BREAKER_SLOW', 3.0))
+OPENLIBRARY_BREAKER_RESET = float(os.environ.get('LENNY_OPENLIBRARY_BREAKER_RESET', 30))
+OPENLIBRARY_FRESH_TTL = int(os.environ.get('LENNY_OPENLIBRARY_FRESH_TTL', 300))
+OPENLIBRARY_STALE_TTL = int(os.environ.get('LENNY_OPENLIBRARY_STALE_TTL', 86400))
+OPENLIBRARY_STALE_SIZE = int(os.environ.get('LENNY_OPENLIBRARY_STALE_SIZE', 512))
+
+# Hedged Open Library requests: a duplicate is sent when a request is
+# slower than the recent p90, for at most HEDGE_RATE of requests
+OPENLIBRARY_HEDGE = os.environ.get('LENNY_OPENLIBRARY_HEDGE', 'false').lower() == 'true'
+OPENLIBRARY_HEDGE_RATE = float(os.environ.get('LENNY_OPENLIBRARY_HEDGE_RATE', 0.05))
+
+# Outbound Open Library requests per process: at most MAX_IN_FLIGHT at
+# once and RPS started per second (0: no rate cap), interactive first
+OPENLIBRARY_MAX_IN_FLIGHT = int(os.environ.get('LENNY_OPENLIBRARY_MAX_IN_FLIGHT', 8))
+OPENLIBRARY_RPS = float(os.environ.get('LENNY_OPENLIBRARY_RPS', 10))
+
+# Full-text index of open-access EPUBs (see lenny/core/fulltext.py);
+# 0 workers disables background indexing on upload
+FULLTEXT_PATH = os.environ.get('LENNY_FULLTEXT_PATH', 'data/fulltext.db')
+FULLTEXT_WORKERS = int(os.environ.get('LENNY_FULLTEXT_WORKERS', 0 if TESTING else 2))
+
 OPTIONS = {
     'host': HOST,
     'port': PORT,
@@ -55,8 +110,8 @@ DB_CONFIG = {
     'dbname': os.environ.get('DB_NAME', 'lenny'),
 }
 
-# Database configuration
-DB_URI = (
+# Database configuration (LENNY_DB_URI overrides, e.g. a SQLite file for load tests)
+DB_URI = os.environ.get('LENNY_DB_URI') or (
     "sqlite:///:memory:" if TESTING else
     'postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}'.format(**DB_CONFIG)
 )            
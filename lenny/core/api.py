@@ -2,14 +2,20 @@ from pathlib import Path
 from typing import Optional
 from fastapi import UploadFile, Request
 from botocore.exceptions import ClientError
+import logging
 import socket
 from pyopds2_lenny import LennyDataProvider, LennyDataRecord, build_post_borrow_publication
 from pyopds2 import Catalog, Metadata
 from pyopds2.models import Link, Navigation
-from lenny.core import db, s3, auth
-from lenny.core.utils import hash_email
-from lenny.core.models import Item, FormatEnum, Loan
-from lenny.core.openlibrary import OpenLibrary
+from lenny.core import db, s3, auth, serialize
+from lenny.core.utils import hash_email, make_etag, latest
+from lenny.core.models import Item, FormatEnum, Loan, Change, FacetCount, Edition
+from lenny.core.openlibrary import OpenLibrary, OpenLibraryRecord
+from lenny.core.cache import TTLCache
+from lenny.core.index import catalog_index
+from lenny.core.search import SearchPlanner, encode_cursor, decode_cursor
+from lenny.core.suggest import suggest_index
+from lenny.core.fulltext import fulltext_indexer, fulltext_index
 from lenny.core.exceptions import (
     ItemExistsError,
     InvalidFileError,
@@ -24,9 +30,14 @@ from lenny.core.exceptions import (
 
 from lenny.configs import (
     SCHEME, HOST, PORT, PROXY,
-    READER_PORT, LOAN_LIMIT, AUTH_MODE_DIRECT
+    READER_PORT, LOAN_LIMIT, AUTH_MODE_DIRECT,
+    FEED_CACHE_SIZE, FEED_CACHE_TTL,
+    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
 )
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
+import re
+
+logger = logging.getLogger(__name__)
 
 def _make_url(path):
     if PROXY:
@@ -49,6 +60,17 @@ class LennyAPI:
     }
     SEARCH_BATCH_SIZE = 250
     SEARCH_MAX_RESULTS = 100
+    CHANGES_LIMIT = 500
+    EVENTS_REPLAY_LIMIT = 100
+    LOOKUP_LIMIT = 100
+    SUGGEST_LIMIT = 20
+    FACET_LIMIT = 20
+    FACET_SUBJECTS_PER_ITEM = 5
+    FACET_TITLES = {"access": "Access", "format": "Format", "language": "Language", "subject": "Subject"}
+    ACCESS_TITLES = {"open": "Open access", "lendable": "Lendable"}
+    FEED_CACHE = TTLCache(maxsize=FEED_CACHE_SIZE, ttl=FEED_CACHE_TTL)
+    SEARCH_CACHE = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+    EDITION_ID_RE = re.compile(r"/(?:opds|items)/(\d+)(?:[/?]|$)|^OL(\d+)M$")
     Item = Item
     
     @classmethod
@@ -109,66 +131,122 @@ class LennyAPI:
         return None
 
     @classmethod
-    def _enrich_items(cls, items, fields=None, limit=None):
+    def _enrich_items(cls, items, fields=None, limit=None, profile=OpenLibrary.FULL):
         imap = dict((i.openlibrary_edition, i) for i in items)
         olids = [f"OL{i}M" for i in imap.keys()]
         if olids:
+            if profile == OpenLibrary.ID and not fields:
+                # Only which editions Open Library knows is needed:
+                # fetched by key (and cached), not searched
+                return dict((
+                    edition,
+                    OpenLibraryRecord(lenny=imap[edition])
+                ) for edition in OpenLibrary.get_editions(imap))
             q = f"edition_key:({' OR '.join(olids)})"
             return dict((
                 int(book.olid),
                 book + {"lenny": imap[int(book.olid)]}
-            ) for book in OpenLibrary.search(query=q, fields=fields))
+            ) for book in OpenLibrary.search(query=q, fields=fields, profile=profile))
         return {}
     
     @classmethod
-    def get_enriched_items(cls, olid=None, fields=None, offset=None, limit=None):
+    def get_enriched_items(cls, olid=None, fields=None, offset=None, limit=None, profile=OpenLibrary.FULL, **filters):
         """Returns a dict whose keys are int `olid` Open Library
         edition IDs and whose values are OpenLibraryRecords wwith an
         additional `lenny` field containing Lenny's record for this
-        item in the LennyDB
+        item in the LennyDB, optionally narrowed by catalog `filters`
+        (see `Item.filtered`). `profile` selects the Open Library
+        fields fetched (see `OpenLibrary.FIELD_PROFILES`).
         """
         limit = limit or cls.DEFAULT_LIMIT
-        items = [Item.exists(olid)] if olid else Item.get_many(offset=offset, limit=limit)
-        return cls._enrich_items(items, fields=fields)
+        if olid:
+            items = [Item.exists(olid)]
+        elif any(filters.values()):
+            items = Item.get_many_filtered(offset=offset, limit=limit, **filters)
+        else:
+            items = Item.get_many(offset=offset, limit=limit)
+        return cls._enrich_items(items, fields=fields, profile=profile)
 
     @classmethod
-    def opds_feed(cls, olid=None, offset=None, limit=None, query=None, auth_mode_direct=None, email=None):
+    def opds_feed(cls, olid=None, offset=None, limit=None, query=None, auth_mode_direct=None, email=None, **filters):
         """
-        Generate an OPDS 2.0 catalog using the opds2 Catalog.create helper
-        and the LennyDataProvider to transform Open Library metadata into
-        OPDS Publications with Lenny borrow/return links.
+        Generate an OPDS 2.0 catalog (or a single publication if `olid`)
+        as seen by patron `email`.
+
+        The patron-independent base document is shared across all
+        patrons through `FEED_CACHE`; the patron's active loans are
+        then overlaid onto it (see `overlay_loans`). `filters` narrow
+        the catalog (see `Item.filtered`).
         """
         use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
+        loans = Loan.get_active_editions(email) if email else set()
+
+        # A borrowed single item never needs its anonymous base document
+        if olid and int(olid) in loans:
+            return build_post_borrow_publication(olid, auth_mode_direct=use_direct)
 
-        # If requesting single item and user is authenticated, check for active loan
-        if olid and email:
-            if item := Item.exists(olid):
-                if item.is_login_required and Loan.exists(item.id, email):
-                    return build_post_borrow_publication(olid, auth_mode_direct=use_direct)
+        feed = cls.base_feed(
+            olid=olid, offset=offset, limit=limit, auth_mode_direct=use_direct, **filters
+        )
+        return cls.overlay_loans(feed, loans, auth_mode_direct=use_direct)
 
+    @classmethod
+    def base_feed(cls, olid=None, offset=None, limit=None, auth_mode_direct=None, **filters):
+        """Returns the cached, patron-independent OPDS catalog page (or
+        publication), building it on a miss. The cache key embeds the
+        catalog version so borrows, returns, uploads and facet count
+        changes invalidate it. A page built while Open Library failed
+        (see `OpenLibrary.tracking`) is returned but never cached.
+        """
+        use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
         limit = limit or cls.DEFAULT_LIMIT
         offset = offset or 0
-        items = cls.get_enriched_items(olid=olid, offset=offset, limit=limit)
+        item = Item.exists(olid) if olid else None
+        filters = {k: v for k, v in filters.items() if v}
+        key = (olid, offset, limit, use_direct, tuple(sorted(filters.items())), cls.catalog_version(item=item))
+        upstream = None
+
+        def build():
+            nonlocal upstream
+            with OpenLibrary.tracking() as upstream:
+                feed = cls._build_feed(
+                    olid=olid, offset=offset, limit=limit, auth_mode_direct=use_direct, **filters
+                )
+            if not upstream.degraded:
+                # Cached, so never mutated again: its publications are encoded once
+                serialize.share(feed)
+            return feed
+        return cls.FEED_CACHE.get_or_set(key, build, keep=lambda feed: not upstream.degraded)
+
+    @classmethod
+    def _build_feed(cls, olid=None, offset=0, limit=None, auth_mode_direct=False, **filters):
+        """
+        Generate an OPDS 2.0 catalog using the opds2 Catalog.create helper
+        and the LennyDataProvider to transform Open Library metadata into
+        OPDS Publications with Lenny borrow/return links. Catalogs carry
+        their facet groups (see `facet_groups`).
+        """
+        # LennyDataProvider fetches the metadata it renders itself
+        items = cls.get_enriched_items(olid=olid, offset=offset, limit=limit, profile=OpenLibrary.ID, **filters)
         if not items:
-            return LennyDataProvider.empty_catalog(limit=limit, auth_mode_direct=use_direct)
+            feed = LennyDataProvider.empty_catalog(limit=limit, auth_mode_direct=auth_mode_direct)
+            return feed if olid else cls._with_facets(feed, **filters)
         query, lenny_ids, total = cls._build_query_and_lenny_ids(items)
         lenny_ids_map = {k: v for k, v in zip(items.keys(), lenny_ids) if v is not None}
         lenny_ids_arg = lenny_ids_map if lenny_ids_map else None
         
         # Build maps for each item's encryption and availability status
-        encryption_map = {}
-        borrowable_map = {}
-        
+        lenny_items = {}
         for rec in items.values():
             lenny_item = getattr(rec, "lenny", None)
             if lenny_item is None:
                 continue
             try:
-                edition_id = int(lenny_item.openlibrary_edition)
-                encryption_map[edition_id] = lenny_item.encrypted
-                borrowable_map[edition_id] = lenny_item.is_borrowable
+                lenny_items[int(lenny_item.openlibrary_edition)] = lenny_item
             except (AttributeError, TypeError, ValueError):
                 continue
+        encryption_map = {edition: item.encrypted for edition, item in lenny_items.items()}
+        borrowable_map = cls.borrowable_map(lenny_items)
 
         search_response = LennyDataProvider.search(
             query=query,
@@ -181,12 +259,153 @@ class LennyAPI:
 
         for record in search_response.records:
             if isinstance(record, LennyDataRecord):
-                record.auth_mode_direct = use_direct
+                record.auth_mode_direct = auth_mode_direct
         
         if olid:
-            return LennyDataProvider.build_publication(search_response.records[0], auth_mode_direct=use_direct)
+            return LennyDataProvider.build_publication(search_response.records[0], auth_mode_direct=auth_mode_direct)
         
-        return LennyDataProvider.build_catalog(search_response, auth_mode_direct=use_direct)
+        feed = LennyDataProvider.build_catalog(search_response, auth_mode_direct=auth_mode_direct)
+        return cls._with_facets(cls.filter_links(feed, **filters), **filters)
+
+    @classmethod
+    def _with_facets(cls, feed, **filters):
+        if not isinstance(feed, dict):
+            return feed
+        return {**feed, "facets": cls.facet_groups(**filters)}
+
+    @classmethod
+    def facet_groups(cls, **filters):
+        """
+        OPDS 2.0 facet groups (access, format, language, subject) whose
+        `numberOfItems` come from the incrementally maintained
+        `FacetCount` table, so no request scans the catalog. Counts are
+        catalog-wide; each link narrows the current `filters`.
+        """
+        active = {k: v for k, v in filters.items() if v}
+        groups = []
+        for facet in FacetCount.FACETS:
+            links = []
+            for value, count in FacetCount.top(facet, limit=cls.FACET_LIMIT):
+                params = {k: str(v).lower() if isinstance(v, bool) else v for k, v in {**active, facet: value}.items()}
+                link = {
+                    "href": cls.make_url(f"/v1/api/opds?{urlencode(params)}"),
+                    "type": "application/opds+json",
+                    "title": cls.ACCESS_TITLES.get(value, value) if facet == "access" else value,
+                    "properties": {"numberOfItems": count},
+                }
+                if active.get(facet) == value:
+                    link["rel"] = "self"
+                links.append(link)
+            if links:
+                groups.append({"metadata": {"title": cls.FACET_TITLES[facet]}, "links": links})
+        return groups
+
+    @classmethod
+    def index_metadata(cls, items):
+        """Mirrors the title and authors Open Library has for `items`
+        (for suggestions) and stores their languages and (top) subjects
+        (for the language and subject facets), with a single Open
+        Library search. Uploads and backfills can come in bulk, so the
+        search yields to patron-facing requests (BACKGROUND priority)."""
+        imap = {item.openlibrary_edition: item for item in items}
+        if not imap:
+            return
+        query = f"edition_key:({' OR '.join(f'OL{edition}M' for edition in imap)})"
+        fields = ["language", "subject", "editions.language"]
+        with OpenLibrary.priority(OpenLibrary.BACKGROUND):
+            books = list(OpenLibrary.search(query=query, fields=fields, limit=len(imap), profile=OpenLibrary.CARD))
+        mirrored = []
+        for book in books:
+            if (item := imap.get(int(book.olid))) is None:
+                continue
+            title = book.edition.get("title") or book.get("title")
+            if title:
+                Edition.upsert(item.openlibrary_edition, title, book.get("author_name") or [])
+                mirrored.append((item.openlibrary_edition, title, book.get("author_name") or []))
+            item.set_facets("language", book.edition.get("language") or book.get("language") or [])
+            item.set_facets("subject", (book.get("subject") or [])[:cls.FACET_SUBJECTS_PER_ITEM])
+        db.commit()
+        for edition, title, authors in mirrored:
+            suggest_index.add(edition, title, authors)
+
+    @classmethod
+    def filter_links(cls, feed, **filters):
+        """Carries the catalog `filters` over to the feed's paging links."""
+        params = {k: str(v).lower() if isinstance(v, bool) else v for k, v in filters.items() if v}
+        if not params or not isinstance(feed, dict):
+            return feed
+        links = []
+        for link in feed.get("links") or []:
+            if link.get("rel") in ("first", "previous", "prev", "next", "last") and link.get("href"):
+                href = link["href"]
+                link = {**link, "href": f"{href}{'&' if '?' in href else '?'}{urlencode(params)}"}
+            links.append(link)
+        return {**feed, "links": links}
+
+    @classmethod
+    def overlay_loans(cls, feed, loans, auth_mode_direct=False):
+        """Returns `feed` with every publication the patron has on loan
+        (`loans`, a set of edition ids) swapped for its post-borrow
+        publication. The (possibly cached) `feed` is never mutated.
+        """
+        publications = feed.get("publications") if isinstance(feed, dict) else None
+        if not loans or not publications:
+            return feed
+        overlaid = []
+        for pub in publications:
+            edition_id = cls.publication_edition_id(pub)
+            if edition_id in loans:
+                pub = build_post_borrow_publication(edition_id, auth_mode_direct=auth_mode_direct)
+            overlaid.append(pub)
+        return {**feed, "publications": overlaid}
+
+    @classmethod
+    def publication_edition_id(cls, pub) -> Optional[int]:
+        """Recovers the Open Library edition id of an OPDS publication
+        dict from its `@id` or its Lenny item/opds links."""
+        metadata = pub.get("metadata") or {}
+        candidates = [metadata.get("@id") or metadata.get("identifier") or ""]
+        candidates += [link.get("href", "") for link in pub.get("links") or []]
+        for candidate in candidates:
+            if candidate and (match := cls.EDITION_ID_RE.search(str(candidate))):
+                return int(match.group(1) or match.group(2))
+        return None
+
+    @classmethod
+    def catalog_version(cls, item=None):
+        """Cheap aggregate version of the catalog (with its facet counts
+        and newest change), or of a single `item` and its loans, which
+        changes on uploads, removals, borrows and returns."""
+        if item is not None:
+            return (item.openlibrary_edition, item.encrypted, item.updated_at, Loan.version(item_id=item.id))
+        return (Item.version(), Loan.version(), FacetCount.version(), Change.newest())
+
+    @classmethod
+    def feed_validators(cls, item=None, offset=None, limit=None, auth_mode_direct=None, email=None, **filters):
+        """
+        Returns a strong (etag, last_modified) pair for the OPDS catalog
+        page, or for a single `item`'s publication, as seen by `email`.
+
+        Both are derived from cheap DB aggregates (item and loan versions
+        plus the patron's active loans) so conditional requests can be
+        answered before any Open Library or enrichment work is done.
+        The catalog's Last-Modified comes from the change log too, as
+        removing an item lowers no other timestamp's maximum.
+        """
+        use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
+        patron_loans = sorted(Loan.get_active_editions(email)) if email else []
+        version = cls.catalog_version(item=item)
+        if item is not None:
+            patron_loans = [e for e in patron_loans if e == item.openlibrary_edition]
+            scope = ("publication",)
+            last_modified = latest(item.updated_at, *version[-1][1:])
+        else:
+            (_, items_modified), loans, facets, (_, changed) = version
+            filters = tuple(sorted((k, v) for k, v in filters.items() if v))
+            scope = ("catalog", offset or 0, limit or cls.DEFAULT_LIMIT, filters)
+            last_modified = latest(items_modified, *loans[1:], facets[1], changed)
+        etag = make_etag(*scope, version, use_direct, patron_loans)
+        return etag, last_modified
 
     @classmethod
     def _build_query_and_lenny_ids(cls, items):
@@ -203,13 +422,167 @@ class LennyAPI:
         return query, lenny_ids, total
 
     @classmethod
-    def search_feed(cls, query=None, limit=None, auth_mode_direct=None):
+    def borrowable_map(cls, items):
+        """Returns {openlibrary_edition: is_borrowable} for `items`, a
+        {openlibrary_edition: Item} mapping, counting the active loans
+        of all of them in one query rather than one per item."""
+        active = Loan.active_counts([item.id for item in items.values()])
+        return {
+            edition: item.is_lendable and item.num_lendable_total - active.get(item.id, 0) > 0
+            for edition, item in items.items()
+        }
+
+    @classmethod
+    def items_feed(cls, items, title=None, auth_mode_direct=None):
+        """Builds an OPDS catalog of `items`, a {openlibrary_edition: Item}
+        mapping, with a single Open Library fetch."""
+        use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
+        title = title or cls.OPDS_TITLE
+        if not items:
+            return LennyDataProvider.empty_catalog(title=title, auth_mode_direct=use_direct)
+
+        search_response = LennyDataProvider.search(
+            query=f"edition_key:({' OR '.join(f'OL{edition}M' for edition in items)})",
+            limit=len(items),
+            lenny_ids={edition: edition for edition in items},
+            encryption_map={edition: item.encrypted for edition, item in items.items()},
+            borrowable_map=cls.borrowable_map(items),
+        )
+        for record in search_response.records:
+            if isinstance(record, LennyDataRecord):
+                record.auth_mode_direct = use_direct
+        return LennyDataProvider.build_catalog(search_response, title=title, auth_mode_direct=use_direct)
+
+    @classmethod
+    def changes_feed(cls, since=None, limit=None, auth_mode_direct=None):
+        """
+        Incremental sync feed: the publications affected by catalog
+        changes (additions, removals, borrows and returns) recorded
+        after sync token `since`, plus the token to sync from next.
+
+        Without `since`, returns no publications and the current token,
+        which a client takes after its initial full crawl of the catalog.
+        """
+        limit = min(limit or cls.CHANGES_LIMIT, cls.CHANGES_LIMIT)
+        has_more = False
+        if since is None:
+            changes, token = [], Change.latest_token()
+        else:
+            changes = Change.since(since, limit=limit + 1)
+            has_more = len(changes) > limit
+            changes = changes[:limit]
+            token = changes[-1].id if changes else since
+
+        editions = {change.openlibrary_edition for change in changes}
+        items = Item.get_editions(editions)
+        removed = sorted(editions - items.keys())
+        feed = cls.items_feed(items, title="Catalog changes", auth_mode_direct=auth_mode_direct)
+
+        return {
+            **feed,
+            "metadata": {**feed.get("metadata", {}), "syncToken": str(token), "hasMore": has_more},
+            "links": [*feed.get("links", []), {
+                "rel": "next",
+                "href": cls.make_url(f"/v1/api/opds/changes?since={token}"),
+                "type": "application/opds+json",
+            }],
+            "removed": [f"OL{edition}M" for edition in removed],
+        }
+
+    @classmethod
+    def lookup_feed(cls, editions, auth_mode_direct=None, email=None):
+        """
+        Batch lookup of up to `LOOKUP_LIMIT` publications, as seen by
+        patron `email`: items, active loans and the patron's loans are
+        each resolved with one query, and metadata with a single Open
+        Library fetch.
+
+        Returns an OPDS catalog of the publications found plus an
+        `availability` map of every requested id to one of `available`,
+        `unavailable`, `borrowed` (by this patron) or `not_found`.
+        """
+        use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
+        editions = list(dict.fromkeys(editions))[:cls.LOOKUP_LIMIT]
+        items = Item.get_editions(editions)
+        loans = Loan.get_active_editions(email) & items.keys() if email else set()
+        borrowable = cls.borrowable_map(items)
+
+        availability = {}
+        for edition in editions:
+            if (item := items.get(edition)) is None:
+                status = "not_found"
+            elif edition in loans:
+                status = "borrowed"
+            elif item.is_readable or borrowable[edition]:
+                status = "available"
+            else:
+                status = "unavailable"
+            availability[f"OL{edition}M"] = status
+
+        feed = cls.items_feed(items, title="Lookup", auth_mode_direct=use_direct)
+        return {**cls.overlay_loans(feed, loans, auth_mode_direct=use_direct), "availability": availability}
+
+    @classmethod
+    def availability_events(cls, since, editions=None):
+        """
+        Availability events for the changes recorded after sync token
+        `since`, so a reconnecting event stream can catch up. Replayed
+        events carry each item's current availability.
+
+        Returns None when more than `EVENTS_REPLAY_LIMIT` changes were
+        missed; the client should resync from the changes feed instead.
+        """
+        changes = Change.since(since, limit=cls.EVENTS_REPLAY_LIMIT + 1)
+        if len(changes) > cls.EVENTS_REPLAY_LIMIT:
+            return None
+        if editions:
+            changes = [change for change in changes if change.openlibrary_edition in editions]
+        items = Item.get_editions({change.openlibrary_edition for change in changes})
+        borrowable = cls.borrowable_map(items)
+        available = {
+            edition: item.is_readable or borrowable[edition]
+            for edition, item in items.items()
+        }
+        return [{
+            "token": change.id,
+            "edition": change.openlibrary_edition,
+            "kind": change.kind.name.lower(),
+            "available": available.get(change.openlibrary_edition, False),
+        } for change in changes]
+
+    @classmethod
+    def suggest(cls, prefix, limit=None):
+        """As-you-type title and author suggestions for `prefix`, served
+        from the in-memory `suggest_index` (no Open Library request)."""
+        limit = min(limit or 10, cls.SUGGEST_LIMIT)
+        suggestions = suggest_index.refresh().suggest(prefix, limit=limit)
+        for suggestion in suggestions:
+            if suggestion["type"] == "title":
+                suggestion["href"] = cls.make_url(f"/v1/api/opds/{suggestion['edition']}")
+                suggestion["edition"] = f"OL{suggestion['edition']}M"
+            else:
+                suggestion["href"] = cls.make_url(f"/v1/api/opds/search?{urlencode({'query': suggestion['author']})}")
+        return suggestions
+
+    @classmethod
+    def search_feed(cls, query=None, limit=None, auth_mode_direct=None, cursor=None):
         """
         Search Lenny's catalog via OpenLibrary, constrained to local edition IDs.
 
-        Chunks all local edition IDs into batches, queries OL with
-        '{query} AND edition_key:(OL1M OR OL2M OR ...)' per batch,
-        and stops once enough results are collected.
+        A `SearchPlanner` either chunks the local edition IDs into
+        batches, querying OL with '{query} AND edition_key:(OL1M OR ...)'
+        per batch, or runs the unfiltered query and intersects its
+        editions with the catalog, whichever it estimates is cheaper.
+        Edition ids and their flags come from the in-memory `catalog_index`.
+
+        Results are paged: each page links to the next with an opaque
+        `cursor` recording where the planner stopped, so a deep page
+        costs one page of upstream work. Raises ValueError for an
+        invalid `cursor`.
+
+        Results are cached in `SEARCH_CACHE` per normalized query, cursor,
+        limit, auth mode and catalog version; concurrent identical
+        searches wait for a single computation.
         """
         use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
         limit = min(limit or cls.DEFAULT_LIMIT, cls.SEARCH_MAX_RESULTS)
@@ -220,60 +593,95 @@ class LennyAPI:
             )
 
         query = query.strip()
-        all_items = Item.get_all()
-        if not all_items:
+        index = catalog_index.refresh()
+        if not len(index):
             return LennyDataProvider.empty_catalog(
                 title=f"Search results for: {query}", auth_mode_direct=use_direct
             )
 
-        olid_list = list(all_items.keys())
-        batches = [
-            olid_list[i:i + cls.SEARCH_BATCH_SIZE]
-            for i in range(0, len(olid_list), cls.SEARCH_BATCH_SIZE)
-        ]
-
-        collected = []
-        for batch in batches:
-            edition_keys = " OR ".join(f"OL{olid}M" for olid in batch)
-            ol_query = f"{query} AND edition_key:({edition_keys})"
+        normalized = cls.normalize_query(query)
+        position = decode_cursor(cursor, normalized) if cursor else None
+        key = (normalized, cursor, limit, use_direct, index.token)
+        return cls.SEARCH_CACHE.get_or_set(key, lambda: cls._search_catalog(
+            index, query, limit, use_direct, position=position
+        ))
 
-            for record in OpenLibrary.search(query=ol_query, limit=cls.SEARCH_BATCH_SIZE):
-                collected.append(record)
-                if len(collected) >= limit:
-                    break
+    @classmethod
+    def normalize_query(cls, query: str) -> str:
+        """Whitespace insensitive form of a search query. Case is kept:
+        Open Library's search treats "a OR b" and "a or b" differently."""
+        return " ".join(query.split())
 
-            if len(collected) >= limit:
-                break
+    @classmethod
+    def _search_catalog(cls, index, query, limit, use_direct, position=None):
+        planner = SearchPlanner(index, batch_size=cls.SEARCH_BATCH_SIZE)
+        _, editions, resume = planner.search(query, limit, cursor=position)
+        feed = cls._editions_feed(index, editions, f"Search results for: {query}", limit, use_direct)
+        if not editions or resume is None or not isinstance(feed, dict):
+            return feed
+        params = {"query": query, "cursor": encode_cursor(resume, cls.normalize_query(query))}
+        if use_direct:
+            params["auth_mode"] = "direct"
+        return cls._with_next_link(feed, f"/v1/api/opds/search?{urlencode(params)}")
 
-        if not collected:
+    @classmethod
+    def fulltext_search_feed(cls, query=None, limit=None, offset=None, auth_mode_direct=None):
+        """
+        Searches inside the text of open-access books (see
+        lenny/core/fulltext.py) for the phrase `query`. The feed lists the
+        matching editions, most matches first, with a `matches` map of
+        each edition to its match count and the character offsets and
+        snippets of its first matches.
+        """
+        use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
+        limit = min(limit or cls.DEFAULT_LIMIT, cls.SEARCH_MAX_RESULTS)
+        offset = offset or 0
+        if not query or not query.strip():
             return LennyDataProvider.empty_catalog(
-                title=f"Search results for: {query}", auth_mode_direct=use_direct
+                title="Search results", auth_mode_direct=use_direct
             )
 
-        matched_query_parts = []
-        lenny_ids_map = {}
-        encryption_map = {}
-        borrowable_map = {}
-
-        for record in collected:
-            try:
-                olid_int = int(record.olid)
-            except (AttributeError, ValueError, TypeError):
-                continue
+        query = query.strip()
+        index = catalog_index.refresh()
+        total, hits = fulltext_index.search(
+            query, limit=limit, offset=offset,
+            within=lambda edition: edition in index and not index.is_encrypted(edition)
+        )
+        editions = [hit["edition"] for hit in hits]
+        feed = cls._editions_feed(index, editions, f"Full-text search results for: {query}", limit, use_direct)
+        if not editions or not isinstance(feed, dict):
+            return feed
+        feed = {**feed, "matches": {
+            f"OL{hit['edition']}M": {"count": hit["count"], "matches": hit["matches"]} for hit in hits
+        }}
+        if offset + limit >= total:
+            return feed
+        params = {"query": query, "fulltext": "true", "offset": offset + limit}
+        if use_direct:
+            params["auth_mode"] = "direct"
+        return cls._with_next_link(feed, f"/v1/api/opds/search?{urlencode(params)}")
 
-            item = all_items.get(olid_int)
-            if not item:
-                continue
+    @classmethod
+    def _with_next_link(cls, feed, path):
+        links = [link for link in feed.get("links") or [] if link.get("rel") != "next"]
+        links.append({
+            "rel": "next",
+            "href": cls.make_url(path),
+            "type": "application/opds+json",
+        })
+        return {**feed, "links": links}
 
-            matched_query_parts.append(f"OL{olid_int}M")
-            lenny_ids_map[olid_int] = olid_int
-            encryption_map[olid_int] = item.encrypted
-            borrowable_map[olid_int] = item.is_borrowable
+    @classmethod
+    def _editions_feed(cls, index, editions, title, limit, use_direct):
+        """OPDS feed of catalog `editions`, with encryption and
+        availability taken from the catalog `index`."""
+        if not editions:
+            return LennyDataProvider.empty_catalog(title=title, auth_mode_direct=use_direct)
 
-        if not matched_query_parts:
-            return LennyDataProvider.empty_catalog(
-                title=f"Search results for: {query}", auth_mode_direct=use_direct
-            )
+        matched_query_parts = [f"OL{olid_int}M" for olid_int in editions]
+        lenny_ids_map = {olid_int: olid_int for olid_int in editions}
+        encryption_map = {olid_int: index.is_encrypted(olid_int) for olid_int in editions}
+        borrowable_map = {olid_int: index.is_borrowable(olid_int) for olid_int in editions}
 
         # Re-query via LennyDataProvider to get properly structured records
         provider_query = f"edition_key:({' OR '.join(matched_query_parts)})"
@@ -291,7 +699,7 @@ class LennyAPI:
 
         return LennyDataProvider.build_catalog(
             search_response,
-            title=f"Search results for: {query}",
+            title=title,
             auth_mode_direct=use_direct,
         )
 
@@ -406,10 +814,18 @@ class LennyAPI:
                 )
                 db.add(item)
                 db.commit()
-                return item
             except Exception as e:
                 db.rollback()
                 raise DatabaseInsertError(f"Failed to add item to db: {str(e)}.")
+            try:
+                cls.index_metadata([item])
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"[Metadata] Could not index metadata of {openlibrary_edition}: {e}")
+            if not encrypt and formats & FormatEnum.EPUB.value:
+                # A new upload: the text of a removed earlier one is stale
+                fulltext_indexer.schedule(openlibrary_edition, replace=True)
+            return item
 
     @classmethod
     def get_borrowed_items(cls, email: str):
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+    Circuit breaker for Lenny's upstream calls
+
+    After `failures` consecutive failed (or slower than `slow`
+    seconds) calls, the breaker opens: calls are refused at once for
+    `reset_timeout` seconds instead of each waiting out a timeout.
+    Then a single trial call is let through (half-open); its success
+    closes the breaker, its failure opens it again.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import threading
+import time
+from typing import Optional
+
+from lenny.core.metrics import metrics
+
+
+class CircuitBreaker:
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failures: int = 5, slow: Optional[float] = None, reset_timeout: float = 30):
+        self.name = name
+        self.failures = failures
+        self.slow = slow
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            metrics.incr("breaker.transition", breaker=self.name, state=state)
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now. When half-open, only the
+        first caller gets through, as the trial."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._trial:
+                    return False
+                self._trial = True
+            return True
+
+    def record(self, ok: bool, latency: Optional[float] = None):
+        """Records the outcome of an allowed call."""
+        if ok and self.slow is not None and latency is not None and latency > self.slow:
+            ok = False
+        with self._lock:
+            self._trial = False
+            if ok:
+                self.consecutive = 0
+                self._set_state(self.CLOSED)
+                return
+            self.consecutive += 1
+            if self.state == self.HALF_OPEN or self.consecutive >= self.failures:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def reset(self):
+        with self._lock:
+            self.consecutive = 0
+            self._trial = False
+            self._set_state(self.CLOSED)
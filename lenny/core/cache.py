@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+    In-process caches for Lenny
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key: the first caller
+    runs the function, the others block until it finishes and share
+    its result (or exception). Nothing is kept once the call returns.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class TTLCache:
+    """A small thread-safe LRU cache whose entries expire `ttl`
+    seconds after being set (never, if `ttl` is None).
+
+    Keys are expected to embed whatever version they depend on
+    (e.g. the catalog version) so stale entries simply stop being
+    requested and age out of the LRU.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> Any:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any],
+                   keep: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Returns the cached value for `key`, computing and caching
+        it with `factory()` on a miss. Concurrent misses for the same
+        key are coalesced into a single `factory()` call. A computed
+        value for which `keep(value)` is false is returned, not cached."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._flight.do(key, lambda: self._fill(key, factory, keep))
+        return value
+
+    def _fill(self, key: Hashable, factory: Callable[[], Any], keep=None) -> Any:
+        # A call that finished just before this one may have filled it
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = factory()
+        return self.set(key, value) if keep is None or keep(value) else value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+    Response compression for Lenny's OPDS/JSON routes
+
+    Negotiates gzip or Brotli from `Accept-Encoding` and keeps every
+    encoded variant alongside the serialized body it was made from,
+    so each version of each cached page is compressed at most once.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import gzip
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from lenny.core.cache import TTLCache
+from lenny.configs import FEED_CACHE_SIZE, FEED_CACHE_TTL
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - Brotli is optional
+    brotli = None
+
+# Bodies smaller than this are cheaper to send than to compress
+MIN_SIZE = 1024
+
+# Server preference when a client accepts several codings equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Serialized (and lazily compressed) bodies keyed by (route, media
+# type, strong ETag): an ETag alone only identifies a version within
+# one resource
+BODIES = TTLCache(maxsize=FEED_CACHE_SIZE, ttl=FEED_CACHE_TTL)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Returns the preferred supported coding acceptable to the client
+    according to its `Accept-Encoding` header, or None for identity."""
+    if not accept_encoding:
+        return None
+    qvalues = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        qvalues[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in ENCODINGS:
+        q = qvalues.get(coding, qvalues.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=9)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    raise ValueError(f"Unsupported content-coding '{encoding}'")
+
+
+def iter_compress(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compresses a stream of chunks on the fly (for streamed feeds,
+    which are never cached)."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if out := process(chunk):
+            yield out
+    yield finish()
+
+
+def variant_etag(etag: Optional[str], encoding: Optional[str]) -> Optional[str]:
+    """Strong ETags must differ between content-codings of a resource,
+    so `"abc"` becomes `"abc-gzip"` for its gzip variant."""
+    if not etag or not encoding:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_variant(etag: str) -> str:
+    for encoding in ("br", "gzip"):
+        if etag.endswith(f'-{encoding}"'):
+            return etag[:-len(encoding) - 2] + '"'
+    return etag
+
+
+class CompressedBody:
+    """A serialized response body plus its compressed variants, each
+    computed on first request."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.variants = {}
+
+    def coding(self, encoding: Optional[str]) -> Optional[str]:
+        """The content-coding `encode` applies for a negotiated `encoding`:
+        none for bodies under `MIN_SIZE`."""
+        return encoding if encoding and len(self.body) >= MIN_SIZE else None
+
+    def encode(self, encoding: Optional[str]) -> tuple[bytes, Optional[str]]:
+        """Returns (content, applied encoding) for a negotiated `encoding`,
+        leaving bodies under `MIN_SIZE` uncompressed."""
+        if not (encoding := self.coding(encoding)):
+            return self.body, None
+        if encoding not in self.variants:
+            self.variants[encoding] = compress(self.body, encoding)
+        return self.variants[encoding], encoding
@@ -1,8 +1,9 @@
 
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
 from lenny.configs import DB_URI, DEBUG
+from lenny.core.metrics import metrics
 
 logger = logging.getLogger(__name__)
 # Only use client_encoding for PostgreSQL, not SQLite
@@ -13,10 +14,15 @@ engine = create_engine(DB_URI, **engine_kwargs)
 session = scoped_session(sessionmaker(
     bind=engine, autocommit=False, autoflush=False))
 
+@event.listens_for(engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    metrics.incr("db.queries")
+
 class LennyBase:
     @classmethod
     def get_many(cls, offset=None, limit=None):
-        return session.query(cls).offset(offset).limit(limit).all()
+        # Offset pages are only stable in a fixed order
+        return session.query(cls).order_by(*cls.__mapper__.primary_key).offset(offset).limit(limit).all()
 
 Base = declarative_base(cls=LennyBase)
 
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""
+    Availability events for Lenny
+
+    An in-process pub/sub broker for availability changes (borrows,
+    returns, items added or removed), consumed by the SSE endpoint.
+
+    Events are staged by the change-log mapper events in models.py and
+    only published once their transaction commits:
+
+    - On PostgreSQL they are sent with `NOTIFY` inside the transaction,
+      so every worker (this one included) receives them through its own
+      `LISTEN` connection once the commit lands.
+    - Elsewhere (e.g. sqlite in tests) they are kept on the session and
+      published to this process's subscribers after commit.
+
+    Each subscriber has a bounded queue. A subscriber that falls
+    `EVENTS_QUEUE_SIZE` events behind is dropped rather than buffered
+    without limit; it reconnects with `Last-Event-ID` and catches up
+    from the change log.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from lenny.configs import EVENTS_QUEUE_SIZE, EVENTS_MAX_SUBSCRIBERS
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "lenny_availability"
+PENDING = "lenny.events"
+
+# Placed on a subscriber's queue when it has been dropped
+DROPPED = object()
+
+
+class TooManySubscribersError(Exception):
+    pass
+
+
+class Subscriber:
+    """One event stream consumer, bound to the event loop serving it."""
+
+    def __init__(self, loop, maxsize: int = EVENTS_QUEUE_SIZE, editions=None):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.editions = set(editions) if editions else None
+        self.dropped = False
+
+    def wants(self, payload: dict) -> bool:
+        return self.editions is None or payload.get("edition") in self.editions
+
+    def offer(self, payload: dict):
+        """Enqueues `payload`; runs on the subscriber's event loop."""
+        if self.dropped or not self.wants(payload):
+            return
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Too slow: discard its backlog and tell it to resync
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(DROPPED)
+
+    async def get(self, timeout: Optional[float] = None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+
+    def __init__(self, max_subscribers: int = EVENTS_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    @contextmanager
+    def subscribe(self, editions=None, maxsize: int = EVENTS_QUEUE_SIZE):
+        subscriber = Subscriber(asyncio.get_running_loop(), maxsize=maxsize, editions=editions)
+        with self._lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                raise TooManySubscribersError
+            self.subscribers.add(subscriber)
+        self.listen()
+        try:
+            yield subscriber
+        finally:
+            with self._lock:
+                self.subscribers.discard(subscriber)
+
+    def publish(self, payload: dict):
+        """Delivers `payload` to every local subscriber. Safe to call
+        from any thread."""
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, payload)
+            except RuntimeError:  # its loop has closed
+                with self._lock:
+                    self.subscribers.discard(subscriber)
+
+    def listen(self):
+        """Starts relaying NOTIFYs from other workers, on PostgreSQL."""
+        from lenny.core.db import engine
+        if engine.dialect.name != "postgresql":
+            return
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = PgListener(self, engine)
+                self._listener.start()
+
+
+class PgListener(threading.Thread):
+    """Holds one `LISTEN` connection per worker and republishes the
+    notifications it receives to the local broker."""
+
+    POLL_INTERVAL = 5
+    RETRY_INTERVAL = 5
+
+    def __init__(self, broker, engine):
+        super().__init__(name="lenny-events-listener", daemon=True)
+        self.broker = broker
+        self.engine = engine
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception as e:
+                logger.warning(f"[Events] LISTEN connection lost: {e}")
+            time.sleep(self.RETRY_INTERVAL)
+
+    def listen(self):
+        connection = self.engine.raw_connection()
+        try:
+            dbapi = connection.driver_connection
+            dbapi.autocommit = True
+            with dbapi.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            while True:
+                if select.select([dbapi], [], [], self.POLL_INTERVAL) == ([], [], []):
+                    continue
+                dbapi.poll()
+                while dbapi.notifies:
+                    notify = dbapi.notifies.pop(0)
+                    try:
+                        self.broker.publish(json.loads(notify.payload))
+                    except ValueError:
+                        logger.warning(f"[Events] Ignoring malformed payload: {notify.payload!r}")
+        finally:
+            connection.invalidate()
+
+
+broker = Broker()
+
+
+def stage(connection, session: Optional[Session], payload: dict):
+    """Queues `payload` for publication when the current transaction
+    commits. Called from mapper events, inside the flush."""
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": json.dumps(payload)}
+        )
+    elif session is not None:
+        session.info.setdefault(PENDING, []).append(payload)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    for payload in session.info.pop(PENDING, []):
+        broker.publish(payload)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop(PENDING, None)
+
+
+def format_event(payload: dict) -> str:
+    """Encodes `payload` as a server-sent `availability` event."""
+    return f"id: {payload['token']}\nevent: availability\ndata: {json.dumps(payload)}\n\n"
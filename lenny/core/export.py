@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+    Static OPDS catalog export for Lenny
+
+    Writes the anonymous catalog as precomputed, precompressed page
+    files plus an `index.json`, to a local directory or an s3 prefix,
+    so nginx (or a CDN) can serve catalog browsing without Python:
+
+        <target>/index.json
+        <target>/offset-0-limit-50.json, offset-0-limit-50.json.gz, offset-0-limit-50.json.br
+        <target>/offset-50-limit-50.json ...
+
+    Pages are named after the `offset` and `limit` of
+    `/v1/api/opds?offset=...&limit=...`, so nginx only serves a page
+    exported at the requested page size, see
+    docker/nginx/snippets/static-catalog.conf.
+
+    Exports are incremental: each page records the version of the
+    items and loans it was built from, and of the facet counts every
+    page carries, and only pages whose inputs changed are rebuilt and
+    rewritten. A page built while Open Library failed is neither
+    written nor recorded, so the next export retries it.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+
+from lenny.core import s3, compression, serialize
+from lenny.core.api import LennyAPI
+from lenny.core.db import session as db
+from lenny.core.models import Item, Loan, FacetCount
+from lenny.core.openlibrary import OpenLibrary
+from lenny.core.utils import make_etag
+
+logger = logging.getLogger(__name__)
+
+INDEX = "index.json"
+CONTENT_TYPE = "application/opds+json"
+
+
+class LocalTarget:
+    """Export destination on the local filesystem."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def read(self, name) -> Optional[bytes]:
+        try:
+            return (self.path / name).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name, data, content_type=CONTENT_TYPE, content_encoding=None):
+        # Write then rename, so nginx never serves a partial page
+        tmp = self.path / f".{name}.tmp"
+        tmp.write_bytes(data)
+        tmp.replace(self.path / name)
+
+    def delete(self, name):
+        (self.path / name).unlink(missing_ok=True)
+
+
+class S3Target:
+    """Export destination under a prefix of an s3 bucket."""
+
+    def __init__(self, bucket=None, prefix="opds"):
+        self.bucket = bucket or s3.BOOKSHELF_BUCKET
+        self.prefix = prefix.strip("/")
+
+    def key(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def read(self, name) -> Optional[bytes]:
+        try:
+            return s3.get_object(Bucket=self.bucket, Key=self.key(name))["Body"].read()
+        except s3.exceptions.NoSuchKey:
+            return None
+
+    def write(self, name, data, content_type=CONTENT_TYPE, content_encoding=None):
+        extra = {"ContentEncoding": content_encoding} if content_encoding else {}
+        s3.put_object(Bucket=self.bucket, Key=self.key(name), Body=data, ContentType=content_type, **extra)
+
+    def delete(self, name):
+        s3.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+
+def make_target(destination: str):
+    """`s3://bucket/prefix` or a local directory path."""
+    if destination.startswith("s3://"):
+        bucket, _, prefix = destination[len("s3://"):].partition("/")
+        return S3Target(bucket=bucket or None, prefix=prefix)
+    return LocalTarget(destination)
+
+
+class CatalogExporter:
+
+    SUFFIXES = {"gzip": ".gz", "br": ".br"}
+
+    def __init__(self, target, page_size: Optional[int] = None, auth_mode_direct: bool = False):
+        self.target = make_target(target) if isinstance(target, str) else target
+        self.page_size = page_size or LennyAPI.DEFAULT_LIMIT
+        self.auth_mode_direct = auth_mode_direct
+
+    def page_name(self, offset: int) -> str:
+        return f"offset-{offset}-limit-{self.page_size}.json"
+
+    def load_index(self) -> dict:
+        raw = self.target.read(INDEX)
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def page_versions(self) -> list:
+        """Returns one version per page, computed from lightweight item
+        rows and grouped loan stats (a few queries, no ORM objects), in
+        the same order `Item.get_many` pages through the catalog."""
+        rows = db.query(Item.id, Item.openlibrary_edition, Item.encrypted, Item.updated_at).order_by(Item.id).all()
+        loans = Loan.version_map()
+        facets = FacetCount.version()
+        versions = []
+        for start in range(0, max(len(rows), 1), self.page_size):
+            page = rows[start:start + self.page_size]
+            versions.append(make_etag(
+                self.page_size, self.auth_mode_direct, facets,
+                [tuple(row) + (loans.get(row[0]),) for row in page]
+            ))
+        return versions
+
+    def export_page(self, offset: int) -> Optional[str]:
+        """Builds one catalog page and writes it with its compressed
+        variants. Returns the digest of its content, or None, writing
+        nothing, if Open Library failed while it was built (see
+        `OpenLibrary.tracking`)."""
+        with OpenLibrary.tracking() as upstream:
+            feed = LennyAPI.base_feed(offset=offset, limit=self.page_size, auth_mode_direct=self.auth_mode_direct)
+        if upstream.degraded:
+            return None
+        body = serialize.encode_feed(feed)
+        name = self.page_name(offset)
+        self.target.write(name, body)
+        for encoding in compression.ENCODINGS:
+            self.target.write(
+                name + self.SUFFIXES[encoding],
+                compression.compress(body, encoding),
+                content_encoding=encoding,
+            )
+        return hashlib.sha1(body).hexdigest()
+
+    def export(self, force: bool = False) -> dict:
+        """Brings the target up to date and returns the new index. Pages
+        whose item/loan inputs are unchanged are left untouched."""
+        index = self.load_index()
+        previous = {page["offset"]: page for page in index.get("pages", [])}
+        written = {page["href"] for page in index.get("pages", [])}
+        if index.get("page_size") != self.page_size or index.get("auth_mode_direct") != self.auth_mode_direct:
+            previous = {}
+
+        pages = []
+        changed = force or not index
+        for n, version in enumerate(self.page_versions()):
+            offset = n * self.page_size
+            page = previous.get(offset)
+            if force or not page or page.get("version") != version:
+                logger.info(f"[Export] Writing catalog page at offset {offset}")
+                if (digest := self.export_page(offset)) is None:
+                    # Any previous page stays, under its old version
+                    logger.warning(f"[Export] Open Library failing, page at offset {offset} left for the next run")
+                    if page:
+                        pages.append(page)
+                    continue
+                changed = True
+                page = {
+                    "offset": offset,
+                    "href": self.page_name(offset),
+                    "version": version,
+                    "digest": digest,
+                }
+            pages.append(page)
+
+        # Pages past the end of the catalog, or exported at another page size
+        for name in written - {page["href"] for page in pages}:
+            changed = True
+            for suffix in ("", *self.SUFFIXES.values()):
+                self.target.delete(name + suffix)
+
+        if not changed:
+            return index
+
+        index = {
+            "title": LennyAPI.OPDS_TITLE,
+            "generated": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "page_size": self.page_size,
+            "auth_mode_direct": self.auth_mode_direct,
+            "encodings": list(compression.ENCODINGS),
+            "pages": pages,
+        }
+        self.target.write(INDEX, json.dumps(index, indent=2).encode("utf-8"), content_type="application/json")
+        return index
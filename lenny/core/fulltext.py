@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+
+"""
+    Full-text search inside Lenny's open-access books
+
+    Open-access EPUBs are read out of s3 once, after upload (or by
+    `scripts/index_fulltext.py` for older items). Their spine XHTML is
+    parsed in reading order straight from the zip, in a process pool so
+    that CPU-bound parsing never holds the API workers' GIL.
+
+    The text feeds a local, on-disk inverted index (an sqlite file at
+    `FULLTEXT_PATH`, shared by the API workers) with positional
+    postings: for every term and edition, the positions of the term in
+    the book. Phrase queries are answered by intersecting the postings
+    of their terms, then checking positions are consecutive; token
+    offsets and the (compressed) text are kept per book, so every match
+    comes with its character offsets and a snippet.
+
+    Indexing is incremental and resumable: each book is committed in
+    its own transaction and recorded in `documents` (failures too), so
+    books already indexed are never re-read and an interrupted backfill
+    picks up where it stopped.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import logging
+import multiprocessing
+import posixpath
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zipfile
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+from lenny.configs import FULLTEXT_PATH, FULLTEXT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w+")
+
+CONTAINER = "META-INF/container.xml"
+NS = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+}
+
+# Guards against zip bombs and absurdly large books
+MAX_DOCUMENT_BYTES = 16 * 1024 * 1024
+MAX_TEXT_CHARS = 16 * 1024 * 1024
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def term(word: str) -> str:
+    """Index form of a word: casefolded, without accents."""
+    if word.isascii():
+        return word.lower()
+    word = unicodedata.normalize("NFKD", word)
+    return "".join(c for c in word if not unicodedata.combining(c)).casefold()
+
+
+def terms(text: str) -> list[str]:
+    return [term(word) for word in _WORD.findall(text or "")]
+
+
+class _TextParser(HTMLParser):
+    """Collects the text of an XHTML document, a newline per block."""
+
+    SKIP = {"script", "style", "head", "title"}
+    BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "section"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        text = "".join(self.parts)
+        return "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+
+
+def spine(zf: zipfile.ZipFile) -> list[str]:
+    """Zip paths of the EPUB's (X)HTML spine documents, in reading order."""
+    try:
+        container = ElementTree.fromstring(zf.read(CONTAINER))
+        rootfile = container.find(".//container:rootfile", NS).get("full-path")
+        package = ElementTree.fromstring(zf.read(rootfile))
+    except (KeyError, AttributeError, ElementTree.ParseError) as e:
+        raise ExtractionError(f"Not a readable EPUB package: {e}")
+    base = posixpath.dirname(rootfile)
+    manifest = {item.get("id"): item for item in package.iterfind("opf:manifest/opf:item", NS)}
+    paths = []
+    for itemref in package.iterfind("opf:spine/opf:itemref", NS):
+        item = manifest.get(itemref.get("idref"))
+        if item is None or "html" not in (item.get("media-type") or ""):
+            continue
+        paths.append(posixpath.normpath(posixpath.join(base, unquote(item.get("href") or ""))))
+    return paths
+
+
+def extract_text(data: bytes) -> str:
+    """The text of an EPUB, its spine documents in reading order."""
+    try:
+        zf = zipfile.ZipFile(BytesIO(data))
+    except zipfile.BadZipFile as e:
+        raise ExtractionError(str(e))
+    chapters, size = [], 0
+    with zf:
+        for path in spine(zf):
+            try:
+                with zf.open(path) as fp:
+                    raw = fp.read(MAX_DOCUMENT_BYTES)
+            except KeyError:
+                continue
+            parser = _TextParser()
+            parser.feed(raw.decode("utf-8", errors="replace"))
+            parser.close()
+            chapter = parser.text()
+            chapters.append(chapter)
+            size += len(chapter)
+            if size >= MAX_TEXT_CHARS:
+                break
+    return "\n\n".join(chapters)[:MAX_TEXT_CHARS]
+
+
+def analyze(data: bytes) -> dict:
+    """Extracts and tokenizes an EPUB. Runs in the process pool, so it
+    takes and returns only plain, picklable values: the text, the
+    start/end character offset of every token, and the positions of
+    each term."""
+    text = extract_text(data)
+    starts, ends, postings = array("I"), array("I"), {}
+    for position, match in enumerate(_WORD.finditer(text)):
+        starts.append(match.start())
+        ends.append(match.end())
+        postings.setdefault(term(match.group()), array("I")).append(position)
+    return {
+        "text": text,
+        "starts": starts.tobytes(),
+        "ends": ends.tobytes(),
+        "postings": {t: positions.tobytes() for t, positions in postings.items()},
+    }
+
+
+class FullTextIndex:
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS documents (
+            edition INTEGER PRIMARY KEY,
+            tokens INTEGER NOT NULL,
+            starts BLOB,
+            ends BLOB,
+            text BLOB,
+            error TEXT,
+            indexed_at REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS postings (
+            term TEXT NOT NULL,
+            edition INTEGER NOT NULL,
+            positions BLOB NOT NULL,
+            PRIMARY KEY (term, edition)
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_postings_edition ON postings (edition)",
+    )
+
+    SNIPPET_CONTEXT = 80
+    SNIPPETS_PER_BOOK = 3
+
+    def __init__(self, path=FULLTEXT_PATH):
+        self.path = str(path)
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """A new connection (sqlite connections aren't shared across
+        threads); the schema is created on first use."""
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        with self._lock:
+            if not self._ready:
+                # WAL: API workers keep reading while a book is written
+                conn.execute("PRAGMA journal_mode=WAL")
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+                conn.commit()
+                self._ready = True
+        return conn
+
+    def indexed(self, editions: Optional[Iterable[int]] = None) -> set:
+        """The editions already indexed (or that failed to), among
+        `editions` if given."""
+        conn = self.connect()
+        try:
+            done = {row[0] for row in conn.execute("SELECT edition FROM documents")}
+        finally:
+            conn.close()
+        return done if editions is None else done & set(editions)
+
+    def missing(self, editions: Iterable[int]) -> list:
+        done = self.indexed()
+        return [edition for edition in editions if edition not in done]
+
+    def add(self, edition: int, analysis: dict):
+        """Stores one book's `analyze` output, replacing any previous
+        version, in a single transaction."""
+        text = analysis["text"].encode("utf-8")
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM postings WHERE edition = ?", (edition,))
+                conn.executemany(
+                    "INSERT INTO postings (term, edition, positions) VALUES (?, ?, ?)",
+                    ((t, edition, positions) for t, positions in analysis["postings"].items())
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (edition, tokens, starts, ends, text, error, indexed_at) "
+                    "VALUES (?, ?, ?, ?, ?, NULL, ?)",
+                    (edition, len(analysis["starts"]) // 4, zlib.compress(analysis["starts"]),
+                     zlib.compress(analysis["ends"]), zlib.compress(text), time.time())
+                )
+        finally:
+            conn.close()
+
+    def fail(self, edition: int, error: str):
+        """Records that `edition` could not be indexed, so it isn't
+        re-read on every pass (see `retry_failed`)."""
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (edition, tokens, error, indexed_at) VALUES (?, 0, ?, ?)",
+                    (edition, error[:500], time.time())
+                )
+        finally:
+            conn.close()
+
+    def retry_failed(self) -> int:
+        conn = self.connect()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM documents WHERE error IS NOT NULL").rowcount
+        finally:
+            conn.close()
+
+    def remove(self, edition: int):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM postings WHERE edition = ?", (edition,))
+                conn.execute("DELETE FROM documents WHERE edition = ?", (edition,))
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _phrases(positions: list) -> list:
+        """Positions where the terms of a phrase occur consecutively,
+        given each term's sorted positions in one book."""
+        following = [set(p) for p in positions[1:]]
+        return [p for p in positions[0] if all(p + i in s for i, s in enumerate(following, 1))]
+
+    def search(self, query: str, limit: int = 20, offset: int = 0, within: Optional[Callable[[int], bool]] = None) -> tuple[int, list]:
+        """Books containing the phrase `query`, most matches first.
+        Returns (total, page) where each hit of the page is
+        {edition, count, matches: [{start, end, snippet, highlight}]};
+        `start`/`end` are character offsets in the book's text and
+        `highlight` those of the match within `snippet`. `within`
+        restricts the results (e.g. to the current catalog)."""
+        words = terms(query)
+        if not words:
+            return 0, []
+        conn = self.connect()
+        try:
+            postings = {}
+            # Rarest terms first, so the candidate set shrinks fastest
+            for word in sorted(set(words), key=lambda w: self._frequency(conn, w)):
+                rows = conn.execute(
+                    "SELECT edition, positions FROM postings WHERE term = ?", (word,)
+                ).fetchall()
+                if postings:
+                    candidates = postings[next(iter(postings))].keys()
+                    rows = [row for row in rows if row[0] in candidates]
+                if not rows:
+                    return 0, []
+                postings[word] = dict(rows)
+            candidates = set.intersection(*(set(p) for p in postings.values()))
+            hits = []
+            for edition in candidates:
+                if within is not None and not within(edition):
+                    continue
+                found = self._phrases([array("I", postings[word][edition]) for word in words])
+                if found:
+                    hits.append((edition, len(words), found))
+            hits.sort(key=lambda hit: (-len(hit[2]), hit[0]))
+            page = [self._snippets(conn, *hit) for hit in hits[offset:offset + limit]]
+        finally:
+            conn.close()
+        return len(hits), page
+
+    @staticmethod
+    def _frequency(conn, word) -> int:
+        return conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (word,)).fetchone()[0]
+
+    def _snippets(self, conn, edition: int, length: int, found: list) -> dict:
+        starts, ends, text = conn.execute(
+            "SELECT starts, ends, text FROM documents WHERE edition = ?", (edition,)
+        ).fetchone()
+        starts = array("I", zlib.decompress(starts))
+        ends = array("I", zlib.decompress(ends))
+        text = zlib.decompress(text).decode("utf-8")
+        matches = []
+        for position in found[:self.SNIPPETS_PER_BOOK]:
+            start, end = starts[position], ends[position + length - 1]
+            left = max(0, start - self.SNIPPET_CONTEXT)
+            right = min(len(text), end + self.SNIPPET_CONTEXT)
+            matches.append({
+                "start": start,
+                "end": end,
+                "snippet": text[left:right],
+                "highlight": [start - left, end - left],
+            })
+        return {"edition": edition, "count": len(found), "matches": matches}
+
+
+def read_epub(edition: int) -> bytes:
+    """The open-access EPUB of `edition`, from s3."""
+    from lenny.core import s3
+    return s3.get_object(Bucket=s3.BOOKSHELF_BUCKET, Key=f"{edition}.epub")["Body"].read()
+
+
+class FullTextIndexer:
+    """Feeds books to the index: fetching runs on a background thread,
+    parsing in a process pool, so neither blocks a request."""
+
+    def __init__(self, index: FullTextIndex, workers: int = FULLTEXT_WORKERS,
+                 fetch: Callable[[int], bytes] = read_epub, pool=None):
+        self.index = index
+        self.workers = workers
+        self.fetch = fetch
+        self._pool = pool
+        self._scheduler = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0 or self._pool is not None
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: forking a threaded server can deadlock
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=100,
+                )
+            return self._pool
+
+    def schedule(self, edition: int, replace: bool = False):
+        """Indexes `edition` in the background, unless already indexed
+        (or, with `replace`, again: e.g. a re-uploaded book)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lenny-fulltext")
+        self._scheduler.submit(self.index_editions, [edition], replace=replace)
+
+    def index_editions(self, editions: Iterable[int], replace: bool = False) -> int:
+        """Indexes the `editions` not indexed yet (all of them, with
+        `replace`), keeping at most two books per pool worker in flight;
+        returns how many were indexed."""
+        pending = deque(editions if replace else self.index.missing(editions))
+        in_flight, indexed = {}, 0
+        window = max(1, self.workers) * 2
+        while pending or in_flight:
+            while pending and len(in_flight) < window:
+                edition = pending.popleft()
+                try:
+                    in_flight[edition] = self.pool().submit(analyze, self.fetch(edition))
+                except Exception as e:
+                    logger.warning(f"[FullText] Could not read {edition}: {e}")
+            if not in_flight:
+                continue
+            edition = next(iter(in_flight))
+            try:
+                self.index.add(edition, in_flight.pop(edition).result())
+                indexed += 1
+            except ExtractionError as e:
+                self.index.fail(edition, str(e))
+                logger.warning(f"[FullText] Could not extract {edition}: {e}")
+            except Exception as e:
+                logger.warning(f"[FullText] Could not index {edition}: {e}")
+        return indexed
+
+
+fulltext_index = FullTextIndex()
+fulltext_indexer = FullTextIndexer(fulltext_index)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+    Hedged requests for Lenny's upstream calls
+
+    A request that hasn't answered within the recent p90 latency of its
+    kind is sent a second time; the first answer wins and the other
+    request is cancelled. That trims the latency tail for the price of
+    a few duplicate requests, capped by a budget: each request earns
+    `rate` hedges (e.g. 0.05: at most ~5% of traffic is duplicated), a
+    bucket of at most `burst` of them.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Optional
+
+from lenny.core.metrics import metrics
+
+
+class Hedger:
+
+    QUANTILE = 0.9
+    # Latencies observed before hedging starts, and the delay bounds
+    MIN_OBSERVATIONS = 20
+    MIN_DELAY = 0.05
+
+    def __init__(self, name: str, latency_metric: str, rate: float = 0.05, burst: float = 10,
+                 max_delay: float = 5.0, workers: int = 32):
+        self.name = name
+        self.latency_metric = latency_metric
+        self.rate = rate
+        self.burst = burst
+        self.max_delay = max_delay
+        self.tokens = burst
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lenny-hedge-{name}")
+
+    def threshold(self, label: str) -> Optional[float]:
+        """Seconds to wait before hedging a `label` request: the recent
+        p90 latency, or None until enough requests have been timed."""
+        summary = metrics.summary(self.latency_metric, profile=label)
+        if summary is None or len(summary.recent) < self.MIN_OBSERVATIONS:
+            return None
+        delay = min(max(summary.quantile(self.QUANTILE), self.MIN_DELAY), self.max_delay)
+        metrics.gauge(f"{self.name}.hedge.threshold", delay, profile=label)
+        return delay
+
+    def _spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.hedges += 1
+            return True
+
+    def run(self, label: str, attempt: Callable[[int], object], cancel: Callable[[int], None]):
+        """Returns the result of `attempt(0)`, or of `attempt(1)` if it
+        was hedged and answered first, cancelling the loser with
+        `cancel(i)`. Raises only if every attempt failed."""
+        with self._lock:
+            self.requests += 1
+            self.tokens = min(self.burst, self.tokens + self.rate)
+            metrics.gauge(f"{self.name}.hedge.rate", self.hedges / self.requests)
+        delay = self.threshold(label)
+        if delay is None:
+            return attempt(0)
+
+        futures = [self._executor.submit(attempt, 0)]
+        done, _ = wait(futures, timeout=delay)
+        if done or not self._spend():
+            return futures[0].result()
+        metrics.incr(f"{self.name}.hedge.sent", profile=label)
+        futures.append(self._executor.submit(attempt, 1))
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is not None:
+                for loser in pending:
+                    cancel(futures.index(loser))
+                if winner is futures[1]:
+                    metrics.incr(f"{self.name}.hedge.won", profile=label)
+                return winner.result()
+        # Both failed: surface the original request's error
+        return futures[0].result()
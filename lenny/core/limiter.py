@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+    Outbound request limiter for Lenny
+
+    Caps the requests a process sends to an upstream service, both in
+    flight at once and started per second, and hands the free slots
+    out by priority: a waiting interactive (patron-facing) request
+    always goes before background work such as preloads or metadata
+    backfills, which simply wait for a quiet moment. Time spent queued
+    is observed as `<name>.queue_wait{priority=...}`.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from lenny.core.metrics import metrics
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = {INTERACTIVE: 0, BACKGROUND: 1}
+
+
+class PriorityLimiter:
+
+    def __init__(self, name: str, max_in_flight: int = 8, rate: Optional[float] = None, burst: Optional[float] = None):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.rate = rate or None
+        # By default, up to a second's worth of requests at once
+        self.burst = burst or max(1.0, self.rate or 0)
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.in_flight = 0
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+
+    def _token_wait(self) -> float:
+        """Takes a rate token if one is available (returning 0), else
+        returns the seconds until the next one."""
+        if self.rate is None:
+            return 0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    @contextmanager
+    def slot(self, priority: str = INTERACTIVE):
+        """Holds one outbound slot for the duration of the block, after
+        every waiting request of a higher priority (or the same priority,
+        queued earlier) has had its own."""
+        start = time.monotonic()
+        ticket = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._tickets))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] == ticket and self.in_flight < self.max_in_flight:
+                        delay = self._token_wait()
+                        if not delay:
+                            heapq.heappop(self._waiting)
+                            self.in_flight += 1
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                raise
+            finally:
+                # The next in line may be able to go too
+                self._cond.notify_all()
+        metrics.observe(f"{self.name}.queue_wait", time.monotonic() - start, priority=priority)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+    HTTP load tests for Lenny
+
+    Drives a running Lenny with `concurrency` virtual patrons, each
+    repeatedly picking an action from a weighted mix (anonymous catalog
+    browsing, search, borrow and return, shelf, reader manifests) and
+    sending its requests one after the other. The report has the
+    throughput and, per route, the request count, errors and
+    p50/p95/p99 latency; `compare` checks it against a stored baseline
+    and lists the regressions.
+
+    See scripts/loadtest.py, which also starts Lenny against local
+    stand-ins and reports its database and upstream call counts.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import asyncio
+import random
+import time
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import quote
+
+import httpx
+
+from lenny.core.metrics import Summary
+
+BROWSE = "browse"
+SEARCH = "search"
+BORROW = "borrow"
+SHELF = "shelf"
+READ = "read"
+
+# Relative weight of each action
+DEFAULT_MIX = {BROWSE: 40, SEARCH: 20, BORROW: 10, SHELF: 15, READ: 15}
+
+# A latency regression must also be at least this many seconds, so
+# noise on millisecond routes isn't flagged
+MIN_REGRESSION = 0.005
+
+
+class LoadTest:
+
+    PAGE_SIZE = 10
+    TIMEOUT = 30
+
+    def __init__(self, base_url: str, editions: Sequence[int], lendable: Sequence[int] = (),
+                 queries: Sequence[str] = ("the",), patrons: Sequence[str] = (),
+                 mix: Optional[Dict[str, float]] = None, concurrency: int = 10,
+                 seed: Optional[int] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        """`editions` are open (readable) catalog editions, `lendable`
+        encrypted ones, `patrons` session cookies; actions needing what
+        isn't given are left out of the mix."""
+        self.base_url = base_url.rstrip("/")
+        self.editions = list(editions)
+        self.lendable = list(lendable)
+        self.queries = list(queries)
+        self.patrons = list(patrons)
+        self.concurrency = concurrency
+        self.transport = transport
+        self._random = random.Random(seed)
+        mix = mix or DEFAULT_MIX
+        needs = {BROWSE: True, SEARCH: self.queries, BORROW: self.lendable and self.patrons,
+                 SHELF: self.patrons, READ: self.editions}
+        self.mix = {action: weight for action, weight in mix.items() if weight > 0 and needs.get(action)}
+        if not self.mix:
+            raise ValueError("No action of the mix can run with the given catalog and patrons")
+        self.latencies = {}
+        self.errors = {}
+
+    def requests(self, action: str, patron: Optional[str]) -> List[tuple]:
+        """(route, method, path, headers) of the requests of one `action`."""
+        headers = {"Cookie": f"session={patron}"} if patron else None
+        if action == BROWSE:
+            pages = max(1, len(self.editions) + len(self.lendable))
+            offset = self._random.randrange(0, pages, self.PAGE_SIZE)
+            return [("GET /opds", "GET", f"/v1/api/opds?offset={offset}&limit={self.PAGE_SIZE}", None)]
+        if action == SEARCH:
+            query = quote(self._random.choice(self.queries))
+            return [("GET /opds/search", "GET", f"/v1/api/opds/search?query={query}", None)]
+        if action == BORROW:
+            edition = self._random.choice(self.lendable)
+            return [
+                ("POST /items/{id}/borrow", "POST", f"/v1/api/items/{edition}/borrow", headers),
+                ("POST /items/{id}/return", "POST", f"/v1/api/items/{edition}/return", headers),
+            ]
+        if action == SHELF:
+            return [("GET /shelf", "GET", "/v1/api/shelf", headers)]
+        if action == READ:
+            edition = self._random.choice(self.editions)
+            return [("GET /items/{id}/readium/manifest.json", "GET",
+                     f"/v1/api/items/{edition}/readium/manifest.json", None)]
+        raise ValueError(f"Unknown action: {action}")
+
+    def _record(self, route: str, latency: float, error: bool):
+        self.latencies.setdefault(route, Summary(size=None)).observe(latency)
+        if error:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    async def _patron(self, client: httpx.AsyncClient, patron: Optional[str], deadline: float, budget: list):
+        actions, weights = list(self.mix), list(self.mix.values())
+        while time.monotonic() < deadline:
+            action = self._random.choices(actions, weights)[0]
+            for route, method, path, headers in self.requests(action, patron):
+                if budget[0] <= 0:
+                    return
+                budget[0] -= 1
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, headers=headers)
+                    error = response.status_code >= 500
+                except httpx.HTTPError:
+                    error = True
+                self._record(route, time.perf_counter() - start, error)
+
+    async def run_async(self, duration: Optional[float] = None, requests: Optional[int] = None) -> dict:
+        if duration is None and requests is None:
+            raise ValueError("Give a duration, a number of requests, or both")
+        self.latencies, self.errors = {}, {}
+        deadline = time.monotonic() + (duration if duration is not None else float("inf"))
+        budget = [requests if requests is not None else float("inf")]
+        limits = httpx.Limits(max_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.TIMEOUT, limits=limits,
+                                     transport=self.transport) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                self._patron(client, self.patrons[i % len(self.patrons)] if self.patrons else None, deadline, budget)
+                for i in range(self.concurrency)
+            ))
+            elapsed = time.perf_counter() - start
+        return self.report(elapsed)
+
+    def run(self, duration: Optional[float] = None, requests: Optional[int] = None) -> dict:
+        """Runs for `duration` seconds or `requests` requests, whichever
+        comes first; returns the report."""
+        return asyncio.run(self.run_async(duration=duration, requests=requests))
+
+    def report(self, elapsed: float) -> dict:
+        total = sum(summary.count for summary in self.latencies.values())
+        return {
+            "concurrency": self.concurrency,
+            "duration": round(elapsed, 3),
+            "requests": total,
+            "throughput": round(total / elapsed, 2) if elapsed else 0.0,
+            "errors": sum(self.errors.values()),
+            "routes": {
+                route: {
+                    "count": summary.count,
+                    "errors": self.errors.get(route, 0),
+                    "mean": round(summary.mean, 6),
+                    "p50": round(summary.quantile(0.5), 6),
+                    "p95": round(summary.quantile(0.95), 6),
+                    "p99": round(summary.quantile(0.99), 6),
+                }
+                for route, summary in sorted(self.latencies.items())
+            },
+            "counters": {},
+        }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.2) -> List[str]:
+    """Regressions of `report` against `baseline`: throughput down,
+    p95/p99 latency or per-request counters (database queries, upstream
+    calls) up by more than `tolerance`, or a route's error rate up by
+    more than a percentage point."""
+    regressions = []
+    if report["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']} -> {report['throughput']} req/s")
+    for route, stats in report["routes"].items():
+        if (base := baseline["routes"].get(route)) is None:
+            continue
+        for quantile in ("p95", "p99"):
+            before, after = base[quantile], stats[quantile]
+            if after > before * (1 + tolerance) and after - before > MIN_REGRESSION:
+                regressions.append(f"{route} {quantile} {before * 1000:.1f} -> {after * 1000:.1f} ms")
+        before, after = base["errors"] / max(base["count"], 1), stats["errors"] / max(stats["count"], 1)
+        if after > before + 0.01:
+            regressions.append(f"{route} errors {before:.1%} -> {after:.1%}")
+    for name, count in report.get("counters", {}).items():
+        if (base := baseline.get("counters", {}).get(name)) is None:
+            continue
+        before = base / max(baseline["requests"], 1)
+        after = count / max(report["requests"], 1)
+        if after > before * (1 + tolerance) and after - before > 0.01:
+            regressions.append(f"{name} {before:.2f} -> {after:.2f} per request")
+    return regressions
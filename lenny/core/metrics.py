@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+    In-process metrics for Lenny
+
+    Counters, gauges (last value set) and latency summaries (count,
+    mean, p50/p95/max over a bounded reservoir of recent observations),
+    keyed by name and labels, e.g. `search.latency{strategy=intersect}`. Exposed as JSON
+    at `/v1/api/metrics` and read back by components that tune
+    themselves from observed latencies (see `SearchPlanner`).
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return f"{name}{{{','.join(f'{k}={v}' for k, v in sorted(labels.items()))}}}"
+
+
+class Summary:
+    """Running count and sum plus the `size` most recent observations."""
+
+    def __init__(self, size: int = 512):
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=size)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Mean of the recent observations, so it follows drift."""
+        return sum(self.recent) / len(self.recent) if self.recent else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": self.mean,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": max(self.recent) if self.recent else None,
+        }
+
+
+class Metrics:
+
+    def __init__(self, reservoir: int = 512):
+        self.reservoir = reservoir
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, n: int = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self.summaries:
+                self.summaries[key] = Summary(self.reservoir)
+            self.summaries[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observes the wall time of the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def summary(self, name: str, **labels) -> Optional[Summary]:
+        return self.summaries.get(_key(name, labels))
+
+    def counter(self, name: str, **labels) -> int:
+        return self.counters.get(_key(name, labels), 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "summaries": {key: s.to_dict() for key, s in self.summaries.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.summaries.clear()
+
+
+metrics = Metrics()
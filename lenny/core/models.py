@@ -8,12 +8,14 @@
     :license: see LICENSE for more details
 """
 
-from sqlalchemy import Column, String, Boolean, BigInteger, Integer, DateTime, Enum as SQLAlchemyEnum, Index
+from sqlalchemy import Column, String, Boolean, BigInteger, Integer, DateTime, JSON, Enum as SQLAlchemyEnum, Index
 from sqlalchemy.sql import func
-from sqlalchemy import ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import ForeignKey, event, inspect, insert, select, update, or_, text, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import relationship, object_session
 from sqlalchemy.ext.hybrid import hybrid_property
 from lenny.core.utils import hash_email
+from lenny.core import events
 from lenny.core.db import session as db, Base
 from lenny.core.exceptions import (
     LoanNotRequiredError,
@@ -30,11 +32,27 @@ class FormatEnum(enum.Enum):
     PDF = 2
     EPUB_PDF = 3
 
+# Values of the `format` facet for each stored format
+FORMAT_FACETS = {
+    FormatEnum.EPUB: ('epub',),
+    FormatEnum.PDF: ('pdf',),
+    FormatEnum.EPUB_PDF: ('epub', 'pdf'),
+}
+
+class ChangeEnum(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    AVAILABILITY = 3
+
 class Item(Base):
     __tablename__ = 'items'
     __table_args__ = (
         Index('idx_items_openlibrary_edition', 'openlibrary_edition'),
+        Index('idx_items_encrypted_id', 'encrypted', 'id'),
     )
+
+    ACCESS_FILTERS = ('open', 'lendable')
+    FORMAT_FILTERS = ('epub', 'pdf')
     
     id = Column(BigInteger, primary_key=True)
     openlibrary_edition = Column(BigInteger, nullable=False)
@@ -105,12 +123,76 @@ class Item(Base):
     def exists(cls, olid):
         return db.query(Item).filter(Item.openlibrary_edition == olid).first()
 
+    @classmethod
+    def filtered(cls, available=False, access=None, format=None, language=None, subject=None):
+        """
+        Query of items ordered by id, optionally restricted to those
+        `available` right now (open access, or lendable with no active
+        loan), to an `access` kind ('open' or 'lendable'), a `format`
+        ('epub' or 'pdf'), or a `language` or `subject` facet value.
+
+        Availability is a NOT EXISTS against the active-loan index, so
+        pages are served by the database without per-item COUNTs.
+        """
+        q = db.query(cls)
+        if access == 'open':
+            q = q.filter(cls.encrypted == False)
+        elif access == 'lendable':
+            q = q.filter(cls.encrypted == True)
+        if available:
+            on_loan = db.query(Loan.id).filter(Loan.item_id == cls.id, Loan.returned_at == None).exists()
+            q = q.filter(or_(cls.encrypted == False, ~on_loan))
+        if format:
+            q = q.filter(cls.formats.in_([f for f, names in FORMAT_FACETS.items() if format in names]))
+        for facet, value in (('language', language), ('subject', subject)):
+            if value:
+                q = q.filter(db.query(ItemFacet.item_id).filter(
+                    ItemFacet.item_id == cls.id, ItemFacet.facet == facet, ItemFacet.value == value
+                ).exists())
+        return q.order_by(cls.id)
+
+    @classmethod
+    def get_many_filtered(cls, offset=None, limit=None, **filters):
+        return cls.filtered(**filters).offset(offset).limit(limit).all()
+
+    def set_facets(self, facet, values):
+        """Replaces this item's values of an Open Library derived
+        `facet` ('language' or 'subject'). Takes effect on commit."""
+        values = set(values)
+        for item_facet in [f for f in self.facets if f.facet == facet and f.value not in values]:
+            self.facets.remove(item_facet)
+        existing = {f.value for f in self.facets if f.facet == facet}
+        for value in values - existing:
+            self.facets.append(ItemFacet(facet=facet, value=value))
+
     @classmethod
     def get_all(cls):
         """Return all items as {openlibrary_edition: Item} mapping."""
         items = db.query(cls).all()
         return {item.openlibrary_edition: item for item in items}
 
+    @classmethod
+    def edition_ids(cls):
+        """The set of Open Library edition ids in the catalog."""
+        return {edition for (edition,) in db.query(cls.openlibrary_edition).distinct()}
+
+    @classmethod
+    def get_editions(cls, editions):
+        """Return {openlibrary_edition: Item} for `editions` in one query."""
+        if not editions:
+            return {}
+        items = db.query(cls).filter(cls.openlibrary_edition.in_(list(editions))).all()
+        return {item.openlibrary_edition: item for item in items}
+
+    @classmethod
+    def version(cls):
+        """Returns (count, max updated_at) across all items.
+
+        A single aggregate query, cheap enough to run on every request
+        to validate cached OPDS feeds.
+        """
+        return tuple(db.query(func.count(cls.id), func.max(cls.updated_at)).one())
+
     def unborrow(self, email: str):
         if not self.is_login_required:
             raise LoanNotRequiredError
@@ -163,6 +245,7 @@ class Loan(Base):
     __table_args__ = (
         Index('idx_loans_item_patron_returned', 'item_id', 'patron_email_hash', 'returned_at'),
         Index('idx_loans_item_returned', 'item_id', 'returned_at'),
+        Index('idx_loans_active_item', 'item_id', postgresql_where=text('returned_at IS NULL')),
     )
 
     id = Column(BigInteger, primary_key=True)
@@ -182,6 +265,52 @@ class Loan(Base):
             Loan.returned_at == None
         ).first()
 
+    @classmethod
+    def version(cls, item_id=None):
+        """Returns (count, max created_at, max returned_at) for loans,
+        optionally restricted to a single item. Any borrow or return
+        changes at least one of these values.
+        """
+        q = db.query(func.count(cls.id), func.max(cls.created_at), func.max(cls.returned_at))
+        if item_id is not None:
+            q = q.filter(cls.item_id == item_id)
+        return tuple(q.one())
+
+    @classmethod
+    def version_map(cls):
+        """Returns {item_id: (count, max created_at, max returned_at)}
+        for every item with loans, in one grouped query."""
+        rows = db.query(
+            cls.item_id, func.count(cls.id), func.max(cls.created_at), func.max(cls.returned_at)
+        ).group_by(cls.item_id).all()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    @classmethod
+    def active_counts(cls, item_ids):
+        """Returns {item_id: number of active loans} for `item_ids`, in
+        one grouped query. Items without active loans are omitted."""
+        if not item_ids:
+            return {}
+        rows = db.query(cls.item_id, func.count(cls.id)).filter(
+            cls.item_id.in_(list(item_ids)),
+            cls.returned_at == None
+        ).group_by(cls.item_id).all()
+        return {item_id: count for item_id, count in rows}
+
+    @classmethod
+    def get_active_editions(cls, email, hashed=False):
+        """Returns the set of openlibrary_edition ids a patron
+        currently has on loan, using a single query.
+        """
+        hashed_email = email if hashed else hash_email(email)
+        rows = db.query(Item.openlibrary_edition).join(
+            cls, cls.item_id == Item.id
+        ).filter(
+            cls.patron_email_hash == hashed_email,
+            cls.returned_at == None
+        ).all()
+        return {row[0] for row in rows}
+
     @classmethod
     def create(cls, item_id, email, hashed=False):
         hashed_email = email if hashed else hash_email(email)
@@ -204,3 +333,294 @@ class Loan(Base):
             raise DatabaseInsertError(f"Failed to return loan: {str(e)}.")
 
 Item.loans = relationship('Loan', back_populates='item', cascade='all, delete-orphan')
+
+
+class ItemFacet(Base):
+    """An Open Library derived facet value (language, subject) of an item."""
+    __tablename__ = 'item_facets'
+    __table_args__ = (
+        Index('idx_item_facets_facet_value', 'facet', 'value', 'item_id'),
+    )
+
+    item_id = Column(BigInteger, ForeignKey('items.id'), primary_key=True)
+    facet = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+
+Item.facets = relationship('ItemFacet', cascade='all, delete-orphan')
+
+
+class FacetCount(Base):
+    """Number of items per facet value, maintained incrementally by
+    the mapper events below so facet groups never scan the catalog."""
+    __tablename__ = 'facet_counts'
+    __table_args__ = (
+        Index('idx_facet_counts_facet_count', 'facet', 'count'),
+    )
+
+    facet = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), default=func.now())
+
+    FACETS = ('format', 'access', 'language', 'subject')
+
+    @classmethod
+    def top(cls, facet, limit=None):
+        """[(value, count)] of a facet, most common first."""
+        rows = db.query(cls.value, cls.count).filter(
+            cls.facet == facet, cls.count > 0
+        ).order_by(cls.count.desc(), cls.value).limit(limit).all()
+        return [tuple(row) for row in rows]
+
+    @classmethod
+    def version(cls):
+        return tuple(db.query(func.count(cls.value), func.max(cls.updated_at)).one())
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes every count from the items (e.g. for items stored
+        before facet counting existed) with grouped queries."""
+        counts = {}
+        for encrypted, formats, n in db.query(Item.encrypted, Item.formats, func.count(Item.id)).group_by(Item.encrypted, Item.formats):
+            for key in _item_facets(encrypted, formats):
+                counts[key] = counts.get(key, 0) + n
+        for facet, value, n in db.query(ItemFacet.facet, ItemFacet.value, func.count(ItemFacet.item_id)).group_by(ItemFacet.facet, ItemFacet.value):
+            counts[(facet, value)] = n
+        db.query(cls).delete()
+        db.add_all(cls(facet=facet, value=value, count=n) for (facet, value), n in counts.items())
+        db.commit()
+
+    @classmethod
+    def bump(cls, connection, facet, value, delta):
+        """Adds `delta` to a facet value's count, as an atomic upsert."""
+        values = {'facet': facet, 'value': value, 'count': delta, 'updated_at': func.now()}
+        dialect = connection.dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            upsert = (postgresql if dialect == 'postgresql' else sqlite).insert(cls.__table__).values(**values)
+            connection.execute(upsert.on_conflict_do_update(
+                index_elements=['facet', 'value'],
+                set_={'count': cls.__table__.c.count + delta, 'updated_at': func.now()}
+            ))
+            return
+        updated = connection.execute(update(cls.__table__).where(
+            cls.facet == facet, cls.value == value
+        ).values(count=cls.__table__.c.count + delta, updated_at=func.now()))
+        if not updated.rowcount:
+            connection.execute(insert(cls.__table__).values(**values))
+
+
+def _item_facets(encrypted, formats):
+    facets = [('access', 'lendable' if encrypted else 'open')]
+    return facets + [('format', name) for name in FORMAT_FACETS.get(formats, ())]
+
+@event.listens_for(Item, 'after_insert')
+def _count_item_added(mapper, connection, target):
+    for facet, value in _item_facets(target.encrypted, target.formats):
+        FacetCount.bump(connection, facet, value, 1)
+
+@event.listens_for(Item, 'after_delete')
+def _count_item_removed(mapper, connection, target):
+    for facet, value in _item_facets(target.encrypted, target.formats):
+        FacetCount.bump(connection, facet, value, -1)
+
+@event.listens_for(Item, 'after_update')
+def _count_item_changed(mapper, connection, target):
+    state = inspect(target).attrs
+    if not (state.encrypted.history.has_changes() or state.formats.history.has_changes()):
+        return
+    old = _item_facets(
+        (state.encrypted.history.deleted or [target.encrypted])[0],
+        (state.formats.history.deleted or [target.formats])[0],
+    )
+    for facet, value in old:
+        FacetCount.bump(connection, facet, value, -1)
+    for facet, value in _item_facets(target.encrypted, target.formats):
+        FacetCount.bump(connection, facet, value, 1)
+
+@event.listens_for(ItemFacet, 'after_insert')
+def _count_facet_added(mapper, connection, target):
+    FacetCount.bump(connection, target.facet, target.value, 1)
+
+@event.listens_for(ItemFacet, 'after_delete')
+def _count_facet_removed(mapper, connection, target):
+    FacetCount.bump(connection, target.facet, target.value, -1)
+
+
+class Edition(Base):
+    """Open Library metadata (title, authors) mirrored locally for
+    catalog editions, so features like suggestions don't need an
+    upstream request."""
+    __tablename__ = 'editions'
+    __table_args__ = (
+        Index('idx_editions_updated_at', 'updated_at'),
+    )
+
+    openlibrary_edition = Column(BigInteger, primary_key=True, autoincrement=False)
+    title = Column(String, nullable=False)
+    authors = Column(JSON, nullable=False, default=list)
+    updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+    @classmethod
+    def upsert(cls, openlibrary_edition, title, authors=None):
+        """Adds or replaces an edition's metadata. Takes effect on commit."""
+        return db.merge(cls(openlibrary_edition=openlibrary_edition, title=title, authors=list(authors or [])))
+
+    @classmethod
+    def bulk_upsert(cls, rows):
+        """Adds or retitles editions from `rows` of (openlibrary_edition,
+        title) in one executemany; existing editions keep their authors.
+        Takes effect on commit."""
+        rows = [{'openlibrary_edition': edition, 'title': title, 'authors': []} for edition, title in rows]
+        if not rows:
+            return
+        dialect = db.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            upsert = (postgresql if dialect == 'postgresql' else sqlite).insert(cls.__table__)
+            db.execute(upsert.on_conflict_do_update(
+                index_elements=['openlibrary_edition'],
+                set_={'title': upsert.excluded.title, 'updated_at': func.now()}
+            ), rows)
+            return
+        for row in rows:
+            edition = db.get(cls, row['openlibrary_edition'])
+            if edition is None:
+                db.add(cls(**row))
+            else:
+                edition.title = row['title']
+
+    @classmethod
+    def set_authors(cls, rows):
+        """Sets the authors of editions from `rows` of (openlibrary_edition,
+        authors) in one executemany. Takes effect on commit."""
+        rows = [{'edition': edition, 'names': list(authors)} for edition, authors in rows]
+        if rows:
+            db.execute(update(cls.__table__).where(
+                cls.__table__.c.openlibrary_edition == bindparam('edition')
+            ).values(authors=bindparam('names'), updated_at=func.now()), rows)
+
+    @classmethod
+    def latest_update(cls):
+        return db.query(func.max(cls.updated_at)).scalar()
+
+    @classmethod
+    def in_catalog(cls, updated_since=None, editions=None):
+        """(openlibrary_edition, title, authors, updated_at) of catalog
+        editions, optionally only those updated at or after `updated_since`
+        or among `editions`."""
+        q = db.query(cls.openlibrary_edition, cls.title, cls.authors, cls.updated_at).join(
+            Item, Item.openlibrary_edition == cls.openlibrary_edition
+        )
+        if updated_since is not None:
+            q = q.filter(cls.updated_at >= updated_since)
+        if editions is not None:
+            q = q.filter(cls.openlibrary_edition.in_(list(editions)))
+        return q.all()
+
+
+class Change(Base):
+    """Append-only log of catalog changes (items added or removed,
+    availability flipped by a borrow or return). Its monotonically
+    increasing `id` is the sync token of the OPDS changes feed.
+
+    Rows are written by the mapper events below, inside the same
+    transaction as the change they record. Ids come from a sequence at
+    insert, not at commit, so a change may become visible after later
+    ones: readers hold back at the first gap in the ids younger than
+    `SETTLE` seconds (a change still in flight) instead of skipping it,
+    while older gaps are inserts that were rolled back.
+    """
+    __tablename__ = 'changes'
+
+    SETTLE = 10
+
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    openlibrary_edition = Column(BigInteger, nullable=False)
+    kind = Column(SQLAlchemyEnum(ChangeEnum), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=func.now())
+
+    @classmethod
+    def _settled(cls, changes, token):
+        """The leading run of `changes` (ordered by id, all after `token`)
+        before which no change still in flight can appear."""
+        horizon = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=cls.SETTLE)
+        settled, expected = [], token + 1
+        for change in changes:
+            created = change.created_at
+            if created is not None and created.tzinfo is None:
+                created = created.replace(tzinfo=datetime.timezone.utc)
+            if change.id != expected and created is not None and created > horizon:
+                break
+            settled.append(change)
+            expected = change.id + 1
+        return settled
+
+    @classmethod
+    def since(cls, token=0, limit=None):
+        """Changes with an id greater than `token`, oldest first, up to
+        the first one that may still be preceded by a change in flight."""
+        return cls._settled(db.query(cls).filter(cls.id > token).order_by(cls.id).limit(limit).all(), token)
+
+    @classmethod
+    def latest_token(cls):
+        """The newest token no change in flight can land before: the
+        last id older than `SETTLE`, plus the settled run of newer ones."""
+        horizon = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=cls.SETTLE)
+        token = db.query(func.max(cls.id)).filter(cls.created_at <= horizon).scalar() or 0
+        recent = cls._settled(db.query(cls.id, cls.created_at).filter(cls.id > token).order_by(cls.id).all(), token)
+        return recent[-1].id if recent else token
+
+    @classmethod
+    def newest(cls):
+        """(id, created_at) of the newest change, or (0, None): a
+        catalog version which removals advance too."""
+        row = db.query(cls.id, cls.created_at).order_by(cls.id.desc()).first()
+        return tuple(row) if row else (0, None)
+
+    @classmethod
+    def record(cls, connection, openlibrary_edition, kind):
+        """Appends a change and returns its id (the new sync token). It
+        is stamped with the time of the insert, which ages its id."""
+        return connection.execute(insert(cls.__table__).values(
+            openlibrary_edition=openlibrary_edition, kind=kind,
+            created_at=datetime.datetime.now(datetime.timezone.utc)
+        )).inserted_primary_key[0]
+
+
+def _item_state(connection, item_id):
+    """(openlibrary_edition, available) of an item as of this flush:
+    available means readable, or lendable with no active loan."""
+    edition, encrypted = connection.execute(
+        select(Item.openlibrary_edition, Item.encrypted).where(Item.id == item_id)
+    ).one()
+    active_loans = connection.execute(
+        select(func.count(Loan.id)).where(Loan.item_id == item_id, Loan.returned_at == None)
+    ).scalar()
+    return edition, not encrypted or active_loans == 0
+
+def _record(connection, target, edition, kind, available):
+    token = Change.record(connection, edition, kind)
+    events.stage(connection, object_session(target), {
+        "token": token,
+        "edition": edition,
+        "kind": kind.name.lower(),
+        "available": available,
+    })
+
+@event.listens_for(Item, 'after_insert')
+def _record_item_added(mapper, connection, target):
+    _record(connection, target, target.openlibrary_edition, ChangeEnum.ADDED, True)
+
+@event.listens_for(Item, 'after_delete')
+def _record_item_removed(mapper, connection, target):
+    _record(connection, target, target.openlibrary_edition, ChangeEnum.REMOVED, False)
+
+@event.listens_for(Loan, 'after_insert')
+def _record_item_borrowed(mapper, connection, target):
+    edition, available = _item_state(connection, target.item_id)
+    _record(connection, target, edition, ChangeEnum.AVAILABILITY, available)
+
+@event.listens_for(Loan, 'after_update')
+def _record_item_returned(mapper, connection, target):
+    if inspect(target).attrs.returned_at.history.has_changes():
+        edition, available = _item_state(connection, target.item_id)
+        _record(connection, target, edition, ChangeEnum.AVAILABILITY, available)
@@ -1,25 +1,113 @@
 import httpx
-from typing import List, Generator, Optional, Dict, Any
-from urllib.parse import urlencode
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import cached_property
+from typing import List, Generator, Optional, Dict, Any, Iterable
+from urllib.parse import urlencode, urlparse, parse_qs
 import logging
 
-from lenny.configs import LENNY_HTTP_HEADERS
+from lenny.configs import (
+    LENNY_HTTP_HEADERS,
+    OPENLIBRARY_BREAKER_FAILURES,
+    OPENLIBRARY_BREAKER_SLOW,
+    OPENLIBRARY_BREAKER_RESET,
+    OPENLIBRARY_FRESH_TTL,
+    OPENLIBRARY_STALE_TTL,
+    OPENLIBRARY_STALE_SIZE,
+    OPENLIBRARY_HEDGE,
+    OPENLIBRARY_HEDGE_RATE,
+    OPENLIBRARY_MAX_IN_FLIGHT,
+    OPENLIBRARY_RPS,
+    OPENLIBRARY_URL,
+    OPENLIBRARY_EDITION_CACHE_SIZE,
+)
+from lenny.core.breaker import CircuitBreaker
+from lenny.core.hedge import Hedger
+from lenny.core.limiter import PriorityLimiter, INTERACTIVE, BACKGROUND
+from lenny.core.cache import SingleFlight, TTLCache
+from lenny.core.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+# Priority of the Open Library requests made in the current context
+_priority = ContextVar("openlibrary_priority", default=INTERACTIVE)
+
+# The `OpenLibrary.tracking()` blocks the current context is in
+_tracking = ContextVar("openlibrary_tracking", default=())
+
+_EDITION_QUERY = re.compile(r"^edition_key:\((OL\d+M(?: OR OL\d+M)*)\)$")
+
+# Cached as "no such edition", unlike a cache miss (None)
+_ABSENT = object()
+
+
+class UpstreamHealth:
+    """Whether the Open Library responses used in an
+    `OpenLibrary.tracking()` block were all good."""
+
+    def __init__(self):
+        self.degraded = False
+
 class OpenLibrary:
     
-    SEARCH_URL = "https://openlibrary.org/search.json"
+    SEARCH_URL = f"{OPENLIBRARY_URL}/search.json"
+    BOOKS_URL = f"{OPENLIBRARY_URL}/api/books"
+    # Editions per key-based request (the keys go in the URL)
+    BOOKS_BATCH_SIZE = 50
     HTTP_HEADERS = LENNY_HTTP_HEADERS
     HTTP_TIMEOUT = 10
     DEFAULT_FIELDS = [
         'key', 'title', 'author_key', 'author_name', 'editions', 'editions.*',
     ]
+    # Fields fetched for each kind of caller; `fields` passed to a
+    # search are added to its profile's
+    ID = "id"
+    CARD = "card"
+    FULL = "full"
+    FIELD_PROFILES = {
+        # Just the work and its matching edition's key
+        ID: ['key', 'editions', 'editions.key'],
+        # Enough to describe a book in a list
+        CARD: [
+            'key', 'title', 'author_key', 'author_name', 'editions',
+            'editions.key', 'editions.title', 'editions.cover_i', 'editions.language',
+        ],
+        FULL: DEFAULT_FIELDS,
+    }
     COVER_SERVER = "https://covers.openlibrary.org"
+    FRESH_TTL = OPENLIBRARY_FRESH_TTL
+    HEDGE = OPENLIBRARY_HEDGE
+    _inflight = SingleFlight()
+    _breaker = CircuitBreaker(
+        "openlibrary",
+        failures=OPENLIBRARY_BREAKER_FAILURES,
+        slow=OPENLIBRARY_BREAKER_SLOW,
+        reset_timeout=OPENLIBRARY_BREAKER_RESET,
+    )
+    # url -> (fetched at, response), and (fields, edition) -> doc
+    _known_good = TTLCache(maxsize=OPENLIBRARY_STALE_SIZE, ttl=OPENLIBRARY_STALE_TTL)
+    _edition_docs = TTLCache(maxsize=OPENLIBRARY_STALE_SIZE * 50, ttl=OPENLIBRARY_STALE_TTL)
+    # edition -> its data from BOOKS_URL, or _ABSENT
+    _editions = TTLCache(maxsize=OPENLIBRARY_EDITION_CACHE_SIZE, ttl=OPENLIBRARY_STALE_TTL)
+    INTERACTIVE = INTERACTIVE
+    BACKGROUND = BACKGROUND
+    _limiter = PriorityLimiter("openlibrary", max_in_flight=OPENLIBRARY_MAX_IN_FLIGHT, rate=OPENLIBRARY_RPS)
+    _hedger = Hedger("openlibrary", "openlibrary.latency", rate=OPENLIBRARY_HEDGE_RATE, max_delay=HTTP_TIMEOUT / 2)
+    _refresher = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lenny-openlibrary")
+    _refreshing = set()
+    _refresh_lock = threading.Lock()
     
     @classmethod
-    def _construct_search_url(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100) -> str:
-        fields = list(set(cls.DEFAULT_FIELDS + (fields or [])))
+    def _construct_search_url(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100, profile: Optional[str] = FULL) -> str:
+        """`profile` selects the base fields (see FIELD_PROFILES); None
+        fetches only `fields`."""
+        base = cls.FIELD_PROFILES[profile] if profile else []
+        # Ordered, so identical searches share a URL (and a request)
+        fields = list(dict.fromkeys(base + (fields or [])))
         params = {
             'q': query,
             'fields': ','.join(fields),
@@ -29,20 +117,14 @@ class OpenLibrary:
         return f"{cls.SEARCH_URL}?{urlencode(params)}"
 
     @classmethod
-    def search(
-        cls,
-        query: str,
-        fields: Optional[List[str]] = None,
-        offset: int = 0,
-        limit: int = 100,
-        max_results: Optional[int] = None,
-    ) -> Generator["OpenLibraryRecord", None, None]:
+    def _docs(cls, query, fields=None, offset=0, limit=100, max_results=None, profile=FULL):
+        """Raw search docs, paging through the results."""
         page = offset // limit + 1
         start_doc = (offset % limit)
         num_yielded = 0
         
         while True:
-            data = cls.search_json(query, fields=fields, page=page, limit=limit)
+            data = cls.search_json(query, fields=fields, page=page, limit=limit, profile=profile)
             docs = data.get("docs", []) if isinstance(data, dict) else []
             page += 1
 
@@ -51,7 +133,7 @@ class OpenLibrary:
                 start_doc = None
             
             for doc in docs:
-                yield OpenLibraryRecord(doc)
+                yield doc
                 num_yielded += 1
                 if max_results and num_yielded >= max_results:
                     return
@@ -60,46 +142,334 @@ class OpenLibrary:
                 break
 
     @classmethod
-    def search_json(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100) -> Dict[str, Any]:
-        url = cls._construct_search_url(query, fields, page, limit)
+    def search(
+        cls,
+        query: str,
+        fields: Optional[List[str]] = None,
+        offset: int = 0,
+        limit: int = 100,
+        max_results: Optional[int] = None,
+        profile: str = FULL,
+    ) -> Generator["OpenLibraryRecord", None, None]:
+        for doc in cls._docs(query, fields, offset=offset, limit=limit, max_results=max_results, profile=profile):
+            yield OpenLibraryRecord(doc)
+
+    @classmethod
+    def search_ids(
+        cls,
+        query: str,
+        offset: int = 0,
+        limit: int = 100,
+        max_results: Optional[int] = None,
+    ) -> Generator[int, None, None]:
+        """The edition id (as an int) of each doc matching `query`: the
+        `id` profile, read straight from the response without wrapping
+        docs as records."""
+        for doc in cls._docs(query, offset=offset, limit=limit, max_results=max_results, profile=cls.ID):
+            try:
+                yield int(doc["editions"]["docs"][0]["key"].rsplit("/", 1)[-1].strip("OLM"))
+            except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+                continue
+
+    @classmethod
+    def get_editions(cls, editions: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """The data Open Library has (`jscmd=data` of `/api/books`) for
+        each of `editions` it knows, by int edition id, in the order
+        asked for. Known ids need no search: editions are fetched by
+        key, `BOOKS_BATCH_SIZE` per request, and cached one by one
+        (unknown ones too), so only uncached editions are requested.
+        Editions whose batch failed are left out, and not cached."""
+        editions = list(dict.fromkeys(editions))
+        missing = [edition for edition in editions if cls._editions.get(edition) is None]
+        for i in range(0, len(missing), cls.BOOKS_BATCH_SIZE):
+            batch = missing[i:i + cls.BOOKS_BATCH_SIZE]
+            params = {
+                'bibkeys': ','.join(f"OLID:OL{edition}M" for edition in batch),
+                'format': 'json',
+                'jscmd': 'data',
+            }
+            url = f"{cls.BOOKS_URL}?{urlencode(params)}"
+            data = cls._inflight.do(url, lambda: cls._guarded_request(url))
+            if not isinstance(data, dict):
+                # Also when another request's failure is shared with this one
+                cls._degrade()
+                continue
+            for edition in batch:
+                cls._editions.set(edition, data.get(f"OLID:OL{edition}M") or _ABSENT)
+        found = {}
+        for edition in editions:
+            data = cls._editions.get(edition)
+            if data is not None and data is not _ABSENT:
+                found[edition] = data
+        return found
+
+    @classmethod
+    def search_json(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100, profile: Optional[str] = FULL) -> Dict[str, Any]:
+        """Identical concurrent searches share one upstream request; the
+        returned dict may be shared, so callers must not mutate it.
+
+        A response is served from memory for `FRESH_TTL` seconds, then,
+        stale, while a background request revalidates it (see
+        `_fetch_json` for when Open Library is down)."""
+        url = cls._construct_search_url(query, fields, page, limit, profile=profile)
+        if (entry := cls._known_good.get(url)) is not None:
+            fetched_at, data = entry
+            if time.monotonic() - fetched_at >= cls.FRESH_TTL:
+                cls._revalidate(url)
+            return data
+        return cls._inflight.do(url, lambda: cls._fetch_json(url))
+
+    @classmethod
+    def _revalidate(cls, url: str):
+        with cls._refresh_lock:
+            if url in cls._refreshing:
+                return
+            cls._refreshing.add(url)
+
+        def refresh():
+            try:
+                with cls.priority(BACKGROUND):
+                    cls._inflight.do(url, lambda: cls._fetch_json(url))
+            finally:
+                with cls._refresh_lock:
+                    cls._refreshing.discard(url)
+        cls._refresher.submit(refresh)
+
+    @classmethod
+    def _fetch_json(cls, url: str) -> Dict[str, Any]:
+        """Requests `url` through the circuit breaker, remembering good
+        responses. While the breaker is open, or when the request fails,
+        returns the last known-good response instead, or one assembled
+        from the last known-good docs of the editions asked for, or {}.
+        """
+        data = cls._guarded_request(url)
+        if data is None:
+            return cls._fallback(url)
+        cls._remember(url, data)
+        return data
+
+    @classmethod
+    def _guarded_request(cls, url: str) -> Optional[Any]:
+        """The response to `url`, requested through the circuit breaker
+        (and timed), or None if the breaker is open or the request
+        failed."""
+        if not cls._breaker.allow():
+            metrics.incr("openlibrary.requests", outcome="rejected")
+            cls._degrade()
+            return None
+        profile = cls._profile_of(url)
+        start = time.perf_counter()
         try:
-            with httpx.Client() as client:
-                response = client.get(url, headers=cls.HTTP_HEADERS, timeout=cls.HTTP_TIMEOUT)
-                response.raise_for_status()
-                return response.json()
+            data = cls._hedged_request_json(url, profile) if cls.HEDGE else cls._request_json(url)
         except (httpx.HTTPError, ValueError) as e:
-            logger.error(f"Error searching Open Library: {e}")
-            return {}
+            cls._breaker.record(False)
+            metrics.incr("openlibrary.requests", outcome="error")
+            logger.error(f"Error requesting Open Library: {e}")
+            cls._degrade()
+            return None
+        except Exception:
+            # Unexpected, but still a failure: a half-open breaker must
+            # not be left waiting on its trial forever
+            cls._breaker.record(False)
+            metrics.incr("openlibrary.requests", outcome="error")
+            cls._degrade()
+            raise
+        latency = time.perf_counter() - start
+        cls._breaker.record(True, latency)
+        metrics.observe("openlibrary.latency", latency, profile=profile)
+        metrics.incr("openlibrary.requests", outcome="ok")
+        return data
+
+    @classmethod
+    @contextmanager
+    def tracking(cls):
+        """Tracks whether the Open Library responses used in the block
+        were all good, so what is built from them can be left uncached:
+
+            with OpenLibrary.tracking() as upstream:
+                ...
+            if upstream.degraded:
+                ...
+
+        A request failing or refused by the circuit breaker, or the
+        breaker not being closed by the end of the block, degrades it.
+        """
+        health = UpstreamHealth()
+        token = _tracking.set(_tracking.get() + (health,))
+        try:
+            yield health
+        finally:
+            _tracking.reset(token)
+            if cls._breaker.state != CircuitBreaker.CLOSED:
+                cls._degrade()
+                health.degraded = True
+
+    @staticmethod
+    def _degrade():
+        for health in _tracking.get():
+            health.degraded = True
+
+    @classmethod
+    @contextmanager
+    def priority(cls, priority: str):
+        """Runs the Open Library requests of the block at `priority`
+        (INTERACTIVE, the default, or BACKGROUND) in the outbound limiter:
+
+            with OpenLibrary.priority(OpenLibrary.BACKGROUND):
+                ...
+        """
+        token = _priority.set(priority)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    @classmethod
+    def _request_json(cls, url: str, client: Optional[httpx.Client] = None) -> Dict[str, Any]:
+        if client is None:
+            with httpx.Client() as client:
+                return cls._request_json(url, client=client)
+        with cls._limiter.slot(_priority.get()):
+            response = client.get(url, headers=cls.HTTP_HEADERS, timeout=cls.HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    @classmethod
+    def _hedged_request_json(cls, url: str, profile: str) -> Dict[str, Any]:
+        """`_request_json`, duplicated if slower than usual for its
+        `profile` (see `Hedger`); the losing request's client is closed,
+        which aborts it."""
+        clients = [httpx.Client(), httpx.Client()]
+        # Attempts run on the hedger's threads, at this context's priority
+        context = copy_context()
+        try:
+            return cls._hedger.run(
+                profile,
+                lambda i: context.copy().run(cls._request_json, url, client=clients[i]),
+                cancel=lambda i: clients[i].close(),
+            )
+        finally:
+            for client in clients:
+                client.close()
+
+    @classmethod
+    def _profile_of(cls, url: str) -> str:
+        """Name of the field profile `url` was built with, "editions"
+        for a key-based edition fetch, or "custom"."""
+        if url.startswith(cls.BOOKS_URL):
+            return "editions"
+        fields = parse_qs(urlparse(url).query).get("fields", [""])[0].split(",")
+        matches = [
+            name for name, base in cls.FIELD_PROFILES.items()
+            if fields[:len(base)] == base
+        ]
+        return max(matches, key=lambda name: len(cls.FIELD_PROFILES[name]), default="custom")
+
+    @staticmethod
+    def _edition_lookup(url: str) -> Optional[tuple]:
+        """(fields, edition ids) if `url` only looks editions up by id."""
+        params = parse_qs(urlparse(url).query)
+        match = _EDITION_QUERY.match(params.get("q", [""])[0])
+        if match is None:
+            return None
+        return params.get("fields", [""])[0], [int(olid.strip("OLM")) for olid in match.group(1).split(" OR ")]
+
+    @classmethod
+    def _remember(cls, url: str, data):
+        if not isinstance(data, dict):
+            return
+        cls._known_good.set(url, (time.monotonic(), data))
+        if (lookup := cls._edition_lookup(url)) is None:
+            return
+        fields, _ = lookup
+        for doc in data.get("docs") or []:
+            try:
+                edition = int(doc["editions"]["docs"][0]["key"].rsplit("/", 1)[-1].strip("OLM"))
+            except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+                continue
+            cls._edition_docs.set((fields, edition), doc)
+
+    @classmethod
+    def _fallback(cls, url: str) -> Dict[str, Any]:
+        if (entry := cls._known_good.get(url)) is not None:
+            metrics.incr("openlibrary.stale", source="query")
+            return entry[1]
+        if (lookup := cls._edition_lookup(url)) is not None:
+            fields, editions = lookup
+            docs = [doc for edition in editions if (doc := cls._edition_docs.get((fields, edition))) is not None]
+            if docs:
+                metrics.incr("openlibrary.stale", source="editions")
+                return {"numFound": len(docs), "docs": docs}
+        return {}
+
+
+class OpenLibraryID(str):
+    """A string of the form `OL[0-9]+M` which, when cast to int,
+    returns only the [0-9]+ value, e.g. int(OpenLibraryID("OL123M")) == 123.
+    """
+    __slots__ = ()
+
+    def __int__(self):
+        return int(self.strip("OLM"))
+
+
+class _Records(list):
+    """A list whose dict elements have been wrapped as records."""
+    __slots__ = ()
+
 
-    
 class OpenLibraryRecord(dict):
+    """An Open Library search doc with attribute access.
+
+    Nested dicts are wrapped lazily, on first access, and the wrapper
+    is stored in place of the raw dict so later accesses reuse it; a
+    record built from a 250-doc search response costs one shallow
+    dict copy per doc until its fields are actually read.
+    """
+
     def __init__(self, data=None, **kwargs):
-        data = data or {}
-        super().__init__()
-        for key, value in {**data, **kwargs}.items():
-            self[key] = self._wrap(value)
+        super().__init__(data or {}, **kwargs)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if type(value) is dict or type(value) is list:
+            value = self._wrap(value)
+            super().__setitem__(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == 'editions':
+            # `edition` and `olid` are derived from it
+            self.__dict__.pop('edition', None)
+            self.__dict__.pop('olid', None)
+        super().__setitem__(key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        self._wrap_all()
+        return super().values()
+
+    def items(self):
+        self._wrap_all()
+        return super().items()
+
+    def _wrap_all(self):
+        for key in self:
+            self[key]
 
     @property
     def cover_url(self) -> Optional[str]:
         if cover_i := self.edition.get('cover_i'):
             return f"{OpenLibrary.COVER_SERVER}/b/id/{cover_i}-M.jpg"
-    
-    @property
-    def edition(self) -> Optional[str]:
+
+    @cached_property
+    def edition(self) -> Optional["OpenLibraryRecord"]:
         return self.editions['docs'][0]
-        
-    @property
-    def olid(self) -> Optional[str]:
-        """Uses a helper class OpenLibraryID to return a special
-        string of the re form `OL[0-9]+M` which, when cast to int will
-        return only the [0-9]+ value
-        """
-        class OpenLibraryID(str):
-            def __new__(cls, value):
-                return super().__new__(cls, value)
-            def __int__(self):
-                # e.g., "OL123M" -> 123
-                return int(self.strip("OLM"))
+
+    @cached_property
+    def olid(self) -> Optional[OpenLibraryID]:
         return OpenLibraryID(self.edition.key.split('/')[-1])
 
     @property
@@ -119,7 +489,7 @@ class OpenLibraryRecord(dict):
                 raise AttributeError(f"'OpenLibraryRecord' object has no attribute '{key}'")
 
     def __setattr__(self, key, value):
-        self[key] = self._wrap(value)
+        self[key] = value
 
     def __delattr__(self, key):
         try:
@@ -128,16 +498,23 @@ class OpenLibraryRecord(dict):
             raise AttributeError(f"'OpenLibraryRecord' object has no attribute '{key}'")
 
     def __add__(self, other):
+        """A new record with `other`'s keys merged in. Values are shared,
+        not copied or re-wrapped: nested records already wrapped in
+        `self` are reused as they are."""
         if isinstance(other, dict):
-            merged = dict(self)  # create a copy
-            merged.update(other)
-            return OpenLibraryRecord(merged)
+            merged = OpenLibraryRecord(self)
+            dict.update(merged, other)
+            if 'editions' not in other:
+                merged.__dict__.update(self.__dict__)
+            return merged
         return NotImplemented
 
     @classmethod
     def _wrap(cls, value):
-        if isinstance(value, dict):
+        """Wraps one level: dicts become (lazy) records, lists have
+        their dict elements wrapped."""
+        if type(value) is dict:
             return cls(value)
-        elif isinstance(value, list):
-            return [cls._wrap(v) for v in value]
+        if type(value) is list:
+            return _Records(cls._wrap(v) if type(v) is dict or type(v) is list else v for v in value)
         return value
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+    Catalog search planning for Lenny
+
+    Lenny searches Open Library for the editions of its own catalog
+    that match a query, using one of two strategies:
+
+    - `batched`: '{query} AND edition_key:(OL1M OR ...)' per batch of
+      catalog ids, until enough matches are found. Cheap for small
+      catalogs and broad queries, but a selective query on a large
+      catalog walks through every batch.
+    - `intersect`: the unfiltered query, paged, each work's
+      `edition_key` list intersected with the in-memory catalog index.
+      Cheap when the query matches few works, whatever the catalog size.
+
+    `SearchPlanner` probes the query once (the probe doubles as the
+    first `intersect` page), estimates the cost of each strategy from
+    `numFound`, the probe's local hit rate and the per-request latency
+    observed so far, and runs the cheaper one.
+
+    Results are paged with opaque cursors recording the strategy and
+    where it stopped (the batch and the position within it, or the
+    upstream page and position), so page N+1 costs one page of work.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import base64
+import hashlib
+import json
+import math
+from typing import Optional
+
+from lenny.configs import SEARCH_STRATEGY
+from lenny.core.metrics import metrics
+from lenny.core.openlibrary import OpenLibrary
+
+
+class SearchPlanner:
+
+    BATCHED = "batched"
+    INTERSECT = "intersect"
+    STRATEGIES = (BATCHED, INTERSECT)
+
+    BATCH_SIZE = 250
+    PAGE_SIZE = 500
+    INTERSECT_FIELDS = ["key", "edition_key"]
+
+    # Seconds per upstream request assumed until MIN_OBSERVATIONS
+    # requests of a strategy have been timed
+    PRIOR_LATENCY = {BATCHED: 0.5, INTERSECT: 1.0}
+    MIN_OBSERVATIONS = 10
+
+    def __init__(self, index, batch_size: Optional[int] = None, strategy: str = SEARCH_STRATEGY):
+        self.index = index
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.strategy = strategy if strategy in self.STRATEGIES else None
+
+    def request_latency(self, strategy: str) -> float:
+        summary = metrics.summary("search.request", strategy=strategy)
+        if summary and len(summary.recent) >= self.MIN_OBSERVATIONS:
+            return summary.mean
+        return self.PRIOR_LATENCY[strategy]
+
+    def estimate(self, limit: int, num_found: int, docs: int, hits: int) -> dict:
+        """Estimated seconds each strategy still needs to find `limit`
+        matches, given a probe that returned `docs` of `num_found` works
+        containing `hits` catalog editions."""
+        batches = math.ceil(len(self.index) / self.batch_size)
+        pages = math.ceil(num_found / self.PAGE_SIZE)
+        matches = hits * num_found / docs if docs else 0
+        if hits >= limit or pages <= 1:
+            remaining_pages = 0
+        elif hits:
+            remaining_pages = min(pages - 1, math.ceil((limit - hits) / hits))
+        else:
+            remaining_pages = pages - 1
+        # Matches are spread evenly over the batches of catalog ids
+        needed_batches = batches if matches < limit else math.ceil(batches * limit / matches)
+        return {
+            self.BATCHED: needed_batches * self.request_latency(self.BATCHED),
+            self.INTERSECT: remaining_pages * self.request_latency(self.INTERSECT),
+        }
+
+    def search(self, query: str, limit: int, cursor: Optional[dict] = None) -> tuple[str, list, Optional[dict]]:
+        """Returns (strategy, matching catalog edition ids in relevance
+        order, at most `limit`, and the position to resume from for the
+        next page or None). A `cursor` from a previous page resumes its
+        strategy where it stopped, without re-planning."""
+        if cursor is not None:
+            if cursor["s"] == self.BATCHED:
+                return self.run(self.BATCHED, self.batched, query, limit, start=cursor["at"])
+            return self.run(self.INTERSECT, self.intersect, query, limit, start=cursor["at"])
+
+        batches = math.ceil(len(self.index) / self.batch_size)
+        if self.strategy == self.BATCHED or (self.strategy is None and batches <= 1):
+            return self.run(self.BATCHED, self.batched, query, limit)
+        if self.strategy == self.INTERSECT:
+            return self.run(self.INTERSECT, self.intersect, query, limit)
+
+        with metrics.timer("search.request", strategy=self.INTERSECT):
+            probe = self.page(query, 1)
+        docs = probe.get("docs") or []
+        hits = len(self.matches(docs))
+        costs = self.estimate(limit, probe.get("numFound") or 0, len(docs), hits)
+        strategy = min(costs, key=costs.get)
+        if strategy == self.INTERSECT:
+            return self.run(strategy, self.intersect, query, limit, probe=probe)
+        return self.run(strategy, self.batched, query, limit)
+
+    def run(self, strategy, method, query, limit, **kwargs):
+        metrics.incr("search.plan", strategy=strategy)
+        with metrics.timer("search.latency", strategy=strategy):
+            found, resume = method(query, limit, **kwargs)
+        return strategy, found, {"s": strategy, "at": resume} if resume else None
+
+    def batched(self, query: str, limit: int, start: Optional[list] = None) -> tuple[list, Optional[list]]:
+        """Searches batch after batch of catalog ids. `start` is the
+        [first edition of a batch, matches of it already returned]."""
+        anchor, skip = start or (None, 0)
+        found = []
+        for batch in self.index.batches(self.batch_size, start=anchor):
+            edition_keys = " OR ".join(f"OL{olid}M" for olid in batch)
+            with metrics.timer("search.request", strategy=self.BATCHED):
+                editions = list(OpenLibrary.search_ids(
+                    query=f"{query} AND edition_key:({edition_keys})", limit=self.batch_size
+                ))
+            matched = []
+            for edition in editions:
+                if edition in self.index and edition not in matched:
+                    matched.append(edition)
+            for pos in range(skip, len(matched)):
+                found.append(matched[pos])
+                if len(found) >= limit:
+                    if pos + 1 < len(matched):
+                        return found, [batch[0], pos + 1]
+                    return found, [batch[-1] + 1, 0] if batch[-1] < self.index.editions[-1] else None
+            skip = 0
+        return found, None
+
+    def page(self, query: str, page: int) -> dict:
+        return OpenLibrary.search_json(
+            query, fields=self.INTERSECT_FIELDS, page=page, limit=self.PAGE_SIZE, profile=None
+        ) or {}
+
+    def matches(self, docs) -> list:
+        """Catalog editions of the works in `docs`, in order."""
+        found, seen = [], set()
+        for doc in docs:
+            for key in doc.get("edition_key") or []:
+                try:
+                    edition = int(str(key).strip("OLM"))
+                except ValueError:
+                    continue
+                if edition not in seen and edition in self.index:
+                    seen.add(edition)
+                    found.append(edition)
+        return found
+
+    def intersect(self, query: str, limit: int, probe: Optional[dict] = None, start: Optional[list] = None) -> tuple[list, Optional[list]]:
+        """Pages through the unfiltered query. `start` is the [page,
+        matches of it already returned]."""
+        page, skip = start or (1, 0)
+        found = []
+        while True:
+            if probe is None:
+                with metrics.timer("search.request", strategy=self.INTERSECT):
+                    probe = self.page(query, page)
+            docs = probe.get("docs") or []
+            matched = self.matches(docs)
+            last_page = len(docs) < self.PAGE_SIZE
+            for pos in range(skip, len(matched)):
+                found.append(matched[pos])
+                if len(found) >= limit:
+                    if pos + 1 < len(matched):
+                        return found, [page, pos + 1]
+                    return found, None if last_page else [page + 1, 0]
+            if last_page:
+                return found, None
+            probe, page, skip = None, page + 1, 0
+
+
+def encode_cursor(position: dict, query: str) -> str:
+    """Opaque, URL-safe cursor for a planner `position`, bound to the
+    (normalized) `query` it was produced for."""
+    payload = {**position, "q": hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, query: str) -> dict:
+    """Inverse of `encode_cursor`. Raises ValueError if the cursor is
+    malformed or was issued for another query."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        valid = (
+            position["s"] in SearchPlanner.STRATEGIES
+            and len(position["at"]) == 2
+            and all(isinstance(n, int) for n in position["at"])
+        )
+    except (ValueError, TypeError, KeyError):
+        valid = False
+    if not valid:
+        raise ValueError("Invalid search cursor")
+    if position.get("q") != hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]:
+        raise ValueError("Search cursor belongs to another query")
+    return {"s": position["s"], "at": position["at"]}
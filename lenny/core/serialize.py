@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+    JSON serialization of OPDS documents for Lenny
+
+    Uses orjson when it is installed (falling back to the stdlib
+    json module), caches the serialized bytes of long-lived documents
+    and publications, and can encode a feed incrementally so large
+    catalogs are streamed one publication at a time.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import json
+from typing import Any, Iterator
+
+from lenny.core.cache import TTLCache
+from lenny.configs import FEED_CACHE_TTL
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# Feeds with at least this many publications are streamed
+STREAM_THRESHOLD = 200
+
+# Publications of shared feeds (see `share`) and their serialized bytes
+# (None until first encoded), keyed by object identity. Entries hold a
+# reference to their object, so an id() can't be recycled while cached.
+FRAGMENTS = TTLCache(maxsize=8192, ttl=FEED_CACHE_TTL)
+
+
+def dumps(obj: Any) -> bytes:
+    """Serializes `obj` to compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def share(feed: Any) -> None:
+    """Declares the publications of `feed` shared: cached and never
+    mutated again, like those of `LennyAPI.base_feed` pages. Only their
+    encoding is reused by `fragment`.
+    """
+    publications = feed.get("publications") if isinstance(feed, dict) else None
+    for publication in publications if isinstance(publications, list) else ():
+        FRAGMENTS.set(id(publication), (publication, None))
+
+
+def fragment(obj: Any) -> bytes:
+    """Like `dumps`, but a shared publication (see `share`) is only
+    encoded once; anything else is encoded on every call.
+    """
+    entry = FRAGMENTS.get(id(obj))
+    if entry is None or entry[0] is not obj:
+        return dumps(obj)
+    if entry[1] is None:
+        entry = FRAGMENTS.set(id(obj), (obj, dumps(obj)))
+    return entry[1]
+
+
+def should_stream(feed: Any) -> bool:
+    publications = feed.get("publications") if isinstance(feed, dict) else None
+    return isinstance(publications, list) and len(publications) >= STREAM_THRESHOLD
+
+
+def iter_feed(feed: dict) -> Iterator[bytes]:
+    """Yields the JSON encoding of an OPDS `feed` incrementally: its
+    envelope (metadata, links, navigation...) first, then one
+    publication fragment at a time, so the whole document never has
+    to exist as a single string.
+    """
+    publications = feed.get("publications") if isinstance(feed, dict) else None
+    if not isinstance(publications, list):
+        yield dumps(feed)
+        return
+    envelope = dumps({k: v for k, v in feed.items() if k != "publications"})
+    yield envelope[:-1] + (b',"publications":[' if len(envelope) > 2 else b'"publications":[')
+    for i, publication in enumerate(publications):
+        yield b"," + fragment(publication) if i else fragment(publication)
+    yield b"]}"
+
+
+def encode_feed(feed: Any) -> bytes:
+    """Serializes an OPDS feed or publication in one piece, reusing
+    the fragments of any shared publications it holds.
+    """
+    if isinstance(feed, dict) and isinstance(feed.get("publications"), list):
+        return b"".join(iter_feed(feed))
+    return dumps(feed)
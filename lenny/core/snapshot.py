@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+    Offline Open Library snapshot import for Lenny
+
+    Fills the local metadata mirror (`Edition`, and the language and
+    subject facets) from a downloaded Open Library dump instead of live
+    searches. The dump (`ol_dump_editions_*.txt.gz`: tab-separated type,
+    key, revision, last modified and JSON record; or JSON lines, gzipped
+    or not) is streamed one line at a time, in a single pass: each
+    line's edition id is read from its key and checked against the set
+    of catalog ids before its JSON is parsed, so the many records of
+    editions Lenny doesn't hold cost a string split each. Matches are
+    bulk loaded `BATCH_SIZE` at a time. Memory grows with the catalog,
+    never with the dump.
+
+    Editions only reference their authors by key: given the authors
+    dump as well, a second pass resolves the names of the authors of
+    the imported editions.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import gzip
+import json
+import logging
+import re
+from typing import Iterable, Iterator, Optional, TextIO, Tuple
+
+from lenny.core.db import session as db
+from lenny.core.models import Edition, Item
+
+logger = logging.getLogger(__name__)
+
+BOOKS = "books"
+AUTHORS = "authors"
+_KEYS = {BOOKS: r"/books/OL(\d+)M", AUTHORS: r"/authors/OL(\d+)A"}
+_TSV_KEYS = {kind: re.compile(key) for kind, key in _KEYS.items()}
+_JSON_KEYS = {kind: re.compile(rf'"key":\s*"{key}"') for kind, key in _KEYS.items()}
+
+# As LennyAPI.FACET_SUBJECTS_PER_ITEM
+SUBJECTS_PER_ITEM = 5
+
+
+def open_dump(path: str) -> TextIO:
+    """The dump at `path` as a stream of text lines, gunzipped on the
+    fly if its name ends with .gz."""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    return opener(path, "rt", encoding="utf-8", errors="replace")
+
+
+def _match(line: str, kind: str) -> Optional[Tuple[int, str]]:
+    """(id, JSON) of a dump line whose key is of `kind`, unparsed."""
+    if line.startswith("{"):
+        match = _JSON_KEYS[kind].search(line)
+        return (int(match.group(1)), line) if match else None
+    columns = line.split("\t", 4)
+    if len(columns) < 5:
+        return None
+    match = _TSV_KEYS[kind].fullmatch(columns[1])
+    return (int(match.group(1)), columns[4]) if match else None
+
+
+def scan(lines: Iterable[str], kind: str, wanted) -> Iterator[Tuple[int, dict]]:
+    """(id, record) of each `kind` (BOOKS or AUTHORS) record in dump
+    `lines` whose id is in `wanted`; the JSON of other records, and of
+    duplicates, is never parsed."""
+    seen = set()
+    for line in lines:
+        if (found := _match(line, kind)) is None:
+            continue
+        id, data = found
+        if id not in wanted or id in seen:
+            continue
+        try:
+            record = json.loads(data)
+        except ValueError:
+            logger.warning(f"Skipping unreadable {kind} record OL{id}")
+            continue
+        if isinstance(record, dict):
+            seen.add(id)
+            yield id, record
+
+
+def _key_ids(refs, kind: str) -> list:
+    """Ids of `refs`, a dump record's list of {"key": ...} references."""
+    ids = []
+    for ref in refs or []:
+        key = ref.get("key") if isinstance(ref, dict) else None
+        if isinstance(key, str) and (match := _TSV_KEYS[kind].fullmatch(key)):
+            ids.append(int(match.group(1)))
+    return ids
+
+
+class SnapshotImporter:
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, editions: Iterable[int], batch_size: Optional[int] = None):
+        self.wanted = set(editions)
+        self.batch_size = batch_size or self.BATCH_SIZE
+        # Imported edition -> its author ids, for `import_authors`
+        self.authors = {}
+
+    def import_editions(self, lines: Iterable[str]) -> int:
+        """Imports the catalog editions of an editions dump; returns
+        how many were found."""
+        batch, imported = [], 0
+        for edition, record in scan(lines, BOOKS, self.wanted):
+            title = record.get("title")
+            if not isinstance(title, str) or not title:
+                continue
+            languages = [key.rsplit("/", 1)[-1] for key in (
+                ref.get("key") for ref in record.get("languages") or [] if isinstance(ref, dict)
+            ) if isinstance(key, str)]
+            subjects = [s for s in record.get("subjects") or [] if isinstance(s, str)]
+            self.authors[edition] = _key_ids(record.get("authors"), AUTHORS)
+            batch.append((edition, title, languages, subjects[:SUBJECTS_PER_ITEM]))
+            if len(batch) >= self.batch_size:
+                imported += self._load(batch)
+                batch = []
+        return imported + self._load(batch)
+
+    def _load(self, batch: list) -> int:
+        if not batch:
+            return 0
+        Edition.bulk_upsert((edition, title) for edition, title, _, _ in batch)
+        items = Item.get_editions([edition for edition, *_ in batch])
+        for edition, _, languages, subjects in batch:
+            if (item := items.get(edition)) is None:
+                continue
+            # The dump may lack what a search would find: keep those
+            if languages:
+                item.set_facets("language", languages)
+            if subjects:
+                item.set_facets("subject", subjects)
+        db.commit()
+        logger.info(f"Imported {len(batch)} editions")
+        return len(batch)
+
+    def import_authors(self, lines: Iterable[str]) -> int:
+        """Resolves the author names of the editions imported so far
+        from an authors dump; returns how many editions got authors."""
+        wanted = {author for authors in self.authors.values() for author in authors}
+        names = {}
+        for author, record in scan(lines, AUTHORS, wanted):
+            if isinstance(name := record.get("name"), str) and name:
+                names[author] = name
+        rows = [
+            (edition, [names[a] for a in authors if a in names])
+            for edition, authors in self.authors.items()
+            if any(a in names for a in authors)
+        ]
+        for i in range(0, len(rows), self.batch_size):
+            Edition.set_authors(rows[i:i + self.batch_size])
+            db.commit()
+        return len(rows)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+"""
+    Local stand-in for Lenny's upstream services
+
+    A single HTTP server standing in for Open Library, the Readium
+    manifest service and the OTP server, each under its own path
+    prefix, so Lenny can run without a network:
+
+        LENNY_OPENLIBRARY_URL=http://localhost:8090/openlibrary
+        LENNY_READIUM_URL=http://localhost:8090/readium
+        OTP_SERVER=http://localhost:8090/otp
+
+    In `record` mode, requests are forwarded to the real upstream and
+    each response is saved as a cassette (a JSON file per distinct
+    request); in `replay` mode, responses come from the cassettes
+    alone, and a request never recorded gets a 404. In both modes,
+    `latency` seconds (plus up to `jitter` more) are added to every
+    response and a share `error_rate` of requests fail with a 503, for
+    load and latency experiments on an isolated box.
+
+    The OPDS provider (pyopds2_lenny) requests Open Library itself,
+    at a URL Lenny can't configure. To send its requests to the
+    stand-in as well, run Lenny through `lenny_app`, which `redirect`s
+    whatever `requests` and `httpx` send to the real upstreams:
+
+        LENNY_STANDIN_URL=http://localhost:8090 uvicorn --factory lenny.core.standin:lenny_app
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import httpx
+
+from lenny.configs import READIUM_PORT, STANDIN_URL
+
+logger = logging.getLogger(__name__)
+
+RECORD = "record"
+REPLAY = "replay"
+
+# Path prefix -> the real upstream it stands in for
+UPSTREAMS = {
+    "openlibrary": "https://openlibrary.org",
+    "readium": f"http://lenny_readium:{READIUM_PORT}",
+    "otp": "https://staging.openlibrary.org",
+}
+
+# Request headers not forwarded upstream when recording
+_HOP_HEADERS = {"host", "content-length", "connection", "accept-encoding", "transfer-encoding"}
+
+
+class StandIn:
+
+    TIMEOUT = 30
+
+    def __init__(self, cassettes: str, mode: str = REPLAY, upstreams: Optional[Dict[str, str]] = None,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown stand-in mode: {mode}")
+        self.cassettes = Path(cassettes)
+        self.mode = mode
+        self.upstreams = {**UPSTREAMS, **(upstreams or {})}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        # Requests received per upstream
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method: str, path: str, query: str = "", body: bytes = b"") -> str:
+        """Cassette name of a request: identical requests, whatever
+        the order of their query parameters, share it."""
+        query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+        digest = hashlib.sha256(f"{method.upper()} {path}?{query}\n".encode() + (body or b""))
+        return digest.hexdigest()[:32]
+
+    def cassette(self, upstream: str, key: str) -> Path:
+        return self.cassettes / upstream / f"{key}.json"
+
+    def handle(self, method: str, target: str, headers: Dict[str, str], body: bytes = b"") -> Tuple[int, str, bytes]:
+        """(status, content type, body) of the response to a request
+        for `target`, e.g. "/openlibrary/search.json?q=moby"."""
+        url = urlsplit(target)
+        upstream, _, path = url.path.lstrip("/").partition("/")
+        path = f"/{path}"
+        if upstream not in self.upstreams:
+            return 404, "application/json", json.dumps({"error": f"No upstream {upstream!r}"}).encode()
+        with self._lock:
+            self.calls[upstream] += 1
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.uniform(0, self.jitter))
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 503, "application/json", json.dumps({"error": "Injected failure"}).encode()
+
+        cassette = self.cassette(upstream, self.key(method, path, url.query, body))
+        if self.mode == RECORD:
+            return self._record(cassette, method, f"{self.upstreams[upstream]}{path}", url.query, headers, body)
+        if not cassette.exists():
+            logger.warning(f"No recording of {method} {target}")
+            return 404, "application/json", json.dumps({"error": "Not recorded"}).encode()
+        recorded = json.loads(cassette.read_text())
+        return recorded["status"], recorded["content_type"], base64.b64decode(recorded["body"])
+
+    def _record(self, cassette: Path, method: str, url: str, query: str, headers: Dict[str, str], body: bytes):
+        headers = {k: v for k, v in headers.items() if k.lower() not in _HOP_HEADERS}
+        try:
+            with httpx.Client(verify=False, timeout=self.TIMEOUT) as client:
+                response = client.request(
+                    method, f"{url}?{query}" if query else url,
+                    headers=headers, content=body or None, follow_redirects=True,
+                )
+        except httpx.HTTPError as e:
+            logger.error(f"Error recording {method} {url}: {e}")
+            return 502, "application/json", json.dumps({"error": str(e)}).encode()
+        content_type = response.headers.get("content-type", "application/octet-stream")
+        recorded = {
+            "method": method,
+            "url": str(response.request.url),
+            "status": response.status_code,
+            "content_type": content_type,
+            "body": base64.b64encode(response.content).decode(),
+        }
+        # Written aside then moved, so a concurrent replay never reads half a file
+        cassette.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cassette.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(recorded, f)
+        os.replace(tmp, cassette)
+        return response.status_code, content_type, response.content
+
+    def server(self, host: str = "127.0.0.1", port: int = 8090) -> ThreadingHTTPServer:
+        """An HTTP server for the stand-in, to be started with
+        `serve_forever()`."""
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, content_type, content = standin.handle(self.command, self.path, dict(self.headers), body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+
+def redirect(base_url: str, upstreams: Optional[Dict[str, str]] = None) -> Callable[[], None]:
+    """Sends the requests `requests` and `httpx` make to the real
+    upstreams to the stand-in at `base_url` instead, e.g.
+    https://openlibrary.org/search.json to <base_url>/openlibrary/search.json.
+    Never to be used in the stand-in's own process, whose recordings
+    must reach the real upstreams. Returns a function undoing it."""
+    import requests
+
+    prefixes = {
+        real.rstrip("/"): f"{base_url.rstrip('/')}/{name}"
+        for name, real in {**UPSTREAMS, **(upstreams or {})}.items()
+    }
+
+    def rewrite(url: str) -> str:
+        for real, local in prefixes.items():
+            if url == real or url.startswith((f"{real}/", f"{real}?")):
+                return local + url[len(real):]
+        return url
+
+    send = requests.Session.request
+    build = {client: client.build_request for client in (httpx.Client, httpx.AsyncClient)}
+
+    def request(self, method, url, *args, **kwargs):
+        return send(self, method, rewrite(str(url)), *args, **kwargs)
+
+    def build_request(client):
+        def wrapper(self, method, url, **kwargs):
+            request = build[client](self, method, url, **kwargs)
+            if (target := rewrite(str(request.url))) != str(request.url):
+                request.url = httpx.URL(target)
+                request.headers["Host"] = request.url.netloc.decode("ascii")
+            return request
+        return wrapper
+
+    requests.Session.request = request
+    for client in build:
+        client.build_request = build_request(client)
+
+    def undo():
+        requests.Session.request = send
+        for client, original in build.items():
+            client.build_request = original
+    return undo
+
+
+def lenny_app():
+    """Lenny's ASGI app, with all its upstream requests sent to the
+    stand-in at `LENNY_STANDIN_URL` (for uvicorn's --factory)."""
+    if STANDIN_URL:
+        redirect(STANDIN_URL)
+    from lenny.app import app
+    return app
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""
+    Typeahead suggestions for Lenny
+
+    Serves as-you-type title and author suggestions from memory, with
+    no Open Library request: a sorted prefix array of normalized keys
+    (each title, the words of a title onwards, and each author name)
+    searched with `bisect`, built from the locally mirrored `Edition`
+    metadata of catalog editions.
+
+    The index is updated in place when a book is added in this worker,
+    and catches up with other workers' additions and removals through
+    `Edition.updated_at` and the catalog change log, checked at most
+    once every `REFRESH_INTERVAL` seconds. Its size is capped by
+    `MAX_ENTRIES`: past it, only whole titles and authors are indexed.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from datetime import timedelta
+from typing import Iterable
+
+from lenny.core.models import Edition, Change, ChangeEnum
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Lowercases, strips accents and collapses punctuation/whitespace,
+    so "Les Misérables," and "les miserables" share a key."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(_WORD.findall(text.casefold()))
+
+
+class SuggestIndex:
+
+    TITLE = "title"
+    AUTHOR = "author"
+
+    KEY_LENGTH = 64
+    # Word offsets of a title indexed, so "potter" finds "Harry Potter"
+    MAX_WORDS = 8
+    MAX_ENTRIES = 2_000_000
+    REFRESH_INTERVAL = 2.0
+    SETTLE = 10
+
+    def __init__(self):
+        self.keys = []      # sorted normalized keys
+        self.entries = []   # parallel (edition, kind, text)
+        self.editions = {}  # edition -> (title, authors)
+        self.stamp = None
+        self.token = None
+        self.checked = 0.0
+        self._lock = threading.RLock()
+
+    def _keys(self, edition: int, title: str, authors: Iterable[str], full: bool = False):
+        words = normalize(title).split()
+        for start in range(1 if full else min(len(words), self.MAX_WORDS)):
+            yield " ".join(words[start:])[:self.KEY_LENGTH], (edition, self.TITLE, title)
+        for author in authors:
+            if key := normalize(author)[:self.KEY_LENGTH]:
+                yield key, (edition, self.AUTHOR, author)
+
+    def add(self, edition: int, title: str, authors: Iterable[str] = ()):
+        """Indexes (or re-indexes) one edition."""
+        authors = list(authors or [])
+        with self._lock:
+            if self.editions.get(edition) == (title, authors):
+                return
+            if edition in self.editions:
+                self.remove(edition)
+            self.editions[edition] = (title, authors)
+            for key, entry in self._keys(edition, title, authors, full=len(self.keys) >= self.MAX_ENTRIES):
+                i = bisect_left(self.keys, key)
+                self.keys.insert(i, key)
+                self.entries.insert(i, entry)
+
+    def remove(self, edition: int):
+        with self._lock:
+            if self.editions.pop(edition, None) is None:
+                return
+            kept = [(k, e) for k, e in zip(self.keys, self.entries) if e[0] != edition]
+            self.keys = [k for k, _ in kept]
+            self.entries = [e for _, e in kept]
+
+    def load(self, rows: Iterable[tuple]):
+        """Replaces the index with `rows` of (edition, title, authors)."""
+        pairs, editions = [], {}
+        for edition, title, authors in rows:
+            editions[edition] = (title, list(authors or []))
+            pairs.extend(self._keys(edition, title, authors or [], full=len(pairs) >= self.MAX_ENTRIES))
+        pairs.sort()
+        with self._lock:
+            self.keys = [key for key, _ in pairs]
+            self.entries = [entry for _, entry in pairs]
+            self.editions = editions
+
+    def refresh(self, force: bool = False) -> "SuggestIndex":
+        """Catches up with metadata and removals from other workers, at
+        most once per `REFRESH_INTERVAL`; returns the index."""
+        now = time.monotonic()
+        if not force and now - self.checked < self.REFRESH_INTERVAL:
+            return self
+        with self._lock:
+            self.checked = now
+            stamp = Edition.latest_update()
+            if self.token is None:
+                self.token = Change.latest_token()
+                self.load(row[:3] for row in Edition.in_catalog())
+            else:
+                # Look back SETTLE seconds: a transaction stamped before
+                # the last refresh may have committed after it
+                since = self.stamp - timedelta(seconds=self.SETTLE) if self.stamp else None
+                for edition, title, authors, _ in Edition.in_catalog(updated_since=since):
+                    self.add(edition, title, authors)
+                # Only past the changes applied: one committed late is
+                # held back by the change cursor, not stepped over
+                added = set()
+                for change in Change.since(self.token):
+                    if change.kind == ChangeEnum.REMOVED:
+                        self.remove(change.openlibrary_edition)
+                        added.discard(change.openlibrary_edition)
+                    elif change.kind == ChangeEnum.ADDED:
+                        added.add(change.openlibrary_edition)
+                    self.token = change.id
+                # A removed and re-uploaded book keeps its (unchanged)
+                # metadata, so it isn't among the updated editions above
+                if added:
+                    for edition, title, authors, _ in Edition.in_catalog(editions=added):
+                        self.add(edition, title, authors)
+            self.stamp = stamp
+        return self
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        """Up to `limit` distinct suggestions: titles (one per edition)
+        whose title, or a word of it onwards, starts with `prefix`, and
+        authors (one per name) whose name does."""
+        prefix = normalize(prefix)[:self.KEY_LENGTH]
+        if not prefix:
+            return []
+        found, seen = [], set()
+        with self._lock:
+            i = bisect_left(self.keys, prefix)
+            while i < len(self.keys) and len(found) < limit and self.keys[i].startswith(prefix):
+                edition, kind, text = self.entries[i]
+                seen_key = (kind, edition) if kind == self.TITLE else (kind, self.keys[i])
+                if seen_key not in seen:
+                    seen.add(seen_key)
+                    if kind == self.TITLE:
+                        title, authors = self.editions.get(edition, (text, []))
+                        found.append({"type": kind, "title": title, "authors": authors, "edition": edition})
+                    else:
+                        found.append({"type": kind, "author": text})
+                i += 1
+        return found
+
+    def __len__(self) -> int:
+        return len(self.editions)
+
+
+suggest_index = SuggestIndex()
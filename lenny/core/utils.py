@@ -1,6 +1,8 @@
 import base64
+import datetime
 import hashlib
 import logging
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
@@ -15,3 +17,20 @@ def encode_book_path(book_id: str, format=".epub") -> str:
 
 def hash_email(email: str) -> str:
     return hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()
+
+def make_etag(*parts) -> str:
+    """Returns a strong ETag (quoted) derived from the repr of `parts`."""
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return f'"{digest}"'
+
+def latest(*timestamps) -> Optional[datetime.datetime]:
+    """Returns the most recent of `timestamps` as an aware UTC
+    datetime truncated to seconds (the resolution of HTTP dates),
+    ignoring None. Naive values are assumed to already be UTC.
+    """
+    aware = [
+        (ts if ts.tzinfo else ts.replace(tzinfo=datetime.timezone.utc))
+        .astimezone(datetime.timezone.utc).replace(microsecond=0)
+        for ts in timestamps if ts is not None
+    ]
+    return max(aware) if aware else None
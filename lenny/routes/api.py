@@ -8,8 +8,10 @@
     :license: see LICENSE for more details
 """
 
+import asyncio
 import json
 import httpx
+from email.utils import format_datetime, parsedate_to_datetime
 from functools import wraps
 from typing import Optional, Generator, List
 from urllib.parse import urlencode
@@ -22,15 +24,19 @@ from fastapi import (
     HTTPException,
     status,
     Body,
-    Cookie
+    Cookie,
+    Header
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import (
     HTMLResponse,
     RedirectResponse,
     Response,
     JSONResponse,
+    StreamingResponse,
 )
-from lenny.core import auth
+from lenny.core import auth, serialize, compression, events
+from lenny.core.metrics import metrics
 from lenny.core.api import LennyAPI
 from lenny import configs
 from pyopds2_lenny import LennyDataProvider, build_post_borrow_publication, LennyDataRecord
@@ -47,6 +53,7 @@ from lenny.core.exceptions import (
     BookUnavailableError,
 )
 from lenny.core.readium import ReadiumAPI
+from lenny.core.openlibrary import OpenLibrary
 from lenny.core.models import Item
 from urllib.parse import quote
 COOKIES_MAX_AGE = 604800  # 1 week
@@ -90,6 +97,111 @@ def is_direct_auth_mode(auth_mode: Optional[str] = None, beta: bool = False) ->
     return (auth_mode == "direct") or beta or configs.AUTH_MODE_DIRECT
 
 
+def is_not_modified(request: Request, etag: str, last_modified=None) -> bool:
+    """Evaluates If-None-Match (preferred) or If-Modified-Since against
+    the current validators of a resource, per RFC 9110 section 13.2.2."""
+    if if_none_match := request.headers.get("if-none-match"):
+        tags = {
+            compression.strip_variant(tag.strip().removeprefix("W/"))
+            for tag in if_none_match.split(",")
+        }
+        return "*" in tags or etag in tags
+    if (if_modified_since := request.headers.get("if-modified-since")) and last_modified:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def validator_headers(etag: str, last_modified=None, private: bool = False) -> dict:
+    """Headers which let OPDS clients revalidate instead of refetching."""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache" if private else "no-cache",
+    }
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def body_key(request: Optional[Request], media_type: str, etag: str) -> tuple:
+    """Key of a serialized body in `compression.BODIES`: an ETag only
+    identifies a version of one resource, in one media type."""
+    return (request.url.path if request is not None else None, media_type, etag)
+
+
+def encoded_response(
+        request: Optional[Request], body: "compression.CompressedBody",
+        media_type: str, headers: Optional[dict] = None) -> Response:
+    """Sends `body` in the content-coding negotiated with the client."""
+    headers = dict(headers or {})
+    accept_encoding = request.headers.get("accept-encoding") if request is not None else None
+    content, encoding = body.encode(compression.negotiate(accept_encoding))
+    headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        if etag := headers.get("ETag"):
+            headers["ETag"] = compression.variant_etag(etag, encoding)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+def not_modified_response(
+        request: Request, headers: dict, media_type: str = "application/opds+json") -> Response:
+    """A 304 carrying the validators the 200 would have: the ETag of the
+    content-coding negotiated with the client, and `Vary`."""
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    encoding = compression.negotiate(request.headers.get("accept-encoding"))
+    # A cached body may be too small to compress; streamed feeds always are
+    if body := compression.BODIES.get(body_key(request, media_type, headers["ETag"])):
+        encoding = body.coding(encoding)
+    headers["ETag"] = compression.variant_etag(headers["ETag"], encoding)
+    return Response(status_code=304, headers=headers)
+
+
+def opds_response(
+        document, media_type: str = "application/opds+json", headers: Optional[dict] = None,
+        request: Optional[Request] = None, cache_key: Optional[str] = None) -> Response:
+    """Serializes (and compresses) an OPDS document, streaming
+    multi-hundred-entry feeds one publication at a time instead of
+    building one string. With a `cache_key` (the document's strong
+    ETag) the body and its compressed variants are kept for reuse
+    by `cached_opds_response`."""
+    if serialize.should_stream(document):
+        headers = dict(headers or {})
+        chunks = serialize.iter_feed(document)
+        accept_encoding = request.headers.get("accept-encoding") if request is not None else None
+        if encoding := compression.negotiate(accept_encoding):
+            chunks = compression.iter_compress(chunks, encoding)
+            headers["Content-Encoding"] = encoding
+            if etag := headers.get("ETag"):
+                headers["ETag"] = compression.variant_etag(etag, encoding)
+        headers["Vary"] = "Accept-Encoding"
+        return StreamingResponse(chunks, media_type=media_type, headers=headers)
+    body = compression.CompressedBody(serialize.encode_feed(document))
+    if cache_key:
+        compression.BODIES.set(body_key(request, media_type, cache_key), body)
+    return encoded_response(request, body, media_type, headers)
+
+
+def degraded_response(
+        document, media_type: str = "application/opds+json", request: Optional[Request] = None) -> Response:
+    """Sends a document built while Open Library failed without
+    validators, and uncacheable, so the next request rebuilds it
+    rather than revalidating a partial version."""
+    return opds_response(document, media_type=media_type, headers={"Cache-Control": "no-store"}, request=request)
+
+
+def cached_opds_response(
+        request: Request, cache_key: str, media_type: str = "application/opds+json",
+        headers: Optional[dict] = None) -> Optional[Response]:
+    """Returns the response for an already serialized version of a
+    document, or None if it has to be built."""
+    if body := compression.BODIES.get(body_key(request, media_type, cache_key)):
+        return encoded_response(request, body, media_type, headers)
+    return None
+
+
 router = APIRouter()
 
 def requires_item_auth(do_function=None):
@@ -136,31 +248,161 @@ async def get_items(fields: Optional[str]=None, offset: Optional[int]=None, limi
     )
 
 @router.get("/opds")
-async def get_opds_catalog(request: Request, offset: Optional[int]=None, limit: Optional[int]=None, beta: bool = False, auth_mode: Optional[str] = None, session: Optional[str] = Cookie(None)):
+async def get_opds_catalog(request: Request, offset: Optional[int]=None, limit: Optional[int]=None, beta: bool = False, auth_mode: Optional[str] = None, session: Optional[str] = Cookie(None), available: bool = False, access: Optional[str] = None, format: Optional[str] = None, language: Optional[str] = None, subject: Optional[str] = None):
+    if access and access not in Item.ACCESS_FILTERS:
+        raise HTTPException(status_code=400, detail=f"access must be one of: {', '.join(Item.ACCESS_FILTERS)}")
+    if format and format not in Item.FORMAT_FILTERS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(Item.FORMAT_FILTERS)}")
     session = extract_session(request, session)
     email = get_authenticated_email(request, session)
-    
-    return Response(
-        content=json.dumps(
-            LennyAPI.opds_feed(offset=offset, limit=limit, auth_mode_direct=is_direct_auth_mode(auth_mode, beta), email=email)
-        ),
-        media_type="application/opds+json"
+    auth_mode_direct = is_direct_auth_mode(auth_mode, beta)
+    filters = {"available": available, "access": access, "format": format, "language": language, "subject": subject}
+
+    etag, last_modified = LennyAPI.feed_validators(
+        offset=offset, limit=limit, auth_mode_direct=auth_mode_direct, email=email, **filters
     )
+    headers = validator_headers(etag, last_modified, private=bool(email))
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(request, headers)
+    if cached := cached_opds_response(request, etag, headers=headers):
+        return cached
+
+    # Off the event loop: Open Library requests may wait on the outbound limiter
+    with OpenLibrary.tracking() as upstream:
+        feed = await run_in_threadpool(
+            LennyAPI.opds_feed,
+            offset=offset, limit=limit, auth_mode_direct=auth_mode_direct, email=email, **filters
+        )
+    if upstream.degraded:
+        return degraded_response(feed, request=request)
+    return opds_response(feed, headers=headers, request=request, cache_key=etag)
 
 @router.get("/opds/search")
-async def opds_search(request: Request, query: Optional[str] = "", auth_mode: Optional[str] = None, beta: bool = False):
+async def opds_search(request: Request, query: Optional[str] = "", auth_mode: Optional[str] = None, beta: bool = False, cursor: Optional[str] = None, fulltext: bool = False, offset: Optional[int] = None):
     """
     OPDS 2.0 search endpoint. Public — no authentication required.
+    Further pages are reached through the feed's `next` link (`cursor`).
+    With `fulltext=true`, searches inside the text of open-access books.
     """
-    return Response(
-        content=json.dumps(
-            LennyAPI.search_feed(
-                query=query,
-                auth_mode_direct=is_direct_auth_mode(auth_mode, beta),
-            )
-        ),
-        media_type="application/opds+json"
+    if fulltext:
+        feed = await run_in_threadpool(
+            LennyAPI.fulltext_search_feed,
+            query=query,
+            offset=offset,
+            auth_mode_direct=is_direct_auth_mode(auth_mode, beta),
+        )
+        return opds_response(feed, request=request)
+    # Off the event loop, so identical concurrent searches can coalesce
+    try:
+        feed = await run_in_threadpool(
+            LennyAPI.search_feed,
+            query=query,
+            auth_mode_direct=is_direct_auth_mode(auth_mode, beta),
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return opds_response(feed, request=request)
+
+@router.get("/suggest")
+async def suggest(q: str = "", limit: Optional[int] = None):
+    """As-you-type title and author suggestions. Public, and served
+    from memory without any Open Library request."""
+    return await run_in_threadpool(LennyAPI.suggest, q, limit=limit)
+
+@router.get("/opds/changes")
+async def opds_changes(request: Request, since: Optional[int] = None, limit: Optional[int] = None, auth_mode: Optional[str] = None, beta: bool = False):
+    """
+    OPDS 2.0 delta-sync feed of the publications changed after sync
+    token `since`. Public — no authentication required.
+    """
+    feed = await run_in_threadpool(
+        LennyAPI.changes_feed,
+        since=since, limit=limit,
+        auth_mode_direct=is_direct_auth_mode(auth_mode, beta),
     )
+    return opds_response(feed, request=request)
+
+def parse_editions(editions: Optional[str]) -> list[int]:
+    """Parses a comma-separated list of edition ids (`123` or `OL123M`),
+    keeping their order and dropping duplicates."""
+    try:
+        return list(dict.fromkeys(
+            int(e.strip().upper().removeprefix("OL").removesuffix("M"))
+            for e in (editions or "").split(",") if e.strip()
+        ))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid edition id")
+
+@router.get("/opds/lookup")
+async def opds_lookup(request: Request, ids: str, session: Optional[str] = Cookie(None), auth_mode: Optional[str] = None, beta: bool = False):
+    """
+    Batch lookup of up to `LennyAPI.LOOKUP_LIMIT` publications by
+    comma-separated edition ids, with per-id availability. Public; an
+    authenticated patron also sees their own loans.
+    """
+    editions = parse_editions(ids)
+    if not editions:
+        raise HTTPException(status_code=400, detail="No edition ids given")
+    if len(editions) > LennyAPI.LOOKUP_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {LennyAPI.LOOKUP_LIMIT} edition ids per lookup")
+    email = get_authenticated_email(request, extract_session(request, session))
+    feed = await run_in_threadpool(
+        LennyAPI.lookup_feed,
+        editions,
+        auth_mode_direct=is_direct_auth_mode(auth_mode, beta),
+        email=email,
+    )
+    return opds_response(
+        feed,
+        headers={"Cache-Control": "private, no-cache" if email else "no-cache"},
+        request=request
+    )
+
+@router.get("/opds/events")
+async def opds_events(request: Request, editions: Optional[str] = None, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-sent stream of availability events (borrows, returns, items
+    added or removed), optionally restricted to `editions`. Clients
+    reconnecting with `Last-Event-ID` first receive what they missed.
+    Public — no authentication required.
+    """
+    watched = set(parse_editions(editions)) or None
+    if len(events.broker.subscribers) >= events.broker.max_subscribers:
+        raise HTTPException(status_code=503, detail="Too many event stream subscribers")
+
+    async def stream():
+        try:
+            with events.broker.subscribe(editions=watched) as subscriber:
+                yield "retry: 5000\n\n"
+                token = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+                if token is not None:
+                    # Its queries would block the event loop, and every stream on it
+                    missed = await run_in_threadpool(LennyAPI.availability_events, token, editions=watched)
+                    if missed is None:
+                        yield "event: reset\ndata: {}\n\n"
+                        return
+                    for payload in missed:
+                        token = payload["token"]
+                        yield events.format_event(payload)
+                while not await request.is_disconnected():
+                    try:
+                        payload = await subscriber.get(timeout=configs.EVENTS_HEARTBEAT)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                    if payload is events.DROPPED:
+                        yield "event: reset\ndata: {}\n\n"
+                        return
+                    if token is None or payload["token"] > token:
+                        yield events.format_event(payload)
+        except events.TooManySubscribersError:
+            return
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
 
 @router.api_route("/opds/{book_id}",  methods=["GET", "POST"])
 async def get_opds_item(request: Request, book_id: int, session: Optional[str] = Cookie(None), beta: bool = False, auth_mode: Optional[str] = None):
@@ -174,13 +416,23 @@ async def get_opds_item(request: Request, book_id: int, session: Optional[str] =
     item = Item.exists(book_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
+    auth_mode_direct = is_direct_auth_mode(auth_mode, beta)
 
-    return Response(
-        content=json.dumps(
-            LennyAPI.opds_feed(olid=book_id, auth_mode_direct=is_direct_auth_mode(auth_mode, beta), email=email)
-        ),
-        media_type="application/opds-publication+json"
+    etag, last_modified = LennyAPI.feed_validators(
+        item=item, auth_mode_direct=auth_mode_direct, email=email
     )
+    headers = validator_headers(etag, last_modified, private=bool(email))
+    media_type = "application/opds-publication+json"
+    if request.method == "GET" and is_not_modified(request, etag, last_modified):
+        return not_modified_response(request, headers, media_type=media_type)
+    if cached := cached_opds_response(request, etag, media_type=media_type, headers=headers):
+        return cached
+
+    with OpenLibrary.tracking() as upstream:
+        feed = await run_in_threadpool(LennyAPI.opds_feed, olid=book_id, auth_mode_direct=auth_mode_direct, email=email)
+    if upstream.degraded:
+        return degraded_response(feed, media_type=media_type, request=request)
+    return opds_response(feed, media_type=media_type, headers=headers, request=request, cache_key=etag)
 
 
 @router.get("/items/{book_id}/read")
@@ -240,8 +492,8 @@ async def borrow_item(request: Request, response: Response, book_id: int, format
                 status_code=303
             )
 
-        return Response(
-            content=json.dumps(build_post_borrow_publication(book_id, auth_mode_direct=is_direct_mode)),
+        return opds_response(
+            build_post_borrow_publication(book_id, auth_mode_direct=is_direct_mode),
             media_type="application/opds-publication+json"
         )
     
@@ -320,8 +572,8 @@ async def return_item(request: Request, book_id: int, format: str=".epub", sessi
                  redirect_url += "?auth_mode=direct"
              return RedirectResponse(url=redirect_url, status_code=303)
 
-        return Response(
-            content=json.dumps(LennyAPI.opds_feed(olid=book_id, auth_mode_direct=is_direct_mode)),
+        return opds_response(
+            LennyAPI.opds_feed(olid=book_id, auth_mode_direct=is_direct_mode),
             media_type="application/opds-publication+json"
         )
     except LoanNotRequiredError:
@@ -371,6 +623,16 @@ async def upload(
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
+@router.get("/metrics")
+async def get_metrics(request: Request):
+    """In-process counters and latency summaries of this worker (e.g.
+    search strategy choices and latencies). Restricted to the hosts
+    allowed to upload."""
+    if not LennyAPI.is_allowed_uploader(request.client.host):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return JSONResponse(metrics.snapshot())
+
+
 @router.get("/profile")
 async def profile(request: Request, session: Optional[str] = Cookie(None)):
     """
@@ -413,10 +675,7 @@ async def get_shelf(request: Request, session: Optional[str] = Cookie(None), aut
     
     shelf_feed = LennyAPI.get_shelf_feed(email, auth_mode_direct=is_direct_auth_mode(auth_mode))
     
-    return Response(
-        content=json.dumps(shelf_feed),
-        media_type="application/opds+json"
-    )
+    return opds_response(shelf_feed, request=request)
 
 
 @router.api_route("/logout", methods=["GET", "POST"])
@@ -434,8 +693,8 @@ async def oauth_implicit(request: Request):
     """
     Returns the OPDS Authentication Document (JSON) describing the implicit flow.
     """
-    return Response(
-        content=json.dumps(LennyDataProvider.get_authentication_document()),
+    return opds_response(
+        LennyDataProvider.get_authentication_document(),
         media_type="application/opds-authentication+json"
     )
 
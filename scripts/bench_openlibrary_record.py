@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmarks `OpenLibraryRecord` on a large search response: wrapping
+every doc, reading `int(record.olid)` as the search batches do, and
+merging in the `lenny` item as `_enrich_items` does. The previous,
+eagerly (recursively) wrapping record is reproduced for comparison.
+
+Pass a recorded `search.json` response with `--response`, e.g.
+
+    curl 'https://openlibrary.org/search.json?q=the&limit=250&fields=key,title,author_key,author_name,editions,editions.*' > docs.json
+    python scripts/bench_openlibrary_record.py --response docs.json -r 50
+
+otherwise a synthetic response of `-n` docs shaped like one is used.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("TESTING", "true")
+
+from lenny.core.openlibrary import OpenLibraryRecord
+
+
+class EagerRecord(dict):
+    """The previous implementation: wraps everything up front and
+    re-wraps on merge; `olid` builds its class on every access."""
+
+    def __init__(self, data=None, **kwargs):
+        super().__init__()
+        for key, value in {**(data or {}), **kwargs}.items():
+            self[key] = self._wrap(value)
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    @property
+    def olid(self):
+        class OpenLibraryID(str):
+            def __int__(self):
+                return int(self.strip("OLM"))
+        return OpenLibraryID(self.editions['docs'][0].key.split('/')[-1])
+
+    def __add__(self, other):
+        merged = dict(self)
+        merged.update(other)
+        return EagerRecord(merged)
+
+    @classmethod
+    def _wrap(cls, value):
+        if isinstance(value, dict):
+            return cls(value)
+        elif isinstance(value, list):
+            return [cls._wrap(v) for v in value]
+        return value
+
+
+def make_response(n):
+    return {"numFound": n, "docs": [{
+        "key": f"/works/OL{i}W",
+        "title": f"The Collected Works, Volume {i}",
+        "author_key": ["OL1A", "OL2A"],
+        "author_name": ["Jane Author", "John Editor"],
+        "subject": [f"Subject {j}" for j in range(30)],
+        "editions": {"numFound": 12, "start": 0, "numFoundExact": True, "docs": [{
+            "key": f"/books/OL{i}M",
+            "title": f"The Collected Works, Volume {i}",
+            "language": ["eng"],
+            "cover_i": i,
+            "publisher": ["A Publisher", "Another"],
+            "isbn": [f"{i:013d}", f"{i:010d}"],
+            "ia": [f"collectedworks{i}"],
+        }]},
+    } for i in range(1, n + 1)]}
+
+
+def run(cls, docs, rounds):
+    """Seconds per round and peak traced KB of one round."""
+    def round_():
+        return [(int(record.olid), record + {"lenny": None}) for record in map(cls, docs)]
+
+    tracemalloc.start()
+    round_()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        round_()
+    return (time.perf_counter() - start) / rounds, peak // 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OpenLibraryRecord wrapping")
+    parser.add_argument("--response", help="A recorded search.json response")
+    parser.add_argument("-n", type=int, default=250, help="Docs in the synthetic response")
+    parser.add_argument("-r", type=int, default=50, help="Rounds")
+    args = parser.parse_args()
+
+    if args.response:
+        docs = json.loads(Path(args.response).read_text())["docs"]
+        docs = [doc for doc in docs if (doc.get("editions") or {}).get("docs")]
+    else:
+        docs = make_response(args.n)["docs"]
+
+    print(f"{len(docs)} docs, {args.r} rounds")
+    print(f"{'record':<20} {'ms/round':>10} {'peak KB':>10}")
+    for name, cls in (("eager (previous)", EagerRecord), ("lazy", OpenLibraryRecord)):
+        seconds, peak = run(cls, docs, args.r)
+        print(f"{name:<20} {seconds * 1000:>10.2f} {peak:>10}")
+
+
+if __name__ == "__main__":
+    main()
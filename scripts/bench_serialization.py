@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmarks OPDS feed serialization: the original `json.dumps` path
+against `lenny.core.serialize` (one-piece and streamed).
+
+For each path, a fresh process builds a synthetic feed of `-n`
+publications shaped like LennyDataProvider output, serializes it
+`-r` times and reports throughput (MB/s) and the growth in peak RSS
+caused by serialization alone. The feed is shared (see
+`serialize.share`) like a cached base feed, so rounds after the first
+reuse its publication fragments, as repeated requests for it do.
+
+    python scripts/bench_serialization.py -n 500 -r 20
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ.setdefault("TESTING", "true")
+
+
+def make_feed(n):
+    base = "http://localhost:8080/v1/api"
+    return {
+        "@context": "https://readium.org/webpub-manifest/context.jsonld",
+        "metadata": {"title": "Lenny Catalog", "numberOfItems": n, "itemsPerPage": n, "currentPage": 1},
+        "links": [
+            {"rel": "self", "href": f"{base}/opds?limit={n}", "type": "application/opds+json"},
+            {"rel": "search", "href": f"{base}/opds/search{{?query}}", "type": "application/opds+json", "templated": True},
+        ],
+        "navigation": [{"href": f"{base}/opds", "title": "Catalog", "type": "application/opds+json"}],
+        "publications": [{
+            "metadata": {
+                "title": f"The Collected Works, Volume {i}",
+                "@type": "http://schema.org/Book",
+                "author": [{"name": "Jane Author"}, {"name": "John Editor"}],
+                "language": ["eng"],
+                "description": "A long enough description of the book to be realistic. " * 4,
+            },
+            "links": [
+                {"rel": "self", "href": f"{base}/opds/{i}", "type": "application/opds-publication+json"},
+                {"rel": "http://opds-spec.org/acquisition/borrow", "href": f"{base}/items/{i}/borrow",
+                 "type": "application/opds-publication+json",
+                 "properties": {"availability": {"state": "available"}, "indirectAcquisition": [{"type": "text/html"}]}},
+            ],
+            "images": [{"href": f"https://covers.openlibrary.org/b/id/{i}-M.jpg", "type": "image/jpeg"}],
+        } for i in range(n)],
+    }
+
+
+def _json_dumps(feed):
+    import json
+    # What the routes did: a str, then encoded by Starlette's Response
+    return [json.dumps(feed).encode("utf-8")]
+
+
+def _encode_feed(feed):
+    from lenny.core import serialize
+    return [serialize.encode_feed(feed)]
+
+
+def _iter_feed(feed):
+    from lenny.core import serialize
+    # Chunks are written out (discarded) as they are produced
+    return serialize.iter_feed(feed)
+
+
+PATHS = {"json.dumps": _json_dumps, "encode_feed": _encode_feed, "iter_feed": _iter_feed}
+
+
+def _run(path, n, rounds, results):
+    from lenny.core import serialize  # keep import cost out of the measurement
+    feed = make_feed(n)
+    serialize.share(feed)
+    serialize_fn = PATHS[path]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    nbytes = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for chunk in serialize_fn(feed):
+            nbytes += len(chunk)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((path, nbytes, elapsed, rss_after - rss_before))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OPDS feed serialization")
+    parser.add_argument("-n", type=int, default=500, help="Publications per feed")
+    parser.add_argument("-r", type=int, default=20, help="Serializations per path")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    print(f"{'path':<12} {'MB/s':>10} {'peak RSS +KB':>14}")
+    for path in PATHS:
+        proc = ctx.Process(target=_run, args=(path, args.n, args.r, results))
+        proc.start()
+        name, nbytes, elapsed, rss_delta = results.get()
+        proc.join()
+        print(f"{name:<12} {nbytes / elapsed / 1e6:>10.1f} {rss_delta:>14}")
+
+
+if __name__ == "__main__":
+    main()
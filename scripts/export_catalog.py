@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Exports Lenny's anonymous OPDS catalog as static, precompressed pages
+(see lenny/core/export.py) to a local directory or s3 prefix:
+
+    python scripts/export_catalog.py /app/static-catalog
+    python scripts/export_catalog.py s3://bookshelf/opds --watch 30
+
+With --watch, the (cheap) catalog version is polled and only pages
+whose items or loans changed are rebuilt.
+"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lenny.core.api import LennyAPI
+from lenny.core.export import CatalogExporter
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the OPDS catalog as static pages")
+    parser.add_argument("destination", help="Local directory or s3://bucket/prefix")
+    parser.add_argument("--page-size", type=int, default=LennyAPI.DEFAULT_LIMIT, help="Publications per page")
+    parser.add_argument("--force", action="store_true", help="Rewrite every page")
+    parser.add_argument("--watch", type=int, metavar="SECONDS", help="Re-export whenever the catalog changes")
+    args = parser.parse_args()
+
+    exporter = CatalogExporter(args.destination, page_size=args.page_size)
+    index = exporter.export(force=args.force)
+    print(f"Exported {len(index.get('pages', []))} pages to {args.destination}")
+
+    version = LennyAPI.catalog_version()
+    while args.watch:
+        time.sleep(args.watch)
+        if (current := LennyAPI.catalog_version()) != version:
+            version = current
+            index = exporter.export()
+            logger.info(f"[Export] Catalog changed, {len(index.get('pages', []))} pages up to date")
+
+
+if __name__ == "__main__":
+    main()
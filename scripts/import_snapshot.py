@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Fills the mirrored title/author metadata and the language and subject
+facets of catalog items from a downloaded Open Library dump (see
+lenny/core/snapshot.py), instead of searching Open Library for each:
+
+    python scripts/import_snapshot.py ol_dump_editions_latest.txt.gz
+    python scripts/import_snapshot.py ol_dump_editions_latest.txt.gz \\
+        --authors ol_dump_authors_latest.txt.gz
+
+Dumps are at https://openlibrary.org/developers/dumps. They are
+streamed, never loaded into memory, so even the full editions dump can
+be imported on a small machine. Facet counts are recomputed at the end.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lenny.core.models import Item, FacetCount
+from lenny.core.snapshot import SnapshotImporter, open_dump
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import catalog metadata from an Open Library dump")
+    parser.add_argument("editions", help="Editions dump (.txt.gz, or JSON lines)")
+    parser.add_argument("--authors", help="Authors dump, to resolve author names")
+    parser.add_argument("--batch-size", type=int, default=SnapshotImporter.BATCH_SIZE, help="Editions per bulk load")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    importer = SnapshotImporter(Item.edition_ids(), batch_size=args.batch_size)
+    logger.info(f"Scanning {args.editions} for {len(importer.wanted)} catalog editions")
+    with open_dump(args.editions) as lines:
+        imported = importer.import_editions(lines)
+    logger.info(f"Imported {imported} of {len(importer.wanted)} catalog editions")
+
+    if args.authors:
+        with open_dump(args.authors) as lines:
+            logger.info(f"Resolved the authors of {importer.import_authors(lines)} editions")
+
+    FacetCount.rebuild()
+    logger.info("Facet counts rebuilt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Indexes the text of every open-access EPUB for full-text search (see
+lenny/core/fulltext.py):
+
+    python scripts/index_fulltext.py
+    python scripts/index_fulltext.py --workers 4 --retry-failed
+
+Books already in the index are skipped without being read, so the
+script can be interrupted and re-run to resume. New uploads are
+indexed as they are added; this is for items stored before.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lenny.configs import FULLTEXT_WORKERS
+from lenny.core.fulltext import FullTextIndexer, fulltext_index
+from lenny.core.models import Item
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the full-text index")
+    parser.add_argument("--workers", type=int, default=FULLTEXT_WORKERS or 2, help="Extraction processes")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry books that failed to extract")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.retry_failed:
+        logger.info(f"Retrying {fulltext_index.retry_failed()} failed books")
+
+    indexer = FullTextIndexer(fulltext_index, workers=args.workers)
+    offset = indexed = 0
+    while items := Item.get_many_filtered(offset=offset, limit=BATCH_SIZE, access='open', format='epub'):
+        indexed += indexer.index_editions([item.openlibrary_edition for item in items])
+        offset += len(items)
+        logger.info(f"Checked {offset} items, indexed {indexed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Backfills the mirrored title/author metadata (used for suggestions)
+and the language and subject facets of every item from Open Library,
+then recomputes the facet counts (see FacetCount):
+
+    python scripts/index_metadata.py
+    python scripts/index_metadata.py --recount-only
+
+New uploads are indexed as they are added; this is for items stored
+before metadata was mirrored.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lenny.core.api import LennyAPI
+from lenny.core.models import Item, FacetCount
+from lenny.core.openlibrary import OpenLibrary
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill catalog metadata and facets")
+    parser.add_argument("--recount-only", action="store_true", help="Only recompute facet counts")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.recount_only:
+        last_id = 0
+        with OpenLibrary.priority(OpenLibrary.BACKGROUND):
+            # Paged by id, so uploads and removals during the backfill
+            # never shift a batch over items or skip some
+            while items := Item.filtered().filter(Item.id > last_id).limit(BATCH_SIZE).all():
+                logger.info(f"Indexing metadata of items {items[0].id}-{items[-1].id}")
+                LennyAPI.index_metadata(items)
+                last_id = items[-1].id
+
+    FacetCount.rebuild()
+    logger.info("Facet counts rebuilt")
+
+
+if __name__ == "__main__":
+    main()
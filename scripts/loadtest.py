@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Load tests Lenny end to end (see lenny/core/loadtest.py) and reports
+the throughput, p50/p95/p99 latency per route, and the database queries
+and upstream calls made:
+
+    python scripts/loadtest.py --cassettes data/cassettes --duration 60 --concurrency 20
+    python scripts/loadtest.py ... --save-baseline data/loadtest-baseline.json
+    python scripts/loadtest.py ... --baseline data/loadtest-baseline.json
+
+Unless --target points at a running Lenny, the API is started (one
+uvicorn worker) on a SQLite file (or --db-uri, e.g. Postgres), with
+Open Library, Readium and the OTP server replayed by the local stand-in
+(see scripts/standin.py: record cassettes with it first) and S3 at
+--s3-endpoint. The OPDS provider's own Open Library searches go to the
+stand-in too (see `lenny.core.standin.lenny_app`), so they are replayed
+and counted with Lenny's. Against a --target, only the API's metrics
+are counted. The catalog is seeded with --editions: --lendable of
+them encrypted, to be borrowed and returned by --patrons patrons.
+
+With --baseline, regressions beyond --tolerance are listed and the
+script exits with status 1.
+"""
+import argparse
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parent.parent
+PATRON_IP = "127.0.0.1"
+
+
+def parse_mix(mix):
+    return {action: float(weight) for action, weight in (part.split("=", 1) for part in mix.split(","))}
+
+
+def parse_editions(editions):
+    if editions and Path(editions).is_file():
+        editions = Path(editions).read_text().replace("\n", ",")
+    return [int(e.strip().strip("OLM")) for e in (editions or "").split(",") if e.strip()]
+
+
+def counters(base_url, standin=None):
+    """Database queries and upstream calls so far, from the API's
+    metrics (of its single worker) and the stand-in. `upstream.*` count
+    every request the stand-in got, the OPDS provider's included;
+    `openlibrary.requests` only those of Lenny's own client."""
+    found = {}
+    try:
+        snapshot = httpx.get(f"{base_url}/v1/api/metrics", timeout=10).json().get("counters", {})
+    except (httpx.HTTPError, ValueError):
+        snapshot = {}
+    found["db.queries"] = snapshot.get("db.queries", 0)
+    found["openlibrary.requests"] = sum(n for k, n in snapshot.items() if k.startswith("openlibrary.requests"))
+    if standin is not None:
+        for upstream, n in standin.calls.items():
+            found[f"upstream.{upstream}"] = n
+    return found
+
+
+def seed(editions, lendable, patrons):
+    """Adds the missing catalog items; returns the patrons' session cookies."""
+    from sqlalchemy import func
+    from lenny.core import auth
+    from lenny.core.models import db, Item, FormatEnum
+
+    existing = Item.edition_ids()
+    next_id = (db.query(func.max(Item.id)).scalar() or 0) + 1
+    for i, edition in enumerate(editions):
+        if edition in existing:
+            continue
+        db.add(Item(id=next_id, openlibrary_edition=edition, encrypted=i < lendable, formats=FormatEnum.EPUB))
+        next_id += 1
+    db.commit()
+    return [auth.create_session_cookie(f"loadtest-{i}@example.org", PATRON_IP) for i in range(patrons)]
+
+
+def wait_until_up(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Lenny exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/v1/api/", timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Lenny didn't come up within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test Lenny end to end")
+    parser.add_argument("--target", help="Base URL of a running Lenny (else one is started)")
+    parser.add_argument("--db-uri", help="Database of the started Lenny (default: a fresh SQLite file)")
+    parser.add_argument("--s3-endpoint", default=os.environ.get("S3_ENDPOINT", ""), help="host:port of S3 (e.g. MinIO)")
+    parser.add_argument("--cassettes", default="data/cassettes", help="Stand-in recordings (see scripts/standin.py)")
+    parser.add_argument("--standin-latency", type=float, default=0.0, help="Seconds added to upstream responses")
+    parser.add_argument("--standin-jitter", type=float, default=0.0)
+    parser.add_argument("--standin-error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--editions", default="", help="Catalog editions: comma separated, or a file of them")
+    parser.add_argument("--lendable", type=int, default=0, help="How many of --editions are encrypted (lendable)")
+    parser.add_argument("--patrons", type=int, default=10, help="Signed-in patrons borrowing and viewing shelves")
+    parser.add_argument("--queries", default="the,history,science,love", help="Comma separated search queries")
+    parser.add_argument("--mix", help="Action weights, e.g. browse=40,search=20,borrow=10,shelf=15,read=15")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of unmeasured load first")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--baseline", help="Report to compare against")
+    parser.add_argument("--save-baseline", help="Write the report here")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    editions = parse_editions(args.editions)
+    workdir = tempfile.TemporaryDirectory(prefix="lenny-loadtest-")
+    standin = server = process = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+            patrons = []
+        else:
+            from lenny.core.standin import StandIn
+            standin = StandIn(args.cassettes, latency=args.standin_latency, jitter=args.standin_jitter,
+                              error_rate=args.standin_error_rate, seed=args.seed)
+            server = standin.server(port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            upstream = f"http://127.0.0.1:{server.server_port}"
+            env = {
+                "TESTING": "false",
+                "LENNY_DB_URI": args.db_uri or f"sqlite:///{workdir.name}/lenny.db",
+                "LENNY_SEED": os.environ.get("LENNY_SEED") or secrets.token_hex(16),
+                "LENNY_STANDIN_URL": upstream,
+                "LENNY_OPENLIBRARY_URL": f"{upstream}/openlibrary",
+                "LENNY_READIUM_URL": f"{upstream}/readium",
+                "OTP_SERVER": f"{upstream}/otp",
+                # Nothing measured reads S3: without one, its calls get the stand-in's 404s
+                "S3_ENDPOINT": args.s3_endpoint or f"127.0.0.1:{server.server_port}",
+                "LENNY_FULLTEXT_PATH": f"{workdir.name}/fulltext.db",
+            }
+            # Seeded with the very configuration the API runs with
+            os.environ.update(env)
+            patrons = seed(editions, args.lendable, args.patrons)
+            base_url = f"http://127.0.0.1:{args.port}"
+            process = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "--factory", "lenny.core.standin:lenny_app", "--host", "127.0.0.1",
+                 "--port", str(args.port), "--workers", "1", "--log-level", "warning"],
+                cwd=ROOT, env={**os.environ, **env},
+            )
+            wait_until_up(base_url, process)
+
+        from lenny.core.loadtest import LoadTest, compare
+        test = LoadTest(
+            base_url,
+            editions=editions[args.lendable:],
+            lendable=editions[:args.lendable],
+            queries=[q for q in args.queries.split(",") if q],
+            patrons=patrons,
+            mix=parse_mix(args.mix) if args.mix else None,
+            concurrency=args.concurrency,
+            seed=args.seed,
+        )
+        if args.warmup:
+            logger.info(f"Warming up for {args.warmup}s")
+            test.run(duration=args.warmup)
+        before = counters(base_url, standin)
+        logger.info(f"Running {', '.join(test.mix)} for {args.duration}s at concurrency {args.concurrency}")
+        report = test.run(duration=args.duration, requests=args.requests)
+        after = counters(base_url, standin)
+        report["counters"] = {name: after[name] - before.get(name, 0) for name in after}
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        workdir.cleanup()
+
+    print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), tolerance=args.tolerance)
+        for regression in regressions:
+            logger.warning(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        logger.info("No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -62,7 +62,7 @@ class StandardEbooks:
 def import_standardebooks(limit=None, offset=0):
     logger.info("[Preloading] Fetching StandardEbooks from Open Library...")
     query = 'id_standard_ebooks:*'
-    for i, book in enumerate(OpenLibrary.search(query, offset=offset, fields=['id_standard_ebooks'])):
+    for i, book in enumerate(OpenLibrary.search(query, offset=offset, fields=['id_standard_ebooks'], profile=OpenLibrary.ID)):
         if limit is not None and i >= limit:
             break
         if int(book.olid) and book.standardebooks_id:
@@ -75,5 +75,8 @@ if __name__ == "__main__":
     parser.add_argument("-n", type=int, help="Number of books to preload", default=None)
     parser.add_argument("-o", type=int, help="Offset", default=0)
     args = parser.parse_args()
-    import_standardebooks(limit=args.n, offset=args.o)
+    # This process's own searches yield to patron-facing requests for
+    # Open Library's capacity (the API indexes the uploads at BACKGROUND)
+    with OpenLibrary.priority(OpenLibrary.BACKGROUND):
+        import_standardebooks(limit=args.n, offset=args.o)
 
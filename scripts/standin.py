@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Runs the local stand-in for Open Library, Readium and the OTP server
+(see lenny/core/standin.py). Record once with the network:
+
+    python scripts/standin.py --mode record --cassettes data/cassettes
+
+then replay offline, optionally slower and flakier than the real thing:
+
+    python scripts/standin.py --cassettes data/cassettes --latency 0.2 --jitter 0.3 --error-rate 0.01
+
+and point Lenny at it:
+
+    LENNY_OPENLIBRARY_URL=http://localhost:8090/openlibrary
+    LENNY_READIUM_URL=http://localhost:8090/readium
+    OTP_SERVER=http://localhost:8090/otp
+
+The OPDS provider requests Open Library itself: to record and replay
+its searches too, run Lenny through the stand-in's app factory:
+
+    LENNY_STANDIN_URL=http://localhost:8090 uvicorn --factory lenny.core.standin:lenny_app
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from lenny.core.standin import StandIn, RECORD, REPLAY, UPSTREAMS
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a record/replay stand-in for Lenny's upstreams")
+    parser.add_argument("--mode", choices=[RECORD, REPLAY], default=REPLAY)
+    parser.add_argument("--cassettes", default="data/cassettes", help="Directory of recorded responses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many random seconds more")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a 503")
+    parser.add_argument("--seed", type=int, help="Seed of the injected jitter and errors")
+    parser.add_argument(
+        "--upstream", action="append", default=[], metavar="NAME=URL",
+        help=f"Real upstream to record from (defaults: {', '.join(f'{k}={v}' for k, v in UPSTREAMS.items())})",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    standin = StandIn(
+        args.cassettes,
+        mode=args.mode,
+        upstreams=dict(u.split("=", 1) for u in args.upstream),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    server = standin.server(args.host, args.port)
+    logger.info(f"Stand-in ({args.mode}) listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
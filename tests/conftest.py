@@ -0,0 +1,39 @@
+import sys
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+def db_session():
+    """An in-memory SQLite session standing in for Lenny's database in
+    the models and the modules querying it directly."""
+    pytest.importorskip("sqlalchemy")
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from lenny.core.db import Base
+
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autocommit=False, autoflush=False)()
+    with patch("lenny.core.db.session", session), \
+         patch("lenny.core.models.db", session), \
+         patch("lenny.core.index.db", session), \
+         patch("lenny.core.snapshot.db", session):
+        yield session
+    session.close()
+    Base.metadata.drop_all(engine)
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Empties the process-wide response caches after each test, so
+    bodies and feeds cached under a mocked ETag or catalog version
+    never leak into another test."""
+    yield
+    from lenny.core import compression, serialize
+    compression.BODIES.clear()
+    serialize.FRAGMENTS.clear()
+    # Only if a test imported it: the API needs optional dependencies
+    if api := sys.modules.get("lenny.core.api"):
+        api.LennyAPI.FEED_CACHE.clear()
+        api.LennyAPI.SEARCH_CACHE.clear()
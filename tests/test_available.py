@@ -0,0 +1,73 @@
+import os
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+@pytest.fixture
+def catalog(db_session):
+    from lenny.core.models import Item, Loan, FormatEnum
+    from lenny.core.utils import hash_email
+
+    db_session.add_all([
+        Item(id=1, openlibrary_edition=111, encrypted=True, formats=FormatEnum.EPUB),
+        Item(id=2, openlibrary_edition=222, encrypted=True, formats=FormatEnum.EPUB),
+        Item(id=3, openlibrary_edition=333, encrypted=False, formats=FormatEnum.EPUB),
+        Item(id=4, openlibrary_edition=444, encrypted=True, formats=FormatEnum.PDF),
+    ])
+    db_session.commit()
+    db_session.add_all([
+        Loan(id=1, item_id=2, patron_email_hash=hash_email("patron@example.com")),
+        Loan(id=2, item_id=4, patron_email_hash=hash_email("patron@example.com")),
+    ])
+    db_session.commit()
+    return db_session
+
+
+def editions(items):
+    return [item.openlibrary_edition for item in items]
+
+
+def test_filtered_by_availability_and_access(catalog):
+    from lenny.core.models import Item, Loan
+
+    assert editions(Item.get_many_filtered()) == [111, 222, 333, 444]
+    assert editions(Item.get_many_filtered(available=True)) == [111, 333]
+    assert editions(Item.get_many_filtered(access="open")) == [333]
+    assert editions(Item.get_many_filtered(access="lendable")) == [111, 222, 444]
+    assert editions(Item.get_many_filtered(available=True, access="lendable")) == [111]
+    assert editions(Item.get_many_filtered(available=True, offset=1, limit=1)) == [333]
+
+    Loan.exists(4, "patron@example.com").finalize()
+    assert editions(Item.get_many_filtered(available=True, access="lendable")) == [111, 444]
+
+
+def test_filter_links_carry_filters_to_paging_links():
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+
+    feed = {"links": [
+        {"rel": "self", "href": "/v1/api/opds"},
+        {"rel": "next", "href": "/v1/api/opds?offset=50&limit=50"},
+    ]}
+    links = LennyAPI.filter_links(feed, available=True, access=None)["links"]
+    assert links[0]["href"] == "/v1/api/opds"
+    assert links[1]["href"] == "/v1/api/opds?offset=50&limit=50&available=true"
+    assert LennyAPI.filter_links(feed, available=False, access=None) is feed
+
+
+def test_get_many_pages_in_id_order(db_session):
+    from lenny.core.models import Item, FormatEnum
+
+    db_session.add_all([
+        Item(id=id, openlibrary_edition=id * 111, encrypted=False, formats=FormatEnum.EPUB)
+        for id in (3, 1, 4, 2)
+    ])
+    db_session.commit()
+    db_session.get(Item, 1).encrypted = True  # rewritten rows keep their place
+    db_session.commit()
+
+    assert [item.id for item in Item.get_many(offset=1, limit=2)] == [2, 3]
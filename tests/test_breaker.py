@@ -0,0 +1,38 @@
+import os
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from lenny.core.breaker import CircuitBreaker
+
+
+def test_opens_after_consecutive_failures_and_recovers():
+    breaker = CircuitBreaker("test", failures=2, reset_timeout=30)
+    with patch("lenny.core.breaker.time.monotonic", return_value=100.0):
+        breaker.record(False)
+        breaker.record(True)
+        breaker.record(False)
+        assert breaker.allow() and breaker.state == CircuitBreaker.CLOSED
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    with patch("lenny.core.breaker.time.monotonic", return_value=131.0):
+        # One trial call once the reset timeout has passed
+        assert breaker.allow() and not breaker.allow()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.OPEN
+
+    with patch("lenny.core.breaker.time.monotonic", return_value=162.0):
+        assert breaker.allow()
+        breaker.record(True)
+        assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker("test", failures=1, slow=2.0)
+    breaker.record(True, latency=1.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(True, latency=5.0)
+    assert breaker.state == CircuitBreaker.OPEN
@@ -0,0 +1,124 @@
+import pytest
+from unittest.mock import patch
+
+from lenny.core.cache import TTLCache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recently used
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(ttl=10)
+    with patch("lenny.core.cache.time.monotonic", return_value=100):
+        cache.set("a", 1)
+    with patch("lenny.core.cache.time.monotonic", return_value=105):
+        assert cache.get("a") == 1
+    with patch("lenny.core.cache.time.monotonic", return_value=111):
+        assert cache.get("a") is None
+
+
+def test_ttl_cache_get_or_set_computes_once():
+    cache = TTLCache()
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return {"feed": True}
+
+    assert cache.get_or_set("k", factory) == {"feed": True}
+    assert cache.get_or_set("k", factory) == {"feed": True}
+    assert len(calls) == 1
+
+
+def test_ttl_cache_get_or_set_keeps_only_wanted_values():
+    cache = TTLCache()
+
+    assert cache.get_or_set("k", lambda: "partial", keep=lambda value: value != "partial") == "partial"
+    assert "k" not in cache
+    assert cache.get_or_set("k", lambda: "full", keep=lambda value: value != "partial") == "full"
+    assert cache.get("k") == "full"
+
+
+def test_singleflight_coalesces_concurrent_calls():
+    import threading
+    from lenny.core.cache import SingleFlight
+
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return {"result": 42}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("q", compute))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    started.wait(timeout=5)
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert len(calls) == 1
+    assert len(results) == 5 and all(r is results[0] for r in results)
+    assert len(flight) == 0
+
+
+def test_singleflight_shares_errors_and_forgets_them():
+    from lenny.core.cache import SingleFlight
+
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("upstream down")
+
+    with pytest.raises(ValueError):
+        flight.do("q", fail)
+    assert flight.do("q", lambda: "recovered") == "recovered"
+
+
+def test_get_or_set_coalesces_misses():
+    import threading
+    from lenny.core.cache import TTLCache
+
+    cache = TTLCache(maxsize=4)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def factory():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return "feed"
+
+    threads = [threading.Thread(target=cache.get_or_set, args=("key", factory)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    started.wait(timeout=5)
+    release.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert len(calls) == 1
+    assert cache.get("key") == "feed"
+
+
+def test_openlibrary_search_json_shares_inflight_requests():
+    from lenny.core.openlibrary import OpenLibrary
+
+    with patch.object(OpenLibrary, "_fetch_json", return_value={"numFound": 1}) as fetch:
+        assert OpenLibrary.search_json("python", limit=5) == {"numFound": 1}
+    fetch.assert_called_once_with(OpenLibrary._construct_search_url("python", None, 1, 5))
@@ -0,0 +1,87 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+def test_change_log_records_catalog_and_availability_changes(db_session):
+    from lenny.core.models import Item, Loan, Change, ChangeEnum, FormatEnum
+    from lenny.core.utils import hash_email
+
+    assert Change.latest_token() == 0
+
+    item = Item(id=1, openlibrary_edition=123, encrypted=True, formats=FormatEnum.EPUB)
+    db_session.add(item)
+    db_session.commit()
+    token = Change.latest_token()
+
+    loan = Loan(id=1, item_id=item.id, patron_email_hash=hash_email("patron@example.com"))
+    db_session.add(loan)
+    db_session.commit()
+    loan.finalize()
+
+    changes = Change.since(token)
+    assert [(c.openlibrary_edition, c.kind) for c in changes] == [
+        (123, ChangeEnum.AVAILABILITY), (123, ChangeEnum.AVAILABILITY)
+    ]
+    assert Change.since(Change.latest_token()) == []
+    assert [c.kind for c in Change.since(0)][0] == ChangeEnum.ADDED
+
+
+
+def test_change_cursor_holds_back_behind_changes_in_flight(db_session):
+    """Ids are taken at insert, not commit: a change committed by one
+    session after a later one from another must not be skipped."""
+    import datetime
+    from sqlalchemy.orm import sessionmaker
+    from lenny.core.models import Change, ChangeEnum
+
+    sessions = sessionmaker(bind=db_session.get_bind(), autocommit=False, autoflush=False)
+    first, second = sessions(), sessions()
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def change(id, edition, created_at=now):
+        return Change(id=id, openlibrary_edition=edition, kind=ChangeEnum.ADDED, created_at=created_at)
+
+    # The first session takes id 1 but commits after the second commits id 2
+    second.add(change(2, 200))
+    second.commit()
+    assert Change.since(0) == []
+    assert Change.latest_token() == 0
+
+    first.add(change(1, 100))
+    first.commit()
+    db_session.expire_all()
+    assert [c.openlibrary_edition for c in Change.since(0)] == [100, 200]
+    assert Change.latest_token() == 2
+
+    # A gap older than SETTLE is an insert that was rolled back
+    settled = now - datetime.timedelta(seconds=Change.SETTLE + 1)
+    second.add(change(4, 400, created_at=settled))
+    second.commit()
+    assert [c.openlibrary_edition for c in Change.since(2)] == [400]
+    assert Change.latest_token() == 4
+    first.close()
+    second.close()
+
+
+def test_changes_feed_reports_removed_editions_and_next_token():
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+
+    changes = [
+        type("C", (), {"id": 7, "openlibrary_edition": 123})(),
+        type("C", (), {"id": 8, "openlibrary_edition": 456})(),
+    ]
+    with patch("lenny.core.api.Change.since", return_value=changes), \
+         patch("lenny.core.api.Item.get_editions", return_value={}):
+        feed = LennyAPI.changes_feed(since=6, auth_mode_direct=True)
+
+    assert feed["metadata"]["syncToken"] == "8"
+    assert feed["metadata"]["hasMore"] is False
+    assert sorted(feed["removed"]) == ["OL123M", "OL456M"]
+    assert feed["links"][-1]["href"].endswith("/v1/api/opds/changes?since=8")
@@ -0,0 +1,58 @@
+import gzip
+import pytest
+from unittest.mock import patch
+
+from lenny.core import compression
+
+
+def test_negotiate_prefers_supported_codings_by_qvalue():
+    assert compression.negotiate(None) is None
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("gzip, deflate") == "gzip"
+    assert compression.negotiate("gzip;q=0") is None
+    assert compression.negotiate("*") == compression.ENCODINGS[0]
+    with patch("lenny.core.compression.ENCODINGS", ("br", "gzip")):
+        assert compression.negotiate("gzip, br") == "br"
+        assert compression.negotiate("gzip;q=1.0, br;q=0.5") == "gzip"
+
+
+def test_compressed_body_compresses_each_variant_once():
+    body = compression.CompressedBody(b'{"publications":[]}' * 200)
+
+    content, encoding = body.encode("gzip")
+    assert encoding == "gzip"
+    assert gzip.decompress(content) == body.body
+
+    with patch("lenny.core.compression.compress") as mock_compress:
+        assert body.encode("gzip") == (content, "gzip")
+    mock_compress.assert_not_called()
+
+
+def test_compressed_body_skips_small_bodies():
+    body = compression.CompressedBody(b"{}")
+    assert body.encode("gzip") == (b"{}", None)
+    assert body.variants == {}
+    assert body.coding("gzip") is None
+    assert compression.CompressedBody(b"x" * 4096).coding("gzip") == "gzip"
+
+
+def test_iter_compress_gzip_stream():
+    chunks = [b'{"a":', b"1", b"}"]
+    assert gzip.decompress(b"".join(compression.iter_compress(chunks, "gzip"))) == b'{"a":1}'
+
+
+def test_variant_etags_round_trip():
+    assert compression.variant_etag('"abc"', "gzip") == '"abc-gzip"'
+    assert compression.variant_etag('"abc"', None) == '"abc"'
+    assert compression.strip_variant('"abc-gzip"') == '"abc"'
+    assert compression.strip_variant('"abc-br"') == '"abc"'
+    assert compression.strip_variant('"abc"') == '"abc"'
+
+
+def test_brotli_variant():
+    brotli = pytest.importorskip("brotli")
+    body = compression.CompressedBody(b"x" * 4096)
+    content, encoding = body.encode("br")
+    assert encoding == "br"
+    assert brotli.decompress(content) == body.body
+    assert brotli.decompress(b"".join(compression.iter_compress([b"x" * 10, b"y"], "br"))) == b"x" * 10 + b"y"
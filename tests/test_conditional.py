@@ -0,0 +1,206 @@
+import os
+import datetime
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+def test_make_etag_is_strong_and_stable():
+    from lenny.core.utils import make_etag
+
+    etag = make_etag("catalog", 0, 50, (2, None))
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == make_etag("catalog", 0, 50, (2, None))
+    assert etag != make_etag("catalog", 50, 50, (2, None))
+
+
+def test_latest_normalizes_to_utc_seconds():
+    from lenny.core.utils import latest
+
+    naive = datetime.datetime(2025, 1, 1, 12, 0, 0, 999)
+    aware = datetime.datetime(2025, 1, 1, 13, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    result = latest(naive, None, aware)
+    assert result == datetime.datetime(2025, 1, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+    assert latest(None, None) is None
+
+
+def test_versions_change_on_borrow_and_return(db_session):
+    from lenny.core.models import Item, Loan, FormatEnum
+    from lenny.core.utils import hash_email
+
+    item = Item(id=1, openlibrary_edition=123, encrypted=True, formats=FormatEnum.EPUB)
+    db_session.add(item)
+    db_session.commit()
+
+    assert Item.version()[0] == 1
+    before = Loan.version(item_id=item.id)
+    assert Loan.get_active_editions("patron@example.com") == set()
+
+    loan = Loan(id=1, item_id=item.id, patron_email_hash=hash_email("patron@example.com"))
+    db_session.add(loan)
+    db_session.commit()
+    borrowed = Loan.version(item_id=item.id)
+    assert borrowed != before
+    assert Loan.get_active_editions("patron@example.com") == {123}
+
+    loan.finalize()
+    assert Loan.version(item_id=item.id) != borrowed
+    assert Loan.get_active_editions("patron@example.com") == set()
+
+
+def test_catalog_last_modified_advances_when_an_item_is_removed(db_session):
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+    from lenny.core.models import Item, Change, FormatEnum
+
+    db_session.add_all([
+        Item(id=1, openlibrary_edition=111, encrypted=False, formats=FormatEnum.EPUB),
+        Item(id=2, openlibrary_edition=222, encrypted=False, formats=FormatEnum.EPUB),
+    ])
+    db_session.commit()
+    etag, last_modified = LennyAPI.feed_validators()
+
+    db_session.delete(db_session.get(Item, 2))
+    db_session.commit()
+    # As if removed a minute later
+    removal = Change.since(Change.latest_token() - 1)[0]
+    removal.created_at = last_modified + datetime.timedelta(minutes=1)
+    db_session.commit()
+
+    removed_etag, removed_last_modified = LennyAPI.feed_validators()
+    assert removed_etag != etag
+    assert removed_last_modified == last_modified + datetime.timedelta(minutes=1)
+
+
+@pytest.fixture(scope="module")
+def test_client():
+    from fastapi.testclient import TestClient
+
+    with patch("lenny.core.db.init"), \
+         patch("lenny.core.db.create_engine"):
+        from lenny.app import app
+        yield TestClient(app)
+
+
+def test_opds_feed_returns_validators(test_client):
+    validators = ('"abc"', datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc))
+
+    with patch("lenny.routes.api.LennyAPI.feed_validators", return_value=validators), \
+         patch("lenny.routes.api.LennyAPI.opds_feed", return_value={"publications": []}):
+        resp = test_client.get("/v1/api/opds")
+
+    assert resp.status_code == 200
+    assert resp.headers["etag"] == '"abc"'
+    assert resp.headers["last-modified"] == "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+def test_opds_feed_304_skips_feed_generation(test_client):
+    validators = ('"def"', datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc))
+
+    with patch("lenny.routes.api.LennyAPI.feed_validators", return_value=validators), \
+         patch("lenny.routes.api.LennyAPI.opds_feed", return_value={"publications": []}) as mock_feed:
+        by_etag = test_client.get("/v1/api/opds", headers={"If-None-Match": '"def"'})
+        by_date = test_client.get("/v1/api/opds", headers={"If-Modified-Since": "Wed, 01 Jan 2025 00:00:00 GMT"})
+        stale = test_client.get("/v1/api/opds", headers={"If-None-Match": '"old"'})
+
+    assert by_etag.status_code == 304
+    assert by_date.status_code == 304
+    assert stale.status_code == 200
+    mock_feed.assert_called_once()
+
+
+def test_opds_feed_body_is_serialized_and_compressed_once(test_client):
+    validators = ('"ghi"', None)
+    feed = {"metadata": {"title": "Lenny Catalog"}, "publications": [{"metadata": {"title": "x" * 2048}}]}
+
+    with patch("lenny.routes.api.LennyAPI.feed_validators", return_value=validators), \
+         patch("lenny.routes.api.LennyAPI.opds_feed", return_value=feed) as mock_feed:
+        first = test_client.get("/v1/api/opds", headers={"Accept-Encoding": "gzip"})
+        second = test_client.get("/v1/api/opds", headers={"Accept-Encoding": "gzip"})
+
+    mock_feed.assert_called_once()
+    assert first.headers["content-encoding"] == second.headers["content-encoding"] == "gzip"
+    assert first.headers["etag"] == '"ghi-gzip"'
+    assert second.json() == feed
+
+
+def test_opds_feed_304_sends_the_validators_of_the_200(test_client):
+    validators = ('"jkl"', None)
+    feed = {"metadata": {"title": "Lenny Catalog"}, "publications": [{"metadata": {"title": "x" * 2048}}]}
+
+    with patch("lenny.routes.api.LennyAPI.feed_validators", return_value=validators), \
+         patch("lenny.routes.api.LennyAPI.opds_feed", return_value=feed):
+        full = test_client.get("/v1/api/opds", headers={"Accept-Encoding": "gzip"})
+        revalidated = test_client.get("/v1/api/opds", headers={
+            "Accept-Encoding": "gzip", "If-None-Match": full.headers["etag"]
+        })
+        identity = test_client.get("/v1/api/opds", headers={
+            "Accept-Encoding": "identity", "If-None-Match": '"jkl"'
+        })
+
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == full.headers["etag"] == '"jkl-gzip"'
+    assert revalidated.headers["vary"] == full.headers["vary"] == "Accept-Encoding"
+    assert identity.status_code == 304
+    assert identity.headers["etag"] == '"jkl"'
+
+
+def test_cached_bodies_are_keyed_by_route_and_media_type(test_client):
+    """Two resources sharing an ETag never get each other's body."""
+    from lenny.core.models import Item
+
+    validators = ('"mno"', None)
+    catalog = {"metadata": {"title": "Lenny Catalog"}, "publications": []}
+    publication = {"metadata": {"title": "One book"}, "links": []}
+
+    with patch("lenny.routes.api.LennyAPI.feed_validators", return_value=validators), \
+         patch("lenny.routes.api.Item.exists", return_value=Item(id=1, openlibrary_edition=123)), \
+         patch("lenny.routes.api.get_authenticated_email", return_value=None), \
+         patch("lenny.routes.api.LennyAPI.opds_feed", side_effect=[catalog, publication]):
+        assert test_client.get("/v1/api/opds").json() == catalog
+        assert test_client.get("/v1/api/opds/123").json() == publication
+        assert test_client.get("/v1/api/opds").json() == catalog
+
+
+def test_feed_built_while_open_library_fails_is_not_validated(test_client):
+    from lenny.core import compression
+    from lenny.core.openlibrary import OpenLibrary
+
+    def degraded_feed(**kwargs):
+        OpenLibrary._degrade()
+        return {"metadata": {"title": "Lenny Catalog"}, "publications": []}
+
+    with patch("lenny.routes.api.LennyAPI.feed_validators", return_value=('"pqr"', None)), \
+         patch("lenny.routes.api.LennyAPI.opds_feed", side_effect=degraded_feed):
+        resp = test_client.get("/v1/api/opds")
+
+    assert resp.status_code == 200
+    assert "etag" not in resp.headers
+    assert resp.headers["cache-control"] == "no-store"
+    assert len(compression.BODIES) == 0
+
+
+def test_feeds_are_built_off_the_event_loop(test_client):
+    """A build waiting on the Open Library limiter mustn't stall the loop."""
+    import asyncio
+
+    def on_loop(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return {"metadata": {"title": "off"}, "publications": []}
+        return {"metadata": {"title": "on"}, "publications": []}
+
+    with patch("lenny.routes.api.LennyAPI.feed_validators", return_value=('"stu"', None)), \
+         patch("lenny.routes.api.get_authenticated_email", return_value=None), \
+         patch("lenny.routes.api.LennyAPI.opds_feed", side_effect=on_loop), \
+         patch("lenny.routes.api.LennyAPI.changes_feed", side_effect=on_loop), \
+         patch("lenny.routes.api.LennyAPI.lookup_feed", side_effect=on_loop):
+        titles = [test_client.get(path).json()["metadata"]["title"]
+                  for path in ("/v1/api/opds", "/v1/api/opds/changes", "/v1/api/opds/lookup?ids=OL1M")]
+
+    assert titles == ["off", "off", "off"]
@@ -90,13 +90,15 @@ def test_beta_flag_backward_compatibility(mock_get_items, test_client):
     for nav in navs:
         assert "auth_mode=direct" in nav["href"]
 
+@patch("lenny.routes.api.LennyAPI.feed_validators", return_value=('"v1"', None))
 @patch("lenny.routes.api.get_authenticated_email")
 @patch("lenny.core.api.build_post_borrow_publication")
-@patch("lenny.core.api.Loan.exists")
+@patch("lenny.core.api.Loan.get_active_editions")
 @patch("lenny.core.api.Item.exists")
 @patch("lenny.core.api.LennyAPI.get_enriched_items")
 def test_single_item_returns_post_borrow_when_authenticated_with_loan(
-    mock_get_items, mock_item_exists, mock_loan_exists, mock_build_post_borrow, mock_get_email, test_client
+    mock_get_items, mock_item_exists, mock_loan_exists, mock_build_post_borrow, mock_get_email,
+    mock_validators, test_client
 ):
     """Test that /opds/{book_id} returns post-borrow publication when user has an active loan."""
     # Setup mocks
@@ -104,7 +106,7 @@ def test_single_item_returns_post_borrow_when_authenticated_with_loan(
     mock_item.is_login_required = True
     mock_item.id = 1
     mock_item_exists.return_value = mock_item
-    mock_loan_exists.return_value = True  # User has an active loan
+    mock_loan_exists.return_value = {123}  # User has an active loan
     mock_get_email.return_value = "test@example.com"  # Mock authenticated user
     
     mock_build_post_borrow.return_value = {
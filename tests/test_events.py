@@ -0,0 +1,103 @@
+import os
+import asyncio
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+def test_subscribers_only_receive_watched_editions():
+    from lenny.core.events import Broker
+
+    async def run():
+        broker = Broker()
+        with broker.subscribe(editions={123}) as watching, broker.subscribe() as everything:
+            broker.publish({"token": 1, "edition": 456})
+            broker.publish({"token": 2, "edition": 123})
+            assert (await everything.get(timeout=1))["token"] == 1
+            assert (await everything.get(timeout=1))["token"] == 2
+            assert (await watching.get(timeout=1))["token"] == 2
+        assert not broker.subscribers
+
+    asyncio.run(run())
+
+
+def test_slow_subscriber_is_dropped_not_buffered():
+    from lenny.core.events import Broker, DROPPED
+
+    async def run():
+        broker = Broker()
+        with broker.subscribe(maxsize=2) as subscriber:
+            for token in range(5):
+                broker.publish({"token": token, "edition": 123})
+            await asyncio.sleep(0)
+            assert subscriber.dropped
+            assert subscriber.queue.qsize() == 1
+            assert await subscriber.get(timeout=1) is DROPPED
+
+    asyncio.run(run())
+
+
+def test_too_many_subscribers():
+    from lenny.core.events import Broker, TooManySubscribersError
+
+    async def run():
+        broker = Broker(max_subscribers=1)
+        with broker.subscribe():
+            with pytest.raises(TooManySubscribersError):
+                with broker.subscribe():
+                    pass
+
+    asyncio.run(run())
+
+
+def test_loan_writes_publish_availability_after_commit(db_session):
+    from lenny.core.models import Item, Loan, FormatEnum
+    from lenny.core.utils import hash_email
+
+    published = []
+    with patch("lenny.core.events.broker.publish", side_effect=published.append):
+        item = Item(id=1, openlibrary_edition=123, encrypted=True, formats=FormatEnum.EPUB)
+        db_session.add(item)
+        db_session.commit()
+
+        loan = Loan(id=1, item_id=item.id, patron_email_hash=hash_email("patron@example.com"))
+        db_session.add(loan)
+        db_session.flush()
+        assert len(published) == 1  # nothing until commit
+        db_session.commit()
+
+        loan.finalize()
+
+        db_session.add(Loan(id=2, item_id=item.id, patron_email_hash=hash_email("other@example.com")))
+        db_session.flush()
+        db_session.rollback()
+
+    assert [(e["kind"], e["available"]) for e in published] == [
+        ("added", True), ("availability", False), ("availability", True)
+    ]
+    assert [e["token"] for e in published] == sorted(e["token"] for e in published)
+
+
+def test_replayed_events_count_loans_in_one_query(db_session):
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+    from lenny.core.models import Item, Loan, FormatEnum
+    from lenny.core.utils import hash_email
+
+    for id in range(1, 4):
+        db_session.add(Item(id=id, openlibrary_edition=100 + id, encrypted=True, formats=FormatEnum.EPUB))
+    db_session.commit()
+    db_session.add(Loan(id=1, item_id=1, patron_email_hash=hash_email("patron@example.com")))
+    db_session.commit()
+
+    with patch("lenny.core.api.Loan.active_counts", wraps=Loan.active_counts) as active_counts:
+        replayed = LennyAPI.availability_events(0)
+
+    active_counts.assert_called_once()
+    assert [(e["edition"], e["kind"], e["available"]) for e in replayed] == [
+        (101, "added", False), (102, "added", True), (103, "added", True), (101, "availability", False)
+    ]
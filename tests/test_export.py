@@ -0,0 +1,120 @@
+import os
+import json
+import gzip
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("pyopds2_lenny")
+
+
+def _feed(offset, limit):
+    return {"metadata": {"title": "Lenny Catalog"}, "publications": [{"metadata": {"title": f"Book {offset}"}}]}
+
+
+def test_export_writes_precompressed_pages_and_index(tmp_path):
+    from lenny.core.export import CatalogExporter
+
+    exporter = CatalogExporter(str(tmp_path), page_size=2)
+    with patch.object(exporter, "page_versions", return_value=["v0", "v1"]), \
+         patch("lenny.core.export.LennyAPI.base_feed", side_effect=lambda offset, limit, auth_mode_direct: _feed(offset, limit)):
+        index = exporter.export()
+
+    assert [page["href"] for page in index["pages"]] == ["offset-0-limit-2.json", "offset-2-limit-2.json"]
+    assert json.loads((tmp_path / "offset-2-limit-2.json").read_bytes()) == _feed(2, 2)
+    assert json.loads(gzip.decompress((tmp_path / "offset-2-limit-2.json.gz").read_bytes())) == _feed(2, 2)
+    assert json.loads((tmp_path / "index.json").read_bytes())["pages"] == index["pages"]
+
+
+def test_export_only_rewrites_changed_pages(tmp_path):
+    from lenny.core.export import CatalogExporter
+
+    exporter = CatalogExporter(str(tmp_path), page_size=2)
+    build = lambda offset, limit, auth_mode_direct: _feed(offset, limit)
+    with patch.object(exporter, "page_versions", return_value=["v0", "v1", "v2"]), \
+         patch("lenny.core.export.LennyAPI.base_feed", side_effect=build):
+        exporter.export()
+
+    with patch.object(exporter, "page_versions", return_value=["v0", "v1-borrowed"]), \
+         patch("lenny.core.export.LennyAPI.base_feed", side_effect=build) as mock_feed:
+        index = exporter.export()
+
+    mock_feed.assert_called_once_with(offset=2, limit=2, auth_mode_direct=False)
+    assert len(index["pages"]) == 2
+    assert not (tmp_path / "offset-4-limit-2.json").exists()
+
+    with patch.object(exporter, "page_versions", return_value=["v0", "v1-borrowed"]), \
+         patch("lenny.core.export.LennyAPI.base_feed") as mock_feed:
+        assert exporter.export() == index
+    mock_feed.assert_not_called()
+
+
+def test_export_at_another_page_size_replaces_pages(tmp_path):
+    from lenny.core import compression
+    from lenny.core.export import CatalogExporter
+
+    build = lambda offset, limit, auth_mode_direct: _feed(offset, limit)
+    with patch("lenny.core.export.LennyAPI.base_feed", side_effect=build):
+        exporter = CatalogExporter(str(tmp_path), page_size=2)
+        with patch.object(exporter, "page_versions", return_value=["v0", "v1"]):
+            exporter.export()
+        exporter = CatalogExporter(str(tmp_path), page_size=4)
+        with patch.object(exporter, "page_versions", return_value=["v0"]):
+            index = exporter.export()
+
+    assert [page["href"] for page in index["pages"]] == ["offset-0-limit-4.json"]
+    variants = {"offset-0-limit-4.json" + CatalogExporter.SUFFIXES[e] for e in compression.ENCODINGS}
+    assert {path.name for path in tmp_path.glob("offset-*")} == {"offset-0-limit-4.json"} | variants
+
+def test_export_skips_pages_built_while_open_library_fails(tmp_path):
+    from lenny.core.export import CatalogExporter
+    from lenny.core.openlibrary import OpenLibrary
+
+    def thin(offset, limit, auth_mode_direct):
+        if offset:
+            OpenLibrary._degrade()
+        return _feed(offset, limit)
+
+    exporter = CatalogExporter(str(tmp_path), page_size=2)
+    build = lambda offset, limit, auth_mode_direct: _feed(offset, limit)
+    with patch.object(exporter, "page_versions", return_value=["v0", "v1"]), \
+         patch("lenny.core.export.LennyAPI.base_feed", side_effect=build):
+        exporter.export()
+    written = (tmp_path / "offset-2-limit-2.json").read_bytes()
+
+    with patch.object(exporter, "page_versions", return_value=["v0-new", "v1-new", "v2"]), \
+         patch("lenny.core.export.LennyAPI.base_feed", side_effect=thin):
+        index = exporter.export()
+
+    # The failed pages keep their previous version (if any), to be retried
+    assert [(page["offset"], page["version"]) for page in index["pages"]] == [(0, "v0-new"), (2, "v1")]
+    assert (tmp_path / "offset-2-limit-2.json").read_bytes() == written
+    assert not (tmp_path / "offset-4-limit-2.json").exists()
+
+    with patch.object(exporter, "page_versions", return_value=["v0-new", "v1-new", "v2"]), \
+         patch("lenny.core.export.LennyAPI.base_feed", side_effect=build) as mock_feed:
+        exporter.export()
+    assert [c.kwargs["offset"] for c in mock_feed.call_args_list] == [2, 4]
+
+def test_page_versions_follow_id_order_and_facets(tmp_path, db_session):
+    from lenny.core.export import CatalogExporter
+    from lenny.core.models import Item, FormatEnum
+
+    db_session.add_all([
+        Item(id=id, openlibrary_edition=id * 111, encrypted=False, formats=FormatEnum.EPUB)
+        for id in (3, 1, 2)
+    ])
+    db_session.commit()
+    exporter = CatalogExporter(str(tmp_path), page_size=2)
+
+    with patch("lenny.core.export.db", db_session):
+        before = exporter.page_versions()
+        # Every page carries the facet groups
+        db_session.get(Item, 3).set_facets("language", ["eng"])
+        db_session.commit()
+        after = exporter.page_versions()
+
+    assert len(before) == len(after) == 2
+    assert before[0] != after[0] and before[1] != after[1]
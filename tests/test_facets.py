@@ -0,0 +1,157 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+def counts(facet):
+    from lenny.core.models import FacetCount
+    return dict(FacetCount.top(facet))
+
+
+def test_facet_counts_follow_item_writes(db_session):
+    from lenny.core.models import Item, FormatEnum
+
+    epub = Item(id=1, openlibrary_edition=111, encrypted=True, formats=FormatEnum.EPUB)
+    both = Item(id=2, openlibrary_edition=222, encrypted=False, formats=FormatEnum.EPUB_PDF)
+    db_session.add_all([epub, both])
+    db_session.commit()
+    assert counts("format") == {"epub": 2, "pdf": 1}
+    assert counts("access") == {"lendable": 1, "open": 1}
+
+    epub.set_facets("language", ["eng", "fre"])
+    both.set_facets("language", ["eng"])
+    db_session.commit()
+    assert counts("language") == {"eng": 2, "fre": 1}
+
+    epub.set_facets("language", ["eng"])
+    epub.encrypted = False
+    db_session.commit()
+    assert counts("language") == {"eng": 2}
+    assert counts("access") == {"open": 2}
+
+    db_session.delete(both)
+    db_session.commit()
+    assert counts("format") == {"epub": 1}
+    assert counts("language") == {"eng": 1}
+
+
+def test_rebuild_matches_incremental_counts(db_session):
+    from lenny.core.models import Item, FacetCount, FormatEnum
+
+    item = Item(id=1, openlibrary_edition=111, encrypted=True, formats=FormatEnum.PDF)
+    db_session.add(item)
+    item.set_facets("subject", ["Poetry"])
+    db_session.commit()
+    before = {facet: counts(facet) for facet in FacetCount.FACETS}
+
+    FacetCount.rebuild()
+    assert {facet: counts(facet) for facet in FacetCount.FACETS} == before
+
+
+def test_filtered_by_facets(db_session):
+    from lenny.core.models import Item, FormatEnum
+
+    db_session.add_all([
+        Item(id=1, openlibrary_edition=111, encrypted=True, formats=FormatEnum.EPUB),
+        Item(id=2, openlibrary_edition=222, encrypted=False, formats=FormatEnum.EPUB_PDF),
+        Item(id=3, openlibrary_edition=333, encrypted=False, formats=FormatEnum.PDF),
+    ])
+    db_session.commit()
+    db_session.get(Item, 2).set_facets("language", ["fre"])
+    db_session.commit()
+
+    assert [i.id for i in Item.get_many_filtered(format="pdf")] == [2, 3]
+    assert [i.id for i in Item.get_many_filtered(format="epub", language="fre")] == [2]
+
+
+def test_facet_groups_link_to_narrowed_catalog(db_session):
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+    from lenny.core.models import Item, FormatEnum
+
+    db_session.add(Item(id=1, openlibrary_edition=111, encrypted=True, formats=FormatEnum.EPUB))
+    db_session.commit()
+
+    groups = {g["metadata"]["title"]: g["links"] for g in LennyAPI.facet_groups(available=True, format="epub")}
+    assert groups["Access"][0]["title"] == "Lendable"
+    assert groups["Access"][0]["properties"]["numberOfItems"] == 1
+    assert "available=true" in groups["Access"][0]["href"]
+    assert groups["Format"][0]["rel"] == "self"
+
+
+def test_index_metadata_stores_editions_and_facets(db_session):
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+    from lenny.core.models import Item, Edition, FormatEnum
+    from lenny.core.openlibrary import OpenLibraryRecord
+
+    item = Item(id=1, openlibrary_edition=123, encrypted=False, formats=FormatEnum.EPUB)
+    db_session.add(item)
+    db_session.commit()
+    book = OpenLibraryRecord({
+        "title": "Moby Dick",
+        "author_name": ["Herman Melville"],
+        "subject": ["Whales", "Sea stories"],
+        "editions": {"docs": [{"key": "/books/OL123M", "title": "Moby-Dick", "language": ["eng", "fre"]}]},
+    })
+
+    with patch("lenny.core.api.db", db_session), \
+         patch("lenny.core.api.OpenLibrary.search", return_value=[book]), \
+         patch("lenny.core.api.suggest_index.add") as suggest_add:
+        LennyAPI.index_metadata([item])
+
+    edition = db_session.get(Edition, 123)
+    assert (edition.title, edition.authors) == ("Moby-Dick", ["Herman Melville"])
+    assert counts("language") == {"eng": 1, "fre": 1}
+    assert counts("subject") == {"Whales": 1, "Sea stories": 1}
+    suggest_add.assert_called_once_with(123, "Moby-Dick", ["Herman Melville"])
+
+
+def test_index_metadata_searches_at_background_priority(db_session):
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core import openlibrary
+    from lenny.core.api import LennyAPI
+    from lenny.core.models import Item, FormatEnum
+
+    item = Item(id=1, openlibrary_edition=123, encrypted=False, formats=FormatEnum.EPUB)
+    db_session.add(item)
+    db_session.commit()
+    priorities = []
+
+    def search(**kwargs):
+        priorities.append(openlibrary._priority.get())
+        yield from ()
+
+    with patch("lenny.core.api.db", db_session), \
+         patch("lenny.core.api.OpenLibrary.search", side_effect=search):
+        LennyAPI.index_metadata([item])
+
+    assert priorities == [openlibrary.BACKGROUND]
+
+
+def test_catalog_facets_are_cached_with_the_base_feed(db_session):
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+    from lenny.core.models import Item, FormatEnum
+
+    db_session.add(Item(id=1, openlibrary_edition=111, encrypted=False, formats=FormatEnum.EPUB))
+    db_session.commit()
+
+    with patch("lenny.core.api.LennyAPI.get_enriched_items", return_value={}), \
+         patch("lenny.core.api.LennyAPI.facet_groups", wraps=LennyAPI.facet_groups) as facet_groups:
+        first = LennyAPI.opds_feed(auth_mode_direct=False)
+        second = LennyAPI.opds_feed(auth_mode_direct=False)
+        facet_groups.assert_called_once()
+        assert first == second
+        assert {g["metadata"]["title"] for g in first["facets"]} == {"Access", "Format"}
+
+        db_session.get(Item, 1).set_facets("language", ["eng"])
+        db_session.commit()
+        third = LennyAPI.opds_feed(auth_mode_direct=False)
+    assert facet_groups.call_count == 2
+    assert "Language" in {g["metadata"]["title"] for g in third["facets"]}
@@ -0,0 +1,110 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+PACKAGE = """<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>
+    <item id="c1" href="one.xhtml" media-type="application/xhtml+xml"/>
+    <item id="c2" href="text/two%20b.xhtml" media-type="application/xhtml+xml"/>
+    <item id="notes" href="notes.xhtml" media-type="application/xhtml+xml"/>
+    <item id="css" href="style.css" media-type="text/css"/>
+  </manifest>
+  <spine><itemref idref="c2"/><itemref idref="c1"/></spine>
+</package>"""
+
+
+def make_epub(chapters):
+    """An EPUB whose spine lists `chapters` (two then one)."""
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip")
+        zf.writestr("META-INF/container.xml", CONTAINER)
+        zf.writestr("OEBPS/content.opf", PACKAGE)
+        zf.writestr("OEBPS/text/two b.xhtml", f"<html><head><title>T</title></head><body><p>{chapters[0]}</p></body></html>")
+        zf.writestr("OEBPS/one.xhtml", f"<html><body><p>{chapters[1]}</p><script>var x;</script></body></html>")
+        zf.writestr("OEBPS/notes.xhtml", "<html><body>not in the spine</body></html>")
+    return buf.getvalue()
+
+
+def test_extract_text_follows_spine():
+    from lenny.core.fulltext import extract_text, ExtractionError
+
+    text = extract_text(make_epub(["Call me Ishmael.", "Some years ago &amp; more"]))
+    assert text == "Call me Ishmael.\n\nSome years ago & more"
+    with pytest.raises(ExtractionError):
+        extract_text(b"not a zip")
+
+
+def test_phrase_search_with_snippet_offsets(tmp_path):
+    from lenny.core.fulltext import FullTextIndex, analyze
+
+    index = FullTextIndex(tmp_path / "fulltext.db")
+    index.add(1, analyze(make_epub(["The white whale.", "The White Whale again, the white whale!"])))
+    index.add(2, analyze(make_epub(["A whale, white as snow.", "Nothing here"])))
+
+    total, hits = index.search("white WHALE")
+    assert total == 1
+    assert hits[0]["edition"] == 1 and hits[0]["count"] == 3
+    text = analyze(make_epub(["The white whale.", "The White Whale again, the white whale!"]))["text"]
+    for match in hits[0]["matches"]:
+        assert text[match["start"]:match["end"]].lower() == "white whale"
+        start, end = match["highlight"]
+        assert match["snippet"][start:end].lower() == "white whale"
+
+    assert index.search("whale")[0] == 2
+    assert index.search("whale", within=lambda edition: edition != 1)[0] == 1
+    assert index.search("white snow") == (0, [])
+    assert index.search("kraken") == (0, [])
+
+
+def test_indexer_is_incremental(tmp_path):
+    from lenny.core.fulltext import FullTextIndex, FullTextIndexer
+
+    books = {1: make_epub(["one", "two"]), 2: make_epub(["three", "four"]), 3: b"broken"}
+    fetched = []
+
+    def fetch(edition):
+        fetched.append(edition)
+        return books[edition]
+
+    index = FullTextIndex(tmp_path / "fulltext.db")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        indexer = FullTextIndexer(index, workers=2, fetch=fetch, pool=pool)
+        assert indexer.index_editions([1, 3]) == 1
+        assert indexer.index_editions([1, 2, 3]) == 1
+    # Indexed and failed books are not read again
+    assert sorted(fetched) == [1, 2, 3]
+    assert index.indexed() == {1, 2, 3}
+    assert index.search("three")[0] == 1
+
+    assert index.retry_failed() == 1
+    index.remove(2)
+    assert index.indexed() == {1}
+    assert index.search("three") == (0, [])
+
+
+def test_indexer_replaces_reuploaded_books(tmp_path):
+    from lenny.core.fulltext import FullTextIndex, FullTextIndexer
+
+    books = {1: make_epub(["first edition", "text"])}
+    index = FullTextIndex(tmp_path / "fulltext.db")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        indexer = FullTextIndexer(index, workers=1, fetch=books.get, pool=pool)
+        assert indexer.index_editions([1]) == 1
+        books[1] = make_epub(["second edition", "text"])
+        assert indexer.index_editions([1]) == 0
+        assert indexer.index_editions([1], replace=True) == 1
+    assert index.search("second edition")[0] == 1
+    assert index.search("first edition") == (0, [])
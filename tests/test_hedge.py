@@ -0,0 +1,89 @@
+import os
+import threading
+
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    from lenny.core.metrics import metrics
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+
+
+def observe(n, latency, profile="id"):
+    from lenny.core.metrics import metrics
+    for _ in range(n):
+        metrics.observe("test.latency", latency, profile=profile)
+
+
+def slow_primary(release):
+    """Attempt 0 blocks until released (or cancelled); attempt 1 answers."""
+    def attempt(i):
+        if i == 0:
+            release.wait(timeout=5)
+            return "primary"
+        return "hedge"
+    return attempt
+
+
+def test_no_hedging_until_latency_is_known():
+    from lenny.core.hedge import Hedger
+
+    hedger = Hedger("test", "test.latency")
+    assert hedger.threshold("id") is None
+    assert hedger.run("id", lambda i: f"attempt {i}", cancel=lambda i: None) == "attempt 0"
+
+
+def test_slow_request_is_hedged_and_loser_cancelled(fresh_metrics):
+    from lenny.core.hedge import Hedger
+
+    observe(Hedger.MIN_OBSERVATIONS, 0.05)
+    hedger = Hedger("test", "test.latency", rate=1, burst=1)
+    release, cancelled = threading.Event(), []
+
+    def cancel(i):
+        cancelled.append(i)
+        release.set()
+
+    assert hedger.run("id", slow_primary(release), cancel=cancel) == "hedge"
+    assert cancelled == [0]
+    assert fresh_metrics.counter("test.hedge.sent", profile="id") == 1
+    assert fresh_metrics.counter("test.hedge.won", profile="id") == 1
+    assert fresh_metrics.gauges["test.hedge.threshold{profile=id}"] == 0.05
+
+
+def test_hedges_are_capped_by_budget(fresh_metrics):
+    from lenny.core.hedge import Hedger
+
+    observe(Hedger.MIN_OBSERVATIONS, 0.05)
+    hedger = Hedger("test", "test.latency", rate=0, burst=1)
+    results = []
+    for _ in range(2):
+        release = threading.Event()
+        threading.Timer(0.2, release.set).start()
+        results.append(hedger.run("id", slow_primary(release), cancel=lambda i: release.set()))
+
+    assert results == ["hedge", "primary"]
+    assert fresh_metrics.counter("test.hedge.sent", profile="id") == 1
+    assert fresh_metrics.gauges["test.hedge.rate"] == 0.5
+
+
+def test_failed_attempt_falls_back_to_the_other():
+    from lenny.core.hedge import Hedger
+
+    observe(Hedger.MIN_OBSERVATIONS, 0.05)
+    hedger = Hedger("test", "test.latency", rate=1, burst=1)
+    release = threading.Event()
+
+    def attempt(i):
+        if i == 1:
+            raise RuntimeError("hedge failed")
+        release.wait(timeout=0.3)
+        return "primary"
+
+    assert hedger.run("id", attempt, cancel=lambda i: None) == "primary"
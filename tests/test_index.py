@@ -0,0 +1,72 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+def test_load_sorts_and_flags():
+    from lenny.core.index import CatalogIndex
+
+    index = CatalogIndex()
+    index.load([(30, True, True), (10, False, False), (20, True, False)])
+
+    assert list(index.editions) == [10, 20, 30]
+    assert 20 in index and 25 not in index
+    assert index.is_borrowable(20) and not index.is_borrowable(30)
+    assert not index.is_borrowable(10) and not index.is_encrypted(10)
+    assert [list(batch) for batch in index.batches(2)] == [[10, 20], [30]]
+
+
+def test_refresh_tracks_change_log(db_session):
+    from lenny.core.index import CatalogIndex
+    from lenny.core.models import Item, Loan, FormatEnum
+    from lenny.core.utils import hash_email
+
+    db_session.add(Item(id=1, openlibrary_edition=111, encrypted=True, formats=FormatEnum.EPUB))
+    db_session.commit()
+    index = CatalogIndex().refresh()
+    assert list(index.editions) == [111] and index.is_borrowable(111)
+
+    db_session.add(Item(id=2, openlibrary_edition=50, encrypted=False, formats=FormatEnum.EPUB))
+    db_session.add(Loan(id=1, item_id=1, patron_email_hash=hash_email("patron@example.com")))
+    db_session.commit()
+    with patch.object(index, "reload", side_effect=AssertionError("should be incremental")):
+        index.refresh()
+    assert list(index.editions) == [50, 111]
+    assert not index.is_borrowable(111)
+
+    db_session.delete(db_session.get(Item, 2))
+    db_session.commit()
+    index.refresh()
+    assert list(index.editions) == [111]
+
+
+def test_refresh_applies_changes_committed_late(db_session):
+    from lenny.core.index import CatalogIndex
+    from lenny.core.models import Item, Change, FormatEnum
+
+    db_session.add(Item(id=1, openlibrary_edition=111, encrypted=False, formats=FormatEnum.EPUB))
+    db_session.commit()
+    index = CatalogIndex().refresh()
+    token = index.token
+
+    # Another transaction took the next id but commits after this one
+    db_session.add(Item(id=2, openlibrary_edition=222, encrypted=False, formats=FormatEnum.EPUB))
+    db_session.flush()
+    late = db_session.query(Change).filter(Change.openlibrary_edition == 222).one()
+    late.id = token + 2
+    db_session.commit()
+    index.refresh()
+    assert index.token == token and 222 not in index
+
+    db_session.add(Item(id=3, openlibrary_edition=333, encrypted=False, formats=FormatEnum.EPUB))
+    db_session.flush()
+    db_session.query(Change).filter(Change.openlibrary_edition == 333).one().id = token + 1
+    db_session.commit()
+    index.refresh()
+    assert index.token == token + 2
+    assert list(index.editions) == [111, 222, 333]
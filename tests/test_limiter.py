@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from lenny.core.limiter import PriorityLimiter, INTERACTIVE, BACKGROUND
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    from lenny.core.metrics import metrics
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+
+
+def test_interactive_requests_go_first():
+    limiter = PriorityLimiter("test", max_in_flight=1)
+    order, release = [], threading.Event()
+
+    def request(name, priority, started=None):
+        with limiter.slot(priority):
+            if started:
+                started.set()
+                release.wait(timeout=5)
+            order.append(name)
+
+    started = threading.Event()
+    first = threading.Thread(target=request, args=("first", BACKGROUND, started))
+    first.start()
+    started.wait(timeout=5)
+    queued = [threading.Thread(target=request, args=("background", BACKGROUND))]
+    queued[0].start()
+    while len(limiter._waiting) < 1:
+        time.sleep(0.001)
+    queued.append(threading.Thread(target=request, args=("interactive", INTERACTIVE)))
+    queued[1].start()
+    while len(limiter._waiting) < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in [first] + queued:
+        thread.join(timeout=5)
+
+    assert order == ["first", "interactive", "background"]
+    assert limiter.in_flight == 0
+
+
+def test_rate_cap_spaces_requests_and_wait_is_observed(fresh_metrics):
+    limiter = PriorityLimiter("test", max_in_flight=4, rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(3):
+        with limiter.slot(INTERACTIVE):
+            pass
+    # A burst of one, then one request every 50ms
+    assert time.monotonic() - start >= 0.09
+    assert fresh_metrics.summary("test.queue_wait", priority=INTERACTIVE).count == 3
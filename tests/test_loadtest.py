@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+httpx = pytest.importorskip("httpx")
+
+
+def test_runs_the_mix_and_reports_per_route():
+    from lenny.core.loadtest import LoadTest
+
+    seen = []
+
+    def handler(request):
+        seen.append((request.method, request.url.path, request.headers.get("cookie")))
+        if request.url.path == "/v1/api/shelf":
+            return httpx.Response(500)
+        return httpx.Response(200, json={})
+
+    test = LoadTest("http://lenny", editions=[1, 2], lendable=[3], queries=["moby dick"],
+                    patrons=["cookie"], concurrency=3, seed=1, transport=httpx.MockTransport(handler))
+    report = test.run(requests=200)
+
+    assert report["requests"] == len(seen) == 200
+    assert set(report["routes"]) == {
+        "GET /opds", "GET /opds/search", "POST /items/{id}/borrow",
+        "POST /items/{id}/return", "GET /shelf", "GET /items/{id}/readium/manifest.json",
+    }
+    shelf = report["routes"]["GET /shelf"]
+    assert shelf["errors"] == shelf["count"] == report["errors"]
+    assert shelf["p50"] <= shelf["p95"] <= shelf["p99"]
+    assert ("POST", "/v1/api/items/3/borrow", "session=cookie") in seen
+    assert ("GET", "/v1/api/opds/search", None) in {(m, p, c) for m, p, c in seen}
+
+
+def test_mix_leaves_out_actions_without_data():
+    from lenny.core.loadtest import LoadTest, BROWSE, SEARCH, READ
+
+    test = LoadTest("http://lenny", editions=[1], queries=["q"])
+    assert set(test.mix) == {BROWSE, SEARCH, READ}
+    with pytest.raises(ValueError):
+        LoadTest("http://lenny", editions=[], queries=[], mix={"shelf": 1})
+
+
+def test_compare_flags_regressions():
+    from lenny.core.loadtest import compare
+
+    def report(throughput, p95, errors=0, queries=100):
+        return {
+            "requests": 100, "throughput": throughput,
+            "routes": {"GET /opds": {"count": 100, "errors": errors, "p95": p95, "p99": p95}},
+            "counters": {"db.queries": queries},
+        }
+
+    baseline = report(100, 0.050)
+    assert compare(report(95, 0.055), baseline) == []
+    regressions = compare(report(50, 0.100, errors=5, queries=300), baseline)
+    assert len(regressions) == 5
+    assert regressions[0] == "throughput 100 -> 50 req/s"
+    assert "GET /opds p95 50.0 -> 100.0 ms" in regressions
+    assert "db.queries 1.00 -> 3.00 per request" in regressions
@@ -0,0 +1,51 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+@pytest.fixture
+def catalog(db_session):
+    from lenny.core.models import Item, Loan, FormatEnum
+    from lenny.core.utils import hash_email
+
+    db_session.add_all([
+        Item(id=1, openlibrary_edition=111, encrypted=True, formats=FormatEnum.EPUB),
+        Item(id=2, openlibrary_edition=222, encrypted=True, formats=FormatEnum.EPUB),
+        Item(id=3, openlibrary_edition=333, encrypted=False, formats=FormatEnum.EPUB),
+    ])
+    db_session.commit()
+    db_session.add(Loan(id=1, item_id=2, patron_email_hash=hash_email("patron@example.com")))
+    db_session.commit()
+    return db_session
+
+
+def test_active_counts_groups_loans_in_one_query(catalog):
+    from lenny.core.models import Loan
+
+    assert Loan.active_counts([1, 2, 3]) == {2: 1}
+    assert Loan.active_counts([]) == {}
+
+
+def test_lookup_feed_reports_availability_per_id(catalog):
+    pytest.importorskip("pyopds2_lenny")
+    from lenny.core.api import LennyAPI
+
+    with patch.object(LennyAPI, "items_feed", return_value={"publications": []}) as mock_feed:
+        feed = LennyAPI.lookup_feed([111, 222, 333, 444, 111], email="other@example.com")
+
+    assert feed["availability"] == {
+        "OL111M": "available",
+        "OL222M": "unavailable",
+        "OL333M": "available",
+        "OL444M": "not_found",
+    }
+    assert set(mock_feed.call_args.args[0]) == {111, 222, 333}
+
+    with patch.object(LennyAPI, "items_feed", return_value={"publications": []}):
+        feed = LennyAPI.lookup_feed([222], email="patron@example.com")
+    assert feed["availability"] == {"OL222M": "borrowed"}
@@ -0,0 +1,96 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("pyopds2_lenny")
+
+
+def _pub(edition_id, rel="http://opds-spec.org/acquisition/borrow"):
+    return {
+        "metadata": {"title": f"Book {edition_id}"},
+        "links": [{"rel": rel, "href": f"http://localhost/v1/api/items/{edition_id}/borrow"}],
+    }
+
+
+def test_publication_edition_id():
+    from lenny.core.api import LennyAPI
+
+    assert LennyAPI.publication_edition_id(_pub(123)) == 123
+    assert LennyAPI.publication_edition_id({"metadata": {"@id": "OL55M"}, "links": []}) == 55
+    assert LennyAPI.publication_edition_id({"metadata": {}, "links": [{"href": "/v1/api/opds/7"}]}) == 7
+    assert LennyAPI.publication_edition_id({"metadata": {}, "links": []}) is None
+
+
+def test_overlay_loans_swaps_borrowed_publications_without_mutating_base():
+    from lenny.core.api import LennyAPI
+
+    base = {"metadata": {"title": "Lenny Catalog"}, "publications": [_pub(1), _pub(2)]}
+    borrowed = {"metadata": {"title": "Book 2"}, "links": [{"rel": "http://opds-spec.org/acquisition/return"}]}
+
+    with patch("lenny.core.api.build_post_borrow_publication", return_value=borrowed) as mock_build:
+        feed = LennyAPI.overlay_loans(base, {2}, auth_mode_direct=False)
+
+    mock_build.assert_called_once_with(2, auth_mode_direct=False)
+    assert feed["publications"] == [_pub(1), borrowed]
+    assert base["publications"] == [_pub(1), _pub(2)]
+    assert LennyAPI.overlay_loans(base, set()) is base
+
+
+def test_opds_feed_shares_base_feed_between_patrons():
+    from lenny.core.api import LennyAPI
+
+    LennyAPI.FEED_CACHE.clear()
+    base = {"metadata": {"title": "Lenny Catalog"}, "publications": [_pub(1)]}
+
+    with patch("lenny.core.api.LennyAPI.catalog_version", return_value=("v1",)), \
+         patch("lenny.core.api.LennyAPI._build_feed", return_value=base) as mock_build, \
+         patch("lenny.core.api.Loan.get_active_editions", return_value=set()):
+        anonymous = LennyAPI.opds_feed(auth_mode_direct=False)
+        patron = LennyAPI.opds_feed(auth_mode_direct=False, email="patron@example.com")
+
+    mock_build.assert_called_once()
+    assert anonymous == patron == base
+
+
+def test_base_feed_shares_publications_of_cached_pages_only():
+    from lenny.core import serialize
+    from lenny.core.api import LennyAPI
+    from lenny.core.openlibrary import OpenLibrary
+
+    cached = {"metadata": {"title": "Lenny Catalog"}, "publications": [_pub(1)]}
+    degraded = {"metadata": {"title": "Lenny Catalog"}, "publications": [_pub(2)]}
+
+    def build(**kwargs):
+        if kwargs.get("offset"):
+            OpenLibrary._degrade()
+            return degraded
+        return cached
+
+    with patch("lenny.core.api.LennyAPI.catalog_version", return_value=("v1",)), \
+         patch("lenny.core.api.LennyAPI._build_feed", side_effect=build):
+        LennyAPI.base_feed(auth_mode_direct=False)
+        LennyAPI.base_feed(offset=10, auth_mode_direct=False)
+
+    assert id(cached["publications"][0]) in serialize.FRAGMENTS
+    assert id(degraded["publications"][0]) not in serialize.FRAGMENTS
+
+
+def test_base_feed_built_while_open_library_fails_is_not_cached():
+    from lenny.core.api import LennyAPI
+    from lenny.core.openlibrary import OpenLibrary
+
+    def build(**kwargs):
+        OpenLibrary._degrade()
+        return {"metadata": {"title": "Lenny Catalog"}, "publications": []}
+
+    with patch("lenny.core.api.LennyAPI.catalog_version", return_value=("v1",)), \
+         patch("lenny.core.api.LennyAPI._build_feed", side_effect=build) as mock_build, \
+         OpenLibrary.tracking() as upstream:
+        LennyAPI.base_feed(auth_mode_direct=False)
+        LennyAPI.base_feed(auth_mode_direct=False)
+
+    assert mock_build.call_count == 2
+    assert upstream.degraded
@@ -0,0 +1,279 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from lenny.core.openlibrary import OpenLibraryRecord, OpenLibraryID
+
+
+def make_doc(n=1):
+    return {
+        "key": "/works/OL1W",
+        "title": "Moby Dick",
+        "author_name": ["Herman Melville"],
+        "editions": {"numFound": n, "docs": [
+            {"key": f"/books/OL{i}M", "title": "Moby Dick", "cover_i": 7} for i in range(1, n + 1)
+        ]},
+    }
+
+
+def test_nested_values_are_wrapped_once_on_access():
+    doc = make_doc(2)
+    record = OpenLibraryRecord(doc)
+
+    # Nothing is wrapped up front
+    assert type(dict.__getitem__(record, "editions")) is dict
+    editions = record.editions
+    assert isinstance(editions, OpenLibraryRecord)
+    assert record.editions is editions
+    assert editions.docs is editions["docs"]
+    assert editions.docs[1].key == "/books/OL2M"
+    assert record.get("missing") is None
+    assert all(isinstance(v, OpenLibraryRecord) for v in record.editions.values() if isinstance(v, dict))
+    # The source doc is left untouched
+    assert type(doc["editions"]) is dict
+
+
+def test_olid_and_edition_are_cached():
+    record = OpenLibraryRecord(make_doc())
+
+    assert record.olid == "OL1M" and int(record.olid) == 1
+    assert isinstance(record.olid, OpenLibraryID)
+    assert record.olid is record.olid and record.edition is record.edition
+    assert record.cover_url == "https://covers.openlibrary.org/b/id/7-M.jpg"
+
+    record.editions = {"docs": [{"key": "/books/OL9M"}]}
+    assert int(record.olid) == 9
+
+
+def test_merge_shares_values():
+    record = OpenLibraryRecord(make_doc())
+    edition = record.edition
+
+    merged = record + {"lenny": 42}
+    assert merged.lenny == 42 and "lenny" not in record
+    assert merged.editions is record.editions
+    assert merged.edition is edition and int(merged.olid) == 1
+    assert merged.title == "Moby Dick"
+
+
+def test_field_profiles():
+    from urllib.parse import parse_qs, urlparse
+    from lenny.core.openlibrary import OpenLibrary
+
+    def fields(url):
+        return parse_qs(urlparse(url).query)["fields"][0].split(",")
+
+    assert fields(OpenLibrary._construct_search_url("q")) == OpenLibrary.DEFAULT_FIELDS
+    assert fields(OpenLibrary._construct_search_url("q", ["subject", "key"], profile=OpenLibrary.ID)) == [
+        "key", "editions", "editions.key", "subject"
+    ]
+    assert fields(OpenLibrary._construct_search_url("q", ["edition_key"], profile=None)) == ["edition_key"]
+    assert "editions.*" not in fields(OpenLibrary._construct_search_url("q", profile=OpenLibrary.CARD))
+
+
+def test_search_ids_reads_raw_docs():
+    from lenny.core.openlibrary import OpenLibrary
+
+    page = {"docs": [make_doc(), {"key": "/works/OL2W"}, {"editions": {"docs": [{"key": "/books/OL5M"}]}}]}
+    with patch.object(OpenLibrary, "search_json", return_value=page) as search_json, \
+         patch("lenny.core.openlibrary.OpenLibraryRecord") as wrap:
+        assert list(OpenLibrary.search_ids("q")) == [1, 5]
+    wrap.assert_not_called()
+    assert search_json.call_args.kwargs["profile"] == OpenLibrary.ID
+
+
+@pytest.fixture
+def upstream():
+    from lenny.core.openlibrary import OpenLibrary
+
+    OpenLibrary._known_good.clear()
+    OpenLibrary._edition_docs.clear()
+    OpenLibrary._editions.clear()
+    OpenLibrary._breaker.reset()
+    with patch.object(OpenLibrary, "_request_json") as request:
+        yield request
+    OpenLibrary._known_good.clear()
+    OpenLibrary._edition_docs.clear()
+    OpenLibrary._editions.clear()
+    OpenLibrary._breaker.reset()
+
+
+def test_stale_response_served_while_revalidating(upstream):
+    from lenny.core.openlibrary import OpenLibrary
+
+    upstream.return_value = {"docs": [make_doc()]}
+    assert OpenLibrary.search_json("moby")["docs"][0]["title"] == "Moby Dick"
+    assert OpenLibrary.search_json("moby")["docs"][0]["title"] == "Moby Dick"
+    assert upstream.call_count == 1
+
+    refreshed = threading.Event()
+    def request(url):
+        refreshed.set()
+        return {"docs": []}
+    upstream.side_effect = request
+    refresher = ThreadPoolExecutor(max_workers=1)
+    with patch.object(OpenLibrary, "FRESH_TTL", 0), patch.object(OpenLibrary, "_refresher", refresher):
+        # The stale response comes back at once; the refresh follows
+        assert OpenLibrary.search_json("moby")["docs"]
+        assert refreshed.wait(timeout=5)
+        refresher.submit(lambda: None).result(timeout=5)
+    assert OpenLibrary.search_json("moby") == {"docs": []}
+
+
+def test_open_breaker_fails_fast_with_known_good_editions(upstream):
+    import httpx
+    from lenny.core.openlibrary import OpenLibrary
+
+    upstream.return_value = {"docs": [make_doc()]}
+    list(OpenLibrary.search_ids("edition_key:(OL1M)"))
+
+    upstream.side_effect = httpx.ConnectTimeout("down")
+    for _ in range(OpenLibrary._breaker.failures):
+        assert OpenLibrary.search_json("python") == {}
+    assert OpenLibrary._breaker.state == "open"
+    calls = upstream.call_count
+
+    # No upstream call while open; editions seen before are still served
+    assert list(OpenLibrary.search_ids("edition_key:(OL1M OR OL2M)")) == [1]
+    assert OpenLibrary.search_json("java") == {}
+    assert upstream.call_count == calls
+
+
+def test_tracking_flags_failed_and_refused_requests(upstream):
+    import httpx
+    from lenny.core.openlibrary import OpenLibrary
+
+    upstream.return_value = {"docs": [make_doc()]}
+    with OpenLibrary.tracking() as outer:
+        with OpenLibrary.tracking() as good:
+            OpenLibrary.search_json("moby")
+        assert not good.degraded and not outer.degraded
+
+        upstream.side_effect = httpx.ConnectTimeout("down")
+        with OpenLibrary.tracking() as failed:
+            assert OpenLibrary.search_json("python") == {}
+    assert failed.degraded and outer.degraded
+
+    for _ in range(OpenLibrary._breaker.failures):
+        OpenLibrary.search_json("java")
+    with OpenLibrary.tracking() as refused:
+        pass
+    assert OpenLibrary._breaker.state == "open" and refused.degraded
+
+
+def test_unexpected_error_ends_breaker_trial(upstream):
+    import httpx
+    from lenny.core.openlibrary import OpenLibrary
+
+    upstream.side_effect = httpx.ConnectTimeout("down")
+    for _ in range(OpenLibrary._breaker.failures):
+        OpenLibrary.search_json("python")
+    assert OpenLibrary._breaker.state == "open"
+
+    upstream.side_effect = RuntimeError("bug")
+    with patch.object(OpenLibrary._breaker, "reset_timeout", 0), OpenLibrary.tracking() as health:
+        with pytest.raises(RuntimeError):
+            OpenLibrary.search_json("java")
+        assert OpenLibrary._breaker.state == "open" and health.degraded
+        # The failed trial was recorded, so the next call is a new trial
+        upstream.side_effect = None
+        upstream.return_value = {"docs": []}
+        assert OpenLibrary.search_json("ruby") == {"docs": []}
+    assert OpenLibrary._breaker.state == "closed"
+
+def test_slow_search_is_hedged(upstream):
+    from lenny.core.hedge import Hedger
+    from lenny.core.metrics import metrics
+    from lenny.core.openlibrary import OpenLibrary
+
+    for _ in range(Hedger.MIN_OBSERVATIONS):
+        metrics.observe("openlibrary.latency", 0.05, profile="id")
+    calls = []
+
+    def request(url, client=None):
+        calls.append(client)
+        if len(calls) == 1:
+            threading.Event().wait(timeout=0.5)
+            return {"docs": ["slow"]}
+        return {"docs": ["fast"]}
+
+    upstream.side_effect = request
+    with patch.object(OpenLibrary, "HEDGE", True):
+        assert OpenLibrary.search_json("hedged", profile=OpenLibrary.ID) == {"docs": ["fast"]}
+    assert len(calls) == 2 and calls[0] is not calls[1]
+    assert calls[0].is_closed
+
+
+@pytest.fixture
+def stand_in():
+    """A local stand-in for Open Library's `/api/books`, serving
+    editions 1-9 and recording the bibkeys of each request."""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+    from lenny.core.openlibrary import OpenLibrary
+
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            keys = parse_qs(urlparse(self.path).query)["bibkeys"][0].split(",")
+            requests.append(keys)
+            body = json.dumps({
+                key: {"key": f"/books/{key[5:]}", "title": f"Book {key[7:-1]}"}
+                for key in keys if int(key[7:-1]) < 10
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    OpenLibrary._editions.clear()
+    OpenLibrary._breaker.reset()
+    with patch.object(OpenLibrary, "BOOKS_URL", f"http://127.0.0.1:{server.server_port}/api/books"):
+        yield requests
+    server.shutdown()
+    server.server_close()
+    OpenLibrary._editions.clear()
+
+
+def test_get_editions_fetches_by_key_in_batches(stand_in):
+    from lenny.core.openlibrary import OpenLibrary
+
+    with patch.object(OpenLibrary, "BOOKS_BATCH_SIZE", 2):
+        editions = OpenLibrary.get_editions([3, 1, 42, 3])
+    assert list(editions) == [3, 1]
+    assert editions[1]["title"] == "Book 1"
+    assert stand_in == [["OLID:OL3M", "OLID:OL1M"], ["OLID:OL42M"]]
+
+
+def test_get_editions_only_requests_uncached(stand_in):
+    from lenny.core.openlibrary import OpenLibrary
+
+    OpenLibrary.get_editions([1, 42])
+    assert list(OpenLibrary.get_editions([1, 2, 42])) == [1, 2]
+    # 1 was cached, and so was 42's absence
+    assert stand_in == [["OLID:OL1M", "OLID:OL42M"], ["OLID:OL2M"]]
+    assert list(OpenLibrary.get_editions([2, 1])) == [2, 1]
+    assert len(stand_in) == 2
+
+
+def test_get_editions_does_not_cache_failures(stand_in):
+    import httpx
+    from lenny.core.openlibrary import OpenLibrary
+
+    with patch.object(OpenLibrary, "_request_json", side_effect=httpx.ConnectError("down")):
+        assert OpenLibrary.get_editions([1]) == {}
+    assert list(OpenLibrary.get_editions([1])) == [1]
+    OpenLibrary._breaker.reset()
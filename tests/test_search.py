@@ -59,11 +59,20 @@ def test_item_get_all_empty_db():
 # Task 4 tests: search_feed
 # ---------------------------------------------------------------------------
 
+def make_index(*rows):
+    """A CatalogIndex of (edition, encrypted, on_loan) rows."""
+    from lenny.core.index import CatalogIndex
+
+    index = CatalogIndex()
+    index.load(rows)
+    return index
+
+
 def test_search_feed_empty_query_returns_empty_catalog():
     """Verify empty query returns empty catalog without hitting OL."""
     from lenny.core.api import LennyAPI
 
-    with patch("lenny.core.api.OpenLibrary.search") as mock_ol_search, \
+    with patch("lenny.core.api.OpenLibrary.search_ids") as mock_ol_search, \
          patch("lenny.core.api.LennyDataProvider.empty_catalog", return_value={"empty": True}) as mock_empty:
         result = LennyAPI.search_feed(query="", auth_mode_direct=False)
 
@@ -76,8 +85,8 @@ def test_search_feed_no_items_returns_empty_catalog():
     """Verify empty DB returns empty catalog without querying OL."""
     from lenny.core.api import LennyAPI
 
-    with patch("lenny.core.api.Item.get_all", return_value={}) as mock_fetch, \
-         patch("lenny.core.api.OpenLibrary.search") as mock_ol_search, \
+    with patch("lenny.core.api.catalog_index.refresh", return_value=make_index()) as mock_fetch, \
+         patch("lenny.core.api.OpenLibrary.search_ids") as mock_ol_search, \
          patch("lenny.core.api.LennyDataProvider.empty_catalog", return_value={"empty": True}) as mock_empty:
         result = LennyAPI.search_feed(query="python", auth_mode_direct=False)
 
@@ -106,19 +115,14 @@ def test_search_feed_builds_chunked_query():
 
     all_items = {10: item1, 20: item2}
 
-    # Create mock OL search results matching those items
-    ol_record1 = MagicMock()
-    ol_record1.olid = "10"
-    ol_record2 = MagicMock()
-    ol_record2.olid = "20"
-
     # Mock LennyDataProvider.search response
     mock_lenny_record = MagicMock(spec=["auth_mode_direct"])
     mock_search_response = MagicMock()
     mock_search_response.records = [mock_lenny_record]
 
-    with patch("lenny.core.api.Item.get_all", return_value=all_items), \
-         patch("lenny.core.api.OpenLibrary.search", return_value=[ol_record1, ol_record2]) as mock_ol_search, \
+    rows = [(edition, item.encrypted, not item.is_borrowable) for edition, item in all_items.items()]
+    with patch("lenny.core.api.catalog_index.refresh", return_value=make_index(*rows)), \
+         patch("lenny.core.api.OpenLibrary.search_ids", return_value=[10, 20]) as mock_ol_search, \
          patch("lenny.core.api.LennyDataProvider.search", return_value=mock_search_response), \
          patch("lenny.core.api.LennyDataProvider.build_catalog", return_value={"catalog": True}) as mock_build:
 
@@ -137,6 +141,20 @@ def test_search_feed_builds_chunked_query():
     assert result == {"catalog": True}
 
 
+def test_search_feed_cache_keeps_query_case():
+    """'a OR b' and 'a or b' differ to Open Library; spacing doesn't."""
+    from lenny.core.api import LennyAPI
+
+    assert LennyAPI.normalize_query("  python   OR\tjava ") == "python OR java"
+    with patch("lenny.core.api.catalog_index.refresh", return_value=make_index((10, False, False))), \
+         patch("lenny.core.api.LennyAPI._search_catalog", return_value={"catalog": True}) as mock_search:
+        LennyAPI.search_feed(query="python OR java", auth_mode_direct=False)
+        LennyAPI.search_feed(query="python  OR java", auth_mode_direct=False)
+        LennyAPI.search_feed(query="python or java", auth_mode_direct=False)
+
+    assert [c.args[1] for c in mock_search.call_args_list] == ["python OR java", "python or java"]
+
+
 # ---------------------------------------------------------------------------
 # Task 5 tests: /opds/search endpoint
 # ---------------------------------------------------------------------------
@@ -151,7 +169,7 @@ def test_opds_search_endpoint_returns_opds_json(test_client):
     assert resp.status_code == 200
     assert "application/opds+json" in resp.headers["content-type"]
     assert resp.json() == mock_feed
-    mock_sf.assert_called_once_with(query="python", auth_mode_direct=False)
+    mock_sf.assert_called_once_with(query="python", auth_mode_direct=False, cursor=None)
 
 
 def test_opds_search_endpoint_empty_query(test_client):
@@ -163,7 +181,7 @@ def test_opds_search_endpoint_empty_query(test_client):
 
     assert resp.status_code == 200
     assert "application/opds+json" in resp.headers["content-type"]
-    mock_sf.assert_called_once_with(query="", auth_mode_direct=False)
+    mock_sf.assert_called_once_with(query="", auth_mode_direct=False, cursor=None)
 
 
 def test_opds_search_no_auth_required(test_client):
@@ -234,11 +252,7 @@ def test_search_flow_end_to_end(test_client):
     mock_item.encrypted = False
     mock_item.is_borrowable = True
 
-    # 2. Mock OL search result matching that item
-    ol_record = MagicMock()
-    ol_record.olid = "999"
-
-    # 3. Build a realistic OPDS feed via build_catalog
+    # 2. Build a realistic OPDS feed via build_catalog
     mock_catalog = {
         "@context": "https://readium.org/webpub-manifest/context.jsonld",
         "metadata": {"title": "Search results for: test"},
@@ -257,10 +271,10 @@ def test_search_flow_end_to_end(test_client):
     mock_search_response = MagicMock()
     mock_search_response.records = [mock_lenny_record]
 
-    with patch("lenny.core.api.Item.get_all",
-               return_value={999: mock_item}), \
-         patch("lenny.core.api.OpenLibrary.search",
-               return_value=[ol_record]) as mock_ol_search, \
+    with patch("lenny.core.api.catalog_index.refresh",
+               return_value=make_index((999, False, False))), \
+         patch("lenny.core.api.OpenLibrary.search_ids",
+               return_value=[999]) as mock_ol_search, \
          patch("lenny.core.api.LennyDataProvider.search",
                return_value=mock_search_response) as mock_provider_search, \
          patch("lenny.core.api.LennyDataProvider.build_catalog",
@@ -320,7 +334,8 @@ def test_opds_catalog_includes_search_link(test_client):
         ],
     }
 
-    with patch("lenny.routes.api.LennyAPI.opds_feed", return_value=mock_catalog):
+    with patch("lenny.routes.api.LennyAPI.opds_feed", return_value=mock_catalog), \
+         patch("lenny.routes.api.LennyAPI.feed_validators", return_value=('"v1"', None)):
         resp = test_client.get("/v1/api/opds")
 
     assert resp.status_code == 200
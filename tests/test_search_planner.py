@@ -0,0 +1,121 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    from lenny.core.metrics import metrics
+    metrics.reset()
+    yield metrics
+    metrics.reset()
+
+
+def make_index(editions):
+    from lenny.core.index import CatalogIndex
+
+    index = CatalogIndex()
+    index.load((edition, True, False) for edition in editions)
+    return index
+
+
+def test_small_catalog_uses_batched_without_probe():
+    from lenny.core.search import SearchPlanner
+
+    planner = SearchPlanner(make_index([10, 20]), batch_size=250, strategy="auto")
+    with patch("lenny.core.search.OpenLibrary.search_json") as probe, \
+         patch("lenny.core.search.OpenLibrary.search_ids", return_value=[20, 99]):
+        assert planner.search("python", 10) == ("batched", [20], None)
+    probe.assert_not_called()
+
+
+def test_selective_query_on_large_catalog_intersects_locally():
+    from lenny.core.search import SearchPlanner
+    from lenny.core.metrics import metrics
+
+    planner = SearchPlanner(make_index(range(1, 10001)), batch_size=250, strategy="auto")
+    page = {"numFound": 2, "docs": [
+        {"key": "/works/OL1W", "edition_key": ["OL20000M", "OL42M"]},
+        {"key": "/works/OL2W", "edition_key": ["OL7M"]},
+    ]}
+    with patch("lenny.core.search.OpenLibrary.search_json", return_value=page) as probe, \
+         patch("lenny.core.search.OpenLibrary.search_ids") as batched:
+        assert planner.search("rare title", 10) == ("intersect", [42, 7], None)
+
+    probe.assert_called_once()
+    batched.assert_not_called()
+    assert metrics.counter("search.plan", strategy="intersect") == 1
+    assert metrics.summary("search.latency", strategy="intersect").count == 1
+
+
+def test_broad_query_with_dense_hits_prefers_batches():
+    from lenny.core.search import SearchPlanner
+
+    planner = SearchPlanner(make_index(range(1, 1001)), batch_size=250, strategy="auto")
+    # 500 works on the first page, none in the catalog, out of 2M
+    costs = planner.estimate(limit=50, num_found=2_000_000, docs=500, hits=0)
+    assert costs["batched"] < costs["intersect"]
+    # Every probed work is local: the probe page alone suffices
+    costs = planner.estimate(limit=50, num_found=2_000_000, docs=500, hits=60)
+    assert costs["intersect"] == 0
+
+
+def test_observed_latency_overrides_prior():
+    from lenny.core.search import SearchPlanner
+    from lenny.core.metrics import metrics
+
+    planner = SearchPlanner(make_index([1]), strategy="auto")
+    assert planner.request_latency("batched") == SearchPlanner.PRIOR_LATENCY["batched"]
+    for _ in range(SearchPlanner.MIN_OBSERVATIONS):
+        metrics.observe("search.request", 2.0, strategy="batched")
+    assert planner.request_latency("batched") == 2.0
+
+
+def test_batched_pages_resume_within_and_across_batches():
+    from lenny.core.search import SearchPlanner
+
+    planner = SearchPlanner(make_index([1, 2, 3, 4, 5]), batch_size=3, strategy="batched")
+    hits = {(1, 2, 3): [3, 1, 2], (4, 5): [5]}
+
+    def search(query, limit):
+        keys = tuple(int(k.strip("OLM")) for k in query.split("edition_key:(")[1].rstrip(")").split(" OR "))
+        return hits[keys]
+
+    with patch("lenny.core.search.OpenLibrary.search_ids", side_effect=search) as ol:
+        _, first, cursor = planner.search("q", 2)
+        assert first == [3, 1] and cursor == {"s": "batched", "at": [1, 2]}
+        _, second, cursor = planner.search("q", 2, cursor=cursor)
+        assert second == [2, 5] and cursor is None
+
+    # Page two refetched only the batch it resumed in, then the next one
+    assert ol.call_count == 3
+
+
+def test_intersect_pages_resume_at_upstream_page():
+    from lenny.core.search import SearchPlanner
+
+    planner = SearchPlanner(make_index([1, 2, 3]), strategy="intersect")
+    planner.PAGE_SIZE = 1
+    pages = {1: {"docs": [{"edition_key": ["OL1M", "OL2M"]}]}, 2: {"docs": [{"edition_key": ["OL3M"]}]}, 3: {"docs": []}}
+
+    with patch("lenny.core.search.OpenLibrary.search_json", side_effect=lambda q, fields, page, limit, profile: pages[page]):
+        _, first, cursor = planner.search("q", 1)
+        assert first == [1] and cursor["at"] == [1, 1]
+        _, second, cursor = planner.search("q", 2, cursor=cursor)
+        assert second == [2, 3] and cursor["at"] == [3, 0]
+
+
+def test_cursor_round_trip_and_validation():
+    from lenny.core.search import encode_cursor, decode_cursor
+
+    cursor = encode_cursor({"s": "batched", "at": [250, 3]}, "python")
+    assert decode_cursor(cursor, "python") == {"s": "batched", "at": [250, 3]}
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, "java")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor", "python")
@@ -0,0 +1,59 @@
+import json
+import pytest
+from unittest.mock import patch
+
+from lenny.core import serialize
+
+
+def _feed(n):
+    return {
+        "metadata": {"title": "Lenny Catalog"},
+        "links": [{"rel": "self", "href": "/v1/api/opds"}],
+        "publications": [{"metadata": {"title": f"Book {i}"}, "links": []} for i in range(n)],
+    }
+
+
+@pytest.mark.parametrize("n", [0, 1, 3])
+def test_iter_feed_matches_json_dumps(n):
+    feed = _feed(n)
+    assert json.loads(b"".join(serialize.iter_feed(feed))) == feed
+    assert json.loads(serialize.encode_feed(feed)) == feed
+
+
+def test_iter_feed_yields_one_chunk_per_publication():
+    chunks = list(serialize.iter_feed(_feed(3)))
+    # envelope, 3 publications, closing brackets
+    assert len(chunks) == 5
+
+
+def test_encode_feed_without_publications():
+    assert json.loads(serialize.encode_feed({"metadata": {"title": "x"}})) == {"metadata": {"title": "x"}}
+    assert json.loads(b"".join(serialize.iter_feed({}))) == {}
+
+
+def test_fragment_reuses_bytes_of_shared_publications():
+    feed = _feed(2)
+    serialize.share(feed)
+    first = serialize.fragment(feed["publications"][0])
+    with patch("lenny.core.serialize.dumps") as mock_dumps:
+        assert serialize.fragment(feed["publications"][0]) is first
+    mock_dumps.assert_not_called()
+
+
+def test_fragment_encodes_unshared_objects_every_time():
+    pub = {"metadata": {"title": "Patron copy"}}
+    assert json.loads(serialize.fragment(pub)) == pub
+    pub["metadata"]["title"] = "Changed"
+    assert json.loads(serialize.fragment(pub)) == pub
+    assert id(pub) not in serialize.FRAGMENTS
+
+
+def test_dumps_falls_back_to_stdlib_json():
+    with patch("lenny.core.serialize.orjson", None):
+        assert serialize.dumps({"a": [1, 2]}) == b'{"a":[1,2]}'
+
+
+def test_should_stream_threshold():
+    assert not serialize.should_stream(_feed(serialize.STREAM_THRESHOLD - 1))
+    assert serialize.should_stream(_feed(serialize.STREAM_THRESHOLD))
+    assert not serialize.should_stream({"metadata": {}})
@@ -0,0 +1,72 @@
+import gzip
+import json
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+pytest.importorskip("sqlalchemy")
+
+
+def edition_line(edition, title, authors=(), languages=(), subjects=()):
+    record = {
+        "key": f"/books/OL{edition}M",
+        "title": title,
+        "authors": [{"key": f"/authors/OL{a}A"} for a in authors],
+        "languages": [{"key": f"/languages/{l}"} for l in languages],
+        "subjects": list(subjects),
+    }
+    return f"/type/edition\t/books/OL{edition}M\t3\t2024-01-01T00:00:00\t{json.dumps(record)}\n"
+
+
+def test_scan_parses_only_wanted_records():
+    from lenny.core.snapshot import scan, BOOKS
+
+    lines = [
+        edition_line(1, "Moby Dick"),
+        edition_line(2, "Not in the catalog"),
+        "/type/edition\t/books/OL3M\t1\t2024-01-01\t{broken\n",
+        json.dumps({"key": "/books/OL4M", "title": "Middlemarch"}) + "\n",
+        "/type/work\t/works/OL1W\t1\t2024-01-01\t{}\n",
+        "garbage\n",
+    ]
+    with patch("lenny.core.snapshot.json.loads", wraps=json.loads) as loads:
+        found = list(scan(lines, BOOKS, {1, 3, 4}))
+    assert [(id, record["title"]) for id, record in found] == [(1, "Moby Dick"), (4, "Middlemarch")]
+    # Edition 2's record was skipped without being parsed
+    assert loads.call_count == 3
+
+
+def test_import_editions_and_authors(db_session, tmp_path):
+    from lenny.core.models import Item, Edition, ItemFacet, FormatEnum
+    from lenny.core.snapshot import SnapshotImporter, open_dump
+
+    db_session.add(Item(id=1, openlibrary_edition=1, encrypted=False, formats=FormatEnum.EPUB))
+    db_session.add(Item(id=2, openlibrary_edition=4, encrypted=False, formats=FormatEnum.EPUB))
+    Edition.upsert(4, "Old title", ["Kept Author"])
+    db_session.commit()
+
+    editions = tmp_path / "editions.txt.gz"
+    with gzip.open(editions, "wt") as dump:
+        dump.write(edition_line(1, "Moby Dick", authors=[7], languages=["eng"], subjects=["Whales"]))
+        dump.write(edition_line(2, "Elsewhere", authors=[8]))
+        dump.write(edition_line(4, "Middlemarch"))
+    authors = tmp_path / "authors.txt"
+    authors.write_text(
+        f"/type/author\t/authors/OL7A\t1\t2024-01-01\t{json.dumps({'key': '/authors/OL7A', 'name': 'Herman Melville'})}\n"
+        f"/type/author\t/authors/OL8A\t1\t2024-01-01\t{json.dumps({'key': '/authors/OL8A', 'name': 'Nobody'})}\n"
+    )
+
+    importer = SnapshotImporter(Item.edition_ids(), batch_size=1)
+    assert importer.wanted == {1, 4}
+    with open_dump(editions) as lines:
+        assert importer.import_editions(lines) == 2
+    with open_dump(authors) as lines:
+        assert importer.import_authors(lines) == 1
+
+    rows = {e.openlibrary_edition: (e.title, e.authors) for e in db_session.query(Edition)}
+    assert rows == {1: ("Moby Dick", ["Herman Melville"]), 4: ("Middlemarch", ["Kept Author"])}
+    facets = {(f.item_id, f.facet, f.value) for f in db_session.query(ItemFacet)}
+    assert facets == {(1, "language", "eng"), (1, "subject", "Whales")}
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+httpx = pytest.importorskip("httpx")
+
+
+def serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+@pytest.fixture
+def upstream():
+    """A fake upstream echoing the path and body of each request."""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def _echo(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode() if length else ""
+            requests.append((self.command, self.path))
+            content = json.dumps({"path": self.path, "body": body}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = _echo
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    yield serve(server), requests
+    server.shutdown()
+    server.server_close()
+
+
+def run(standin):
+    server = standin.server(port=0)
+    return server, serve(server)
+
+
+def test_record_then_replay_offline(upstream, tmp_path):
+    from lenny.core.standin import StandIn, RECORD
+
+    url, requests = upstream
+    recorder, base = run(StandIn(tmp_path, mode=RECORD, upstreams={"openlibrary": url, "otp": url}))
+    try:
+        assert httpx.get(f"{base}/openlibrary/search.json?q=moby&limit=2").json()["path"] == "/search.json?q=moby&limit=2"
+        assert httpx.post(f"{base}/otp/account/otp/issue", data={"email": "a@b.c"}).json()["body"] == "email=a%40b.c"
+    finally:
+        recorder.shutdown()
+        recorder.server_close()
+    assert len(requests) == 2
+
+    replayer, base = run(StandIn(tmp_path, upstreams={"openlibrary": "http://unreachable.invalid"}))
+    try:
+        # Query order doesn't matter; nothing reaches the upstream
+        assert httpx.get(f"{base}/openlibrary/search.json?limit=2&q=moby").json()["path"] == "/search.json?q=moby&limit=2"
+        assert httpx.post(f"{base}/otp/account/otp/issue", data={"email": "a@b.c"}).status_code == 200
+        assert httpx.post(f"{base}/otp/account/otp/issue", data={"email": "x@y.z"}).status_code == 404
+        assert httpx.get(f"{base}/elsewhere/").status_code == 404
+    finally:
+        replayer.shutdown()
+        replayer.server_close()
+    assert len(requests) == 2
+
+
+def test_injected_errors_and_latency(tmp_path):
+    import time
+    from lenny.core.standin import StandIn
+
+    standin = StandIn(tmp_path, latency=0.05, error_rate=1.0)
+    start = time.monotonic()
+    status, _, body = standin.handle("GET", "/openlibrary/search.json?q=moby", {})
+    assert status == 503 and json.loads(body)["error"] == "Injected failure"
+    assert time.monotonic() - start >= 0.05
+
+    # Seeded, so an experiment can be repeated exactly
+    runs = []
+    for _ in range(2):
+        standin = StandIn(tmp_path, error_rate=0.5, seed=7)
+        runs.append([standin.handle("GET", "/otp/x", {})[0] for _ in range(20)])
+    assert runs[0] == runs[1] and {503, 404} == set(runs[0])
+
+
+def test_redirect_sends_library_requests_to_the_standin(upstream, tmp_path):
+    """Requests to the real upstreams, from code whose URLs Lenny
+    doesn't configure, reach the stand-in instead."""
+    requests = pytest.importorskip("requests")
+    from lenny.core.standin import StandIn, RECORD, redirect
+
+    url, received = upstream
+    send = requests.Session.request
+    recorder, base = run(StandIn(tmp_path, mode=RECORD, upstreams={"openlibrary": url}))
+    undo = redirect(base)
+    try:
+        assert requests.get("https://openlibrary.org/search.json", params={"q": "moby"}).json()["path"] == "/search.json?q=moby"
+        assert httpx.get("https://openlibrary.org/search.json?q=whale").json()["path"] == "/search.json?q=whale"
+        with httpx.Client() as client:
+            assert client.build_request("GET", "https://openlibrary.org.example/x").url.host == "openlibrary.org.example"
+    finally:
+        undo()
+        recorder.shutdown()
+        recorder.server_close()
+    assert received == [("GET", "/search.json?q=moby"), ("GET", "/search.json?q=whale")]
+
+    assert requests.Session.request is send
+    with httpx.Client() as client:
+        assert client.build_request("GET", "https://openlibrary.org/x").url.host == "openlibrary.org"